@@ -3,8 +3,8 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_sslify import SSLify
 from flask_uploads import configure_uploads, UploadSet
-from flask_oauthlib.client import OAuth
 from flask_login import LoginManager
+from app.cache import FragmentCache, TTLCache
 
 app = Flask(__name__)
 app.config.from_object('config')
@@ -15,9 +15,38 @@ login_manager = LoginManager(app)
 uploads = UploadSet('uploads', ('zip'))
 configure_uploads(app, (uploads,))
 
-context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-context.load_cert_chain("ssl/cert.pem", "ssl/key.pem")
 
-oauth = OAuth(app)
+def ssl_context():
+    """ SSLContext for serving HTTPS directly from the development server
 
-from app import views, models
+    Built on demand so that importing the app (eg. in WSGI workers behind a
+    TLS terminating proxy, or in scripts) doesn't need the certificates.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    context.load_cert_chain(app.config['SSL_CERT_FILE'],
+                            app.config['SSL_KEY_FILE'])
+    return context
+
+
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_MAX_BYTES'])
+# logged in users, by id, see views.load_user. Code that writes to the user
+# table without the ORM (which invalidates it on update) must invalidate it
+user_cache = TTLCache(app.config['USER_CACHE_TTL'])
+
+
+def create_app():
+    """ The app with its views, API and request hooks registered
+
+    Importing the package only sets up the app, the db and the models, which
+    is all that scripts like db_create.py need. The views pull in the forms,
+    tables, vendor and export code, so they are only loaded here, once, by
+    the servers (run.py, wsgi.py).
+    """
+    from app import views, api, images, instrumentation, profiling
+    return app
+
+
+# search and where_used keep the full text and where-used indexes in sync
+# with the parts, so they are loaded with the models wherever they are
+# written to
+from app import models, search, where_used
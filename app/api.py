@@ -0,0 +1,400 @@
+import os
+from datetime import date, datetime
+
+from flask import request, jsonify, g
+from flask_login import login_required
+from flask_uploads import UploadNotAllowed
+
+from app import app, db, uploads
+from .ingest import ArchiveUpload, ingest_archives
+from .models import (BillOfMaterials, BOMPart, BOMRevision, Order,
+                     Order_VendorPart, Part, PriceHistory)
+from .revisions import refresh_revision, diff_revisions
+from .utils import reference_sort_key
+from .where_used import where_used, touch_boms
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 5000
+
+
+class APIError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _to_json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class Serializer:
+    """ Column-level serializer for a model
+
+    Queries only the requested columns and builds plain dicts from the
+    returned tuples, so no ORM objects are created when listing rows.
+
+    Args:
+        fields: a dict mapping output field names to column expressions
+        writable: the field names that may be set through the API, mapped to
+            a function that converts the incoming JSON value
+        not_null: the writable fields that may not be set to null
+    """
+
+    def __init__(self, fields: dict, writable: dict = None,
+                 not_null: tuple = ()):
+        self.fields = fields
+        self.writable = writable or {}
+        self.not_null = set(not_null)
+
+    def select(self, fields_arg: str = None):
+        """ Parse a comma-separated field list into known field names """
+        if not fields_arg:
+            return list(self.fields)
+        names = [name.strip() for name in fields_arg.split(',') if name]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise APIError('Unknown field(s): ' + ', '.join(unknown))
+        return names
+
+    def query(self, names):
+        return db.session.query(*[self.fields[name] for name in names])
+
+    @staticmethod
+    def rows(query, names):
+        return [{name: _to_json(value) for name, value in zip(names, row)}
+                for row in query]
+
+    def apply(self, obj, data: dict):
+        """ Set writable fields from JSON data on an ORM object """
+        for name, value in data.items():
+            if name not in self.writable:
+                raise APIError('Field {} is not writable'.format(name))
+            if value is None and name in self.not_null:
+                raise APIError('Field {} may not be null'.format(name))
+            if value is not None:
+                value = self.writable[name](value)
+            setattr(obj, self.fields[name].key, value)
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _bool(value):
+    if not isinstance(value, bool):
+        raise ValueError('Expected true or false, got {!r}'.format(value))
+    return value
+
+
+def _int(value):
+    # bool is a subclass of int
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError('Expected an integer, got {!r}'.format(value))
+    return value
+
+
+bom_serializer = Serializer(
+    {'id': BillOfMaterials.id,
+     'name': BillOfMaterials.name,
+     'version': BillOfMaterials.version,
+     'timestamp': BillOfMaterials.timestamp,
+     'content_version': BillOfMaterials.content_version,
+     'user_id': BillOfMaterials.user_id},
+    writable={'name': str, 'version': str})
+
+bompart_serializer = Serializer(
+    {'id': BOMPart.id,
+     'reference': BOMPart.reference,
+     'lookup_source': BOMPart.lookup_source,
+     'lookup_id': BOMPart.lookup_id,
+     'bom_id': BOMPart.bom_id,
+     'part_id': BOMPart.part_id},
+    writable={'reference': str, 'lookup_source': str, 'lookup_id': str})
+
+order_serializer = Serializer(
+    {'id': Order.id,
+     'order_name': Order.order_name,
+     'description': Order.description,
+     'archived': Order.archived,
+     'delivery_date': Order.delivery_date,
+     'cost_object': Order.cost_object,
+     'requestor_name': Order.requestor_name,
+     'requestor_phone': Order.requestor_phone,
+     'supervisor_name': Order.supervisor_name,
+     'timestamp': Order.timestamp,
+     'user_id': Order.user_id},
+    writable={'order_name': str,
+              'description': str,
+              'archived': _bool,
+              'delivery_date': _date,
+              'cost_object': str,
+              'requestor_name': str,
+              'requestor_phone': str,
+              'supervisor_name': str},
+    not_null=('archived',))
+
+order_vendorpart_serializer = Serializer(
+    {'id': Order_VendorPart.id,
+     'order_id': Order_VendorPart.order_id,
+     'vendorpart_id': Order_VendorPart.vendorpart_id,
+     'number_used': Order_VendorPart.number_used,
+     'number_ordered': Order_VendorPart.number_ordered},
+    writable={'number_ordered': _int},
+    not_null=('number_ordered',))
+
+part_serializer = Serializer(
+    {'id': Part.id,
+     'manufacturer': Part.manufacturer,
+     'manufacturer_part_number': Part.manufacturer_part_number,
+     'short_description': Part.short_description,
+     'image_url': Part.image_url},
+    writable={'short_description': str})
+
+revision_serializer = Serializer(
+    {'id': BOMRevision.id,
+     'bom_id': BOMRevision.bom_id,
+     'project': BOMRevision.project,
+     'number': BOMRevision.number,
+     'parent_id': BOMRevision.parent_id,
+     'entries': BOMRevision.entries,
+     'digest': BOMRevision.digest})
+
+price_history_serializer = Serializer(
+    {'id': PriceHistory.id,
+     'part_id': PriceHistory.part_id,
+     'vendor': PriceHistory.vendor,
+     'vendor_part_number': PriceHistory.vendor_part_number,
+     'timestamp': PriceHistory.timestamp,
+     'unit_price': PriceHistory.unit_price,
+     'price_breaks': PriceHistory.price_breaks})
+
+
+def _paginate(serializer, filter_=None, order_by=None):
+    names = serializer.select(request.args.get('fields'))
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise APIError('page and per_page must be integers')
+    if page < 1 or not 0 < per_page <= MAX_PAGE_SIZE:
+        raise APIError('page must be >= 1 and per_page in [1, {}]'
+                       .format(MAX_PAGE_SIZE))
+    query = serializer.query(names)
+    if filter_ is not None:
+        query = query.filter(filter_)
+    total = query.order_by(None).count()
+    order_by = order_by if order_by is not None else serializer.fields['id']
+    query = query.order_by(order_by).limit(per_page).offset((page-1)*per_page)
+    return jsonify(items=serializer.rows(query, names),
+                   page=page,
+                   per_page=per_page,
+                   total=total)
+
+
+def _detail(serializer, id_):
+    names = serializer.select(request.args.get('fields'))
+    query = serializer.query(names).filter(serializer.fields['id'] == id_)
+    rows = serializer.rows(query, names)
+    if not rows:
+        raise APIError('Not found', status=404)
+    return jsonify(rows[0])
+
+
+def _update(serializer, model, id_, commit=True):
+    obj = model.query.get(id_)
+    if obj is None:
+        raise APIError('Not found', status=404)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise APIError('Expected a JSON object')
+    try:
+        serializer.apply(obj, data)
+    except (TypeError, ValueError) as e:
+        raise APIError(str(e))
+    if commit:
+        db.session.commit()
+    return obj
+
+
+@app.errorhandler(APIError)
+def api_error(error):
+    response = jsonify(error=error.message)
+    response.status_code = error.status
+    return response
+
+
+@app.route('/api/boms', methods=['GET'])
+@login_required
+def api_boms():
+    return _paginate(bom_serializer)
+
+
+@app.route('/api/boms/bulk', methods=['POST'])
+@login_required
+def api_boms_bulk():
+    """ Upload many KiCAD archives at once
+
+    Expects the archives as multipart 'files'. The BOM name defaults to the
+    archive's file name, and the version to the 'version' form field.
+    """
+    files = request.files.getlist('files')
+    if not files:
+        raise APIError('No archives uploaded')
+    version = request.form.get('version', '')
+    # check every file first, so a rejected batch leaves nothing behind
+    for file_ in files:
+        if not uploads.file_allowed(file_, os.path.basename(file_.filename)):
+            raise APIError('{} is not a zip archive'.format(file_.filename))
+    archives = []
+    for file_ in files:
+        name = os.path.splitext(os.path.basename(file_.filename))[0]
+        try:
+            filename = uploads.save(file_)
+        except UploadNotAllowed:
+            raise APIError('{} is not a zip archive'.format(file_.filename))
+        archives.append(ArchiveUpload(uploads.path(filename), name, version))
+    ingest_archives(archives, g.user)
+    return jsonify(archives=[archive.to_dict() for archive in archives])
+
+
+@app.route('/api/boms/<int:id_>', methods=['GET', 'PATCH'])
+@login_required
+def api_bom(id_):
+    if request.method == 'PATCH':
+        _update(bom_serializer, BillOfMaterials, id_)
+    return _detail(bom_serializer, id_)
+
+
+@app.route('/api/boms/<int:id_>/parts', methods=['GET', 'POST'])
+@login_required
+def api_bom_parts(id_):
+    if request.method == 'POST':
+        bom = BillOfMaterials.query.get(id_)
+        if bom is None:
+            raise APIError('Not found', status=404)
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not data.get('reference'):
+            raise APIError('Expected a JSON object with a reference')
+        bompart = BOMPart()
+        bompart_serializer.apply(bompart, data)
+        bompart.reference_sort_key = reference_sort_key(bompart.reference)
+        bompart.bom = bom
+        bom.content_version = (bom.content_version or 0) + 1
+        db.session.add(bompart)
+        db.session.commit()
+        refresh_revision(bom)
+        db.session.commit()
+        response = _detail(bompart_serializer, bompart.id)
+        response.status_code = 201
+        return response
+    return _paginate(bompart_serializer,
+                     filter_=BOMPart.bom_id == id_,
+                     order_by=BOMPart.reference_sort_key)
+
+
+def _revision(bom_id):
+    """ The revision of a BOM, a 404 if there is no such BOM or it was
+    never recorded as a revision
+    """
+    bom = BillOfMaterials.query.get(bom_id)
+    if bom is None:
+        raise APIError('BOM {} not found'.format(bom_id), status=404)
+    if bom.revision is None:
+        raise APIError('BOM {} has no revision'.format(bom_id), status=404)
+    return bom.revision
+
+
+@app.route('/api/boms/<int:id_>/revisions', methods=['GET'])
+@login_required
+def api_bom_revisions(id_):
+    """ All revisions of the project of a BOM """
+    return _paginate(revision_serializer,
+                     filter_=BOMRevision.project == _revision(id_).project,
+                     order_by=BOMRevision.number)
+
+
+@app.route('/api/boms/<int:id_>/diff', methods=['GET'])
+@login_required
+def api_bom_diff(id_):
+    """ Differences to a BOM from its parent revision, or from the BOM given
+    by ?against=
+    """
+    revision = _revision(id_)
+    against = request.args.get('against', type=int)
+    if against is not None:
+        old = _revision(against)
+    else:
+        old = revision.parent
+    if old is None:
+        raise APIError('BOM {} is the first revision of its project, give '
+                       'a BOM to compare with as against'.format(id_))
+    diff = diff_revisions(old, revision)
+    diff.update(from_bom_id=old.bom_id, to_bom_id=id_)
+    return jsonify(diff)
+
+
+@app.route('/api/orders', methods=['GET'])
+@login_required
+def api_orders():
+    return _paginate(order_serializer)
+
+
+@app.route('/api/orders/<int:id_>', methods=['GET', 'PATCH'])
+@login_required
+def api_order(id_):
+    if request.method == 'PATCH':
+        _update(order_serializer, Order, id_)
+    return _detail(order_serializer, id_)
+
+
+@app.route('/api/orders/<int:id_>/parts', methods=['GET'])
+@login_required
+def api_order_parts(id_):
+    return _paginate(order_vendorpart_serializer,
+                     filter_=Order_VendorPart.order_id == id_)
+
+
+@app.route('/api/order_parts/<int:id_>', methods=['GET', 'PATCH'])
+@login_required
+def api_order_part(id_):
+    if request.method == 'PATCH':
+        _update(order_vendorpart_serializer, Order_VendorPart, id_)
+    return _detail(order_vendorpart_serializer, id_)
+
+
+@app.route('/api/parts', methods=['GET'])
+@login_required
+def api_parts():
+    return _paginate(part_serializer)
+
+
+@app.route('/api/parts/<int:id_>', methods=['GET', 'PATCH'])
+@login_required
+def api_part(id_):
+    if request.method == 'PATCH':
+        _update(part_serializer, Part, id_, commit=False)
+        # Part descriptions appear in the cached condensed BOM tables
+        touch_boms(db.session.connection(), [id_])
+        db.session.commit()
+    return _detail(part_serializer, id_)
+
+
+@app.route('/api/parts/<int:id_>/price_history', methods=['GET'])
+@login_required
+def api_part_price_history(id_):
+    return _paginate(price_history_serializer,
+                     filter_=PriceHistory.part_id == id_,
+                     order_by=PriceHistory.timestamp)
+
+
+@app.route('/api/parts/<int:id_>/where_used', methods=['GET'])
+@login_required
+def api_part_where_used(id_):
+    """ The BOMs and open orders using a part, from the where-used index """
+    if db.session.query(Part.id).filter(Part.id == id_).first() is None:
+        raise APIError('Not found', status=404)
+    used = where_used([id_])[id_]
+    return jsonify(part_id=id_, boms=used['boms'], orders=used['orders'])
@@ -0,0 +1,172 @@
+""" asyncio based vendor lookups
+
+The engine only needs explicit credentials (no Flask request context), and
+runs many lookups concurrently on a single thread. fetch_parts is a blocking
+facade for use from the Flask views and from CLI scripts.
+
+aiohttp is imported on first use, so importing the app (and vendor_fetch)
+doesn't pay for it unless parts are actually fetched.
+"""
+import time
+import asyncio
+from collections import namedtuple
+from urllib.parse import quote_plus
+
+from app import app
+
+# access_token may be a string or a callable returning the current token,
+# eg. a TokenManager bound to a user, so long runs survive token expiry.
+Credentials = namedtuple('Credentials', ('client_id', 'access_token'))
+
+_headers = {
+    'accept': "*/*",
+    'X-DIGIKEY-Locale-Language': 'en',
+    'X-DIGIKEY-Locale-Site': 'us',
+    'X-DIGIKEY-Locale-Currency': 'usd',
+    'X-DIGIKEY-Locale-ShipToCountry': 'us',
+    'content-type': "application/json",
+    }
+
+
+class LookupFailed(Exception):
+    pass
+
+
+class FetchStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.elapsed = 0.0
+
+    def to_dict(self):
+        return {'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'elapsed_s': self.elapsed}
+
+
+class DigikeyFetchEngine:
+    """ Concurrent Digikey part lookups
+
+    Args:
+        credentials: Credentials for the Digikey API
+        base_url: the API base url, eg. to point at a stub server
+        concurrency: maximum number of requests in flight
+        timeout: seconds allowed per request
+        retries: extra attempts for throttled (429) or failing (5xx) requests
+    """
+    vendor = 'Digikey'
+
+    def __init__(self, credentials, base_url=None, concurrency=None,
+                 timeout=None, retries=2):
+        self.credentials = credentials
+        self.base_url = base_url or app.config['DIGIKEY_BASE_URL']
+        self.concurrency = concurrency or app.config['FETCH_CONCURRENCY']
+        self.timeout = timeout or app.config['FETCH_TIMEOUT']
+        self.retries = retries
+        self.stats = FetchStats()
+
+    async def _token(self):
+        token = self.credentials.access_token
+        if callable(token):
+            # may block on a refresh, so keep it off the event loop
+            loop = asyncio.get_event_loop()
+            token = await loop.run_in_executor(None, token)
+        return token
+
+    async def lookup(self, session, semaphore, vendor_part_number):
+        """ Look up a single vendor part number
+
+        Returns:
+            the raw part dict, with 'vendor' and 'vendor_part_number' added
+        Raises:
+            LookupFailed
+        """
+        import aiohttp
+        data = {'PartNumber': quote_plus(vendor_part_number),
+                'Quantity': 1,
+                'PartPreference': 'CT'}
+        url = self.base_url + 'search'
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                headers = dict(_headers)
+                headers['x-ibm-client-id'] = self.credentials.client_id
+                headers['Authorization'] = 'Bearer ' + await self._token()
+                self.stats.requests += 1
+                retryable = True
+                try:
+                    async with session.post(url, json=data,
+                                            headers=headers) as resp:
+                        if resp.status == 200:
+                            payload = await resp.json(content_type=None)
+                            break
+                        error = 'API returned {}'.format(resp.status)
+                        retryable = resp.status == 429 or resp.status >= 500
+                except (aiohttp.ClientError, asyncio.TimeoutError,
+                        ValueError) as e:
+                    error = '{}: {}'.format(type(e).__name__, e)
+                if not retryable or attempt == self.retries:
+                    self.stats.failures += 1
+                    raise LookupFailed('Error Looking up part {}! {}'
+                                       .format(vendor_part_number, error))
+                self.stats.retries += 1
+                await asyncio.sleep(0.5 * 2**attempt)
+        try:
+            part_raw = payload['Parts'][0]
+        except (KeyError, IndexError, TypeError):
+            self.stats.failures += 1
+            raise LookupFailed('Error Looking up part {}! No match found'
+                               .format(vendor_part_number))
+        part_raw['vendor'] = self.vendor
+        part_raw['vendor_part_number'] = vendor_part_number
+        return part_raw
+
+    async def fetch_many(self, vendor_part_numbers):
+        """ Look up many vendor part numbers concurrently
+
+        Returns:
+            A dict mapping each vendor part number to its raw part dict, or
+            to a LookupFailed if the lookup did not succeed.
+        """
+        import aiohttp
+        vendor_part_numbers = list(dict.fromkeys(vendor_part_numbers))
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=timeout) as session:
+            results = await asyncio.gather(
+                *[self.lookup(session, semaphore, vpn)
+                  for vpn in vendor_part_numbers],
+                return_exceptions=True)
+        self.stats.elapsed += time.perf_counter() - start
+        fetched = {}
+        for vpn, result in zip(vendor_part_numbers, results):
+            if isinstance(result, Exception) and \
+                    not isinstance(result, LookupFailed):
+                self.stats.failures += 1
+                result = LookupFailed('Error Looking up part {}! {}'
+                                      .format(vpn, result))
+            fetched[vpn] = result
+        return fetched
+
+
+def fetch_parts(vendor_part_numbers, credentials, **kwargs):
+    """ Blocking facade around DigikeyFetchEngine.fetch_many
+
+    Runs the lookups on a private event loop, so it can be called from a
+    Flask view or a script. Extra keyword arguments go to the engine.
+
+    Returns:
+        A tuple of (results, stats) as for fetch_many and FetchStats
+    """
+    engine = DigikeyFetchEngine(credentials, **kwargs)
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(
+            engine.fetch_many(vendor_part_numbers))
+    finally:
+        loop.close()
+    return results, engine.stats
@@ -0,0 +1,165 @@
+""" Squashed baseline schema for new databases
+
+db_repository/baseline.sql holds the complete schema as of one migration
+version, as plain SQLite DDL. A new database is created by running it and
+stamping migrate_version with that version, instead of replaying every
+script in db_repository/versions. Migrations added after the baseline still
+upgrade such a database, and older databases keep upgrading through the
+versions one by one, so none of the scripts can be removed yet.
+
+For benchmarks and tests, clone_database() copies a template database built
+once from the baseline, which gives a fresh schema in a few milliseconds.
+
+The baseline is generated from the models with write_baseline(), which
+db_migrate.py calls after every new migration. db_baseline.py checks that
+it is up to date.
+"""
+import os
+import re
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import configparser
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+from config import SQLALCHEMY_DATABASE_URI, SQLALCHEMY_MIGRATE_REPO
+
+BASELINE_PATH = os.path.join(SQLALCHEMY_MIGRATE_REPO, 'baseline.sql')
+_version_regex = re.compile(r'^-- version: (\d+)$', flags=re.MULTILINE)
+_script_regex = re.compile(r'^(\d+)_.*\.py$')
+
+
+def latest_version():
+    """ Number of the newest script in db_repository/versions """
+    versions = [int(m.group(1)) for m in
+                map(_script_regex.match,
+                    os.listdir(os.path.join(SQLALCHEMY_MIGRATE_REPO,
+                                            'versions')))
+                if m]
+    return max(versions, default=0)
+
+
+def dump_schema():
+    """ The DDL of a database created from the models
+
+    Sorted by table, each followed by its indexes, since create_all doesn't
+    order unrelated tables the same way every time. The shadow tables of
+    virtual tables (the FTS index) are left out, since creating the virtual
+    table creates them.
+    """
+    from app import db, search  # search adds the index to create_all
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(bind=engine)
+    rows = engine.execute("SELECT name, sql FROM sqlite_master "
+                          "WHERE sql IS NOT NULL "
+                          "AND name NOT LIKE 'sqlite_%' "
+                          "ORDER BY tbl_name, type != 'table', name"
+                          ).fetchall()
+    virtual = {name for name, sql in rows
+               if sql.startswith('CREATE VIRTUAL TABLE')}
+    return [sql for name, sql in rows
+            if name in virtual or
+            not any(name.startswith(v + '_') for v in virtual)]
+
+
+def render_baseline(version):
+    header = ('-- Baseline schema, generated from the models by '
+              'app/baseline.py.\n'
+              '-- Do not edit, regenerate it with db_baseline.py --write.\n'
+              '-- version: {}\n\n'.format(version))
+    statements = ['\n'.join(line.rstrip() for line in sql.splitlines())
+                  for sql in dump_schema()]
+    return header + ''.join(sql + ';\n\n' for sql in statements)
+
+
+def write_baseline(path=BASELINE_PATH, version=None):
+    """ Regenerate the baseline at version (the newest migration) """
+    if version is None:
+        version = latest_version()
+    with open(path, 'w') as f:
+        f.write(render_baseline(version))
+    return version
+
+
+def read_baseline(path=BASELINE_PATH):
+    """
+    Returns:
+        The version and the SQL script of the baseline
+    """
+    with open(path) as f:
+        script = f.read()
+    return int(_version_regex.search(script).group(1)), script
+
+
+def sqlite_path(uri=SQLALCHEMY_DATABASE_URI):
+    """ The file of an SQLite database uri, None for any other database """
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite' or not url.database:
+        return None
+    return url.database
+
+
+def _stamp(connection, version):
+    """ Put the database under version control at version, like
+    migrate.versioning.api.version_control
+    """
+    cfg = configparser.ConfigParser()
+    cfg.read(os.path.join(SQLALCHEMY_MIGRATE_REPO, 'migrate.cfg'))
+    settings = cfg['db_settings']
+    table = settings.get('version_table', 'migrate_version')
+    connection.execute('CREATE TABLE {} ('
+                       'repository_id VARCHAR(250) NOT NULL, '
+                       'repository_path TEXT, version INTEGER, '
+                       'PRIMARY KEY (repository_id))'.format(table))
+    connection.execute('INSERT INTO {} VALUES (?, ?, ?)'.format(table),
+                       (settings['repository_id'], SQLALCHEMY_MIGRATE_REPO,
+                        version))
+
+
+def create_database(path, baseline=BASELINE_PATH):
+    """ Create a new SQLite database at path from the baseline
+
+    Returns:
+        The migration version the database was stamped with
+    """
+    if os.path.exists(path) and os.path.getsize(path):
+        raise FileExistsError('{} already exists'.format(path))
+    version, script = read_baseline(baseline)
+    connection = sqlite3.connect(path)
+    try:
+        connection.executescript(script)
+        _stamp(connection, version)
+        connection.commit()
+    finally:
+        connection.close()
+    return version
+
+
+def template_path(baseline=BASELINE_PATH):
+    """ Template database for the current baseline, built on first use """
+    with open(baseline, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:12]
+    path = os.path.join(tempfile.gettempdir(),
+                        'bom_baseline_{}.db'.format(digest))
+    if not os.path.exists(path):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        create_database(tmp, baseline)
+        os.replace(tmp, path)
+    return path
+
+
+def clone_database(path, baseline=BASELINE_PATH):
+    """ Replace the database at path with a copy of the template
+
+    Close all connections to it first (db.session.remove() and
+    db.engine.dispose()).
+    """
+    for suffix in ('-journal', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.copyfile(template_path(baseline), path)
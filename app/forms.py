@@ -1,7 +1,7 @@
 from flask_wtf import Form
 from wtforms import (FileField, StringField, SubmitField, SelectMultipleField,
-                     PasswordField, BooleanField)
-from wtforms.validators import DataRequired, Email
+                     PasswordField, BooleanField, IntegerField)
+from wtforms.validators import DataRequired, Email, Optional
 
 
 class UploadForm(Form):
@@ -25,8 +25,9 @@ class LoginForm(Form):
 class PartSearchForm(Form):
     manufacturer = SelectMultipleField('Manufacturer',
                                        validators=[DataRequired()])
-    manufacturer_part_number = StringField('Manufacturer Part Number',
-                                           validators=[DataRequired()])
+    query = StringField('Part # or Description', validators=[Optional()])
+    fuzzy = BooleanField('Fuzzy Matching', default=True)
+    page = IntegerField('Page', default=1)
     submit = SubmitField('Search!')
 
 
@@ -2,11 +2,9 @@ import io
 import urllib
 import zipfile
 import datetime
+from collections import defaultdict
 
-import openpyxl
-from openpyxl.writer.excel import save_virtual_workbook
-
-from .vendor_fetch import vendors
+from .vendor_fetch import form_info
 from .utils import chunks, sanitize_filename
 
 
@@ -20,6 +18,7 @@ class UNLRequisition:
         """
         Fetches an blank requisition form from the physics website
         """
+        import openpyxl  # slow to import, and only needed here
         global _blank_form_raw
         blank_req_url = "http://www.unl.edu/physics/docs/Requisition2014.xlsx"
         if self._blank_form_raw is None:
@@ -27,15 +26,15 @@ class UNLRequisition:
         bio = io.BytesIO(self._blank_form_raw)
         self.workbook = openpyxl.load_workbook(bio)
 
-    def populate_misc_fields(self, vendor):
+    def populate_misc_fields(self, form_info):
         ws = self.workbook.active
-        ws['B11'] = vendor.form_info['long_name']
-        ws['B13'] = vendor.form_info['addr_line1']
-        ws['B16'] = vendor.form_info['addr_line2']
+        ws['B11'] = form_info['long_name']
+        ws['B13'] = form_info['addr_line1']
+        ws['B16'] = form_info['addr_line2']
         ws['B18'] = self.order.description
-        ws['B22'] = vendor.form_info['phone']
-        ws['F22'] = vendor.form_info['fax']
-        ws['B26'] = vendor.form_info['website']
+        ws['B22'] = form_info['phone']
+        ws['F22'] = form_info['fax']
+        ws['B26'] = form_info['website']
         ws['E28'] = str(self.order.delivery_date)
         ws['D43'] = self.order.cost_object
         ws['B45'] = datetime.date.today().strftime("%b. %d, %Y")
@@ -63,20 +62,26 @@ class UNLRequisition:
     def get_form(self):
         """
         Creates a zip file containing the one or more xlsx formatted
-        requisitions as required by UNL Physics purchasing. Creates the file
-        in memory and then returns it as bytes.
+        requisitions as required by UNL Physics purchasing, with separate
+        forms for every vendor of the order. Creates the file in memory and
+        then returns it as bytes.
         """
-        parts_chunked = chunks(self.order.vendorparts, 10)
+        from openpyxl.writer.excel import save_virtual_workbook
+        by_vendor = defaultdict(list)
+        for part in self.order.vendorparts:
+            by_vendor[part.vendorpart.vendor].append(part)
         bio = io.BytesIO()
         zf = zipfile.ZipFile(bio, 'x')
-        for i, parts_chunk in enumerate(parts_chunked):
-            self.fetch_empty_form()
-            self.populate_parts(parts_chunk)
-            self.populate_misc_fields(vendors['Digikey'])
-            self.place_sheet_number(i+1, len(parts_chunked))
-
-            fname = "digikey_req{:02d}.xlsx".format(i+1)
-            zf.writestr(fname, save_virtual_workbook(self.workbook))
+        for vendor in sorted(by_vendor):
+            parts_chunked = chunks(by_vendor[vendor], 10)
+            for i, parts_chunk in enumerate(parts_chunked):
+                self.fetch_empty_form()
+                self.populate_parts(parts_chunk)
+                self.populate_misc_fields(form_info(vendor))
+                self.place_sheet_number(i+1, len(parts_chunked))
+
+                fname = "{}_req{:02d}.xlsx".format(vendor.lower(), i+1)
+                zf.writestr(fname, save_virtual_workbook(self.workbook))
         zf.close()
         bio.seek(0)
         fname = sanitize_filename(self.order.order_name, "zip")
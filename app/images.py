@@ -0,0 +1,142 @@
+""" Local cache for part images
+
+Part images are downloaded once, stored under IMAGE_CACHE_DIR by the sha256
+of their contents, and resized to the sizes in IMAGE_THUMBNAIL_SIZES. Since
+the files are content addressed they never change and can be served with
+long-lived cache headers. Thumbnails require Pillow; without it the original
+image is served for every size.
+"""
+import io
+import os
+import hashlib
+import logging
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import send_file, url_for
+from flask.helpers import NotFound
+
+from app import app, db
+from .models import Part
+
+log = logging.getLogger(__name__)
+
+ONE_YEAR = 365*24*60*60
+_magic = ((b'\xff\xd8\xff', 'image/jpeg'),
+          (b'\x89PNG\r\n\x1a\n', 'image/png'),
+          (b'GIF8', 'image/gif'),
+          (b'RIFF', 'image/webp'))
+_executor = ThreadPoolExecutor(max_workers=app.config['IMAGE_FETCH_WORKERS'])
+
+
+def _sniff_mimetype(head: bytes) -> str:
+    for magic, mimetype in _magic:
+        if head.startswith(magic):
+            return mimetype
+    return 'application/octet-stream'
+
+
+def image_path(digest: str, size: int = None) -> str:
+    name = digest if size is None else '{}_{}'.format(digest, size)
+    return os.path.join(app.config['IMAGE_CACHE_DIR'], digest[:2], name)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _make_thumbnails(digest, data):
+    try:
+        # Pillow is slow to import, so only when there is an image to resize
+        from PIL import Image
+    except ImportError:
+        return
+    for size in app.config['IMAGE_THUMBNAIL_SIZES']:
+        try:
+            img = Image.open(io.BytesIO(data))
+            fmt = img.format
+            img.thumbnail((size, size))
+            out = io.BytesIO()
+            img.save(out, format=fmt)
+        except (IOError, ValueError) as e:
+            log.warning('Could not resize image %s: %s', digest, e)
+            return
+        _write(image_path(digest, size), out.getvalue())
+
+
+def store_image(data: bytes) -> str:
+    """ Store image data and its thumbnails, returns the content digest """
+    digest = hashlib.sha256(data).hexdigest()
+    path = image_path(digest)
+    if not os.path.exists(path):
+        _write(path, data)
+        _make_thumbnails(digest, data)
+    return digest
+
+
+def fetch_image(url: str, opener=urllib.request.urlopen) -> str:
+    """ Download and store an image, returns the content digest """
+    timeout = app.config['IMAGE_FETCH_TIMEOUT']
+    with opener(url, timeout=timeout) as resp:
+        data = resp.read()
+    return store_image(data)
+
+
+def cache_part_images(image_urls, opener=urllib.request.urlopen):
+    """ Fetch the given images and record their digests on the parts
+
+    Intended to run outside of a request, eg. on the prefetch executor.
+    """
+    try:
+        for url in image_urls:
+            try:
+                digest = fetch_image(url, opener)
+            except (IOError, ValueError) as e:
+                log.warning('Could not fetch image %s: %s', url, e)
+                continue
+            Part.query.filter(Part.image_url == url).\
+                update({'image_hash': digest}, synchronize_session=False)
+            db.session.commit()
+    finally:
+        db.session.remove()
+
+
+def prefetch_part_images(parts):
+    """ Queue the images of parts that are not cached yet for download """
+    urls = {part.image_url for part in parts
+            if part is not None and part.image_hash is None and
+            part.image_url and part.image_url.startswith('http')}
+    if urls:
+        return _executor.submit(cache_part_images, sorted(urls))
+
+
+def part_image_url(part, size=200):
+    """ URL for a part's image, the local copy if it has been cached """
+    if part.image_hash is None:
+        return part.image_url
+    return url_for('part_image', digest=part.image_hash, size=size)
+
+
+app.jinja_env.globals['part_image_url'] = part_image_url
+
+
+@app.route('/part_image/<digest>')
+@app.route('/part_image/<digest>/<int:size>')
+def part_image(digest, size=None):
+    if len(digest) != 64 or not all(c in '0123456789abcdef' for c in digest):
+        raise NotFound()
+    path = image_path(digest, size)
+    if size is not None and not os.path.exists(path):
+        path = image_path(digest)
+    if not os.path.exists(path):
+        raise NotFound()
+    with open(path, 'rb') as f:
+        mimetype = _sniff_mimetype(f.read(12))
+    response = send_file(path, mimetype=mimetype, cache_timeout=ONE_YEAR)
+    response.headers['Cache-Control'] = \
+        'public, max-age={}, immutable'.format(ONE_YEAR)
+    return response
@@ -0,0 +1,109 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import app, db
+from .models import BillOfMaterials
+from .revisions import record_revision
+from .utils import chunks
+
+
+class ArchiveUpload:
+    """ One archive of a bulk upload and its processing status """
+
+    def __init__(self, zip_filename, name, version):
+        self.zip_filename = zip_filename
+        self.name = name
+        self.version = version
+        self.status = 'pending'
+        self.message = ''
+        self.fields = None
+        self.unsupported = []
+        self.bom = None
+
+    def to_dict(self):
+        return {'file': os.path.basename(self.zip_filename),
+                'name': self.name,
+                'version': self.version,
+                'status': self.status,
+                'message': self.message,
+                'bom_id': self.bom.id if self.bom is not None else None,
+                'part_count': len(self.fields or []),
+                'unsupported_vendors': sorted(set(self.unsupported))}
+
+
+def _parse(archive, sheet_cache):
+    try:
+        archive.fields, archive.unsupported = \
+            BillOfMaterials.read_kicad_archive(archive.zip_filename,
+                                               sheet_cache)
+        archive.status = 'parsed'
+    except Exception as e:
+        archive.status = 'error'
+        archive.message = 'Failed to parse archive: {}'.format(e)
+
+
+def _build(archive, user):
+    bom = BillOfMaterials.from_parsed_archive(archive.zip_filename,
+                                              archive.fields)
+    bom.name = archive.name
+    bom.version = archive.version
+    bom.user = user
+    db.session.add(bom)
+    record_revision(bom)
+    archive.bom = bom
+
+
+def _commit(archives, status):
+    try:
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        for archive in archives:
+            archive.bom = None
+        return False, str(e)
+    for archive in archives:
+        archive.status = status
+    return True, ''
+
+
+def ingest_archives(archives, user, max_workers=None, group_size=None):
+    """ Parse and store many KiCAD archives at once
+
+    Archives are parsed concurrently and identical schematic sheets are only
+    parsed once. The resulting BOMs are committed in groups of group_size;
+    if a group fails to commit, its archives are retried one by one so a
+    single bad archive only fails itself.
+
+    Args:
+        archives: a list of ArchiveUpload objects
+        user: the User that will own the new BOMs
+        max_workers: number of parser threads
+        group_size: number of BOMs committed per transaction
+    Returns:
+        The archives, with their status set to 'stored' or 'error'
+    """
+    if max_workers is None:
+        max_workers = app.config['BULK_UPLOAD_WORKERS']
+    if group_size is None:
+        group_size = app.config['BULK_UPLOAD_GROUP_SIZE']
+    sheet_cache = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for archive in archives:
+            executor.submit(_parse, archive, sheet_cache)
+
+    parsed = [archive for archive in archives if archive.status == 'parsed']
+    for group in chunks(parsed, group_size):
+        for archive in group:
+            _build(archive, user)
+        ok, _ = _commit(group, 'stored')
+        if ok:
+            continue
+        for archive in group:
+            _build(archive, user)
+            ok, message = _commit([archive], 'stored')
+            if not ok:
+                archive.status = 'error'
+                archive.message = 'Failed to store BOM: {}'.format(message)
+    return archives
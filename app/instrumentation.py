@@ -0,0 +1,264 @@
+""" Per-request instrumentation
+
+Hooks into the Flask request lifecycle, the SQLAlchemy engine events and the
+template signals to measure, for every request: the wall time, the number of
+SQL statements and the time spent executing them, the number of rows fetched
+from their results (ORM, column and core queries alike), and the time spent
+rendering templates.
+
+Requests slower than SLOW_REQUEST_THRESHOLD_MS are written as JSON to the
+'app.slow_requests' logger (and to SLOW_REQUEST_LOG if set), and per endpoint
+histograms are served on /metrics to local clients that don't come through a
+proxy. Template timing needs blinker, which Flask uses for its signals.
+"""
+import json
+import time
+import bisect
+import logging
+import threading
+from datetime import datetime
+
+from flask import g, request, jsonify, has_request_context, Response
+from flask.helpers import NotFound
+from flask.signals import (signals_available, before_render_template,
+                           template_rendered)
+from sqlalchemy import event
+
+from app import app, db
+
+slow_log = logging.getLogger('app.slow_requests')
+if app.config['SLOW_REQUEST_LOG']:
+    _handler = logging.FileHandler(app.config['SLOW_REQUEST_LOG'])
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_log.addHandler(_handler)
+    slow_log.setLevel(logging.INFO)
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000,
+              float('inf'))
+_local_addrs = ('127.0.0.1', '::1')
+# Set by a reverse proxy, whose requests all come from a local address
+_forwarded_headers = ('X-Forwarded-For', 'X-Real-IP', 'Forwarded')
+
+
+class RequestMetrics:
+    """ Counters for a single request """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.wall = None
+        self.status = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        self.template_time = 0.0
+        self.template_starts = []
+
+    def to_dict(self):
+        return {'wall_ms': 1000 * self.wall,
+                'status': self.status,
+                'sql_count': self.sql_count,
+                'sql_ms': 1000 * self.sql_time,
+                'rows': self.rows,
+                'template_ms': 1000 * self.template_time}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value_ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, value_ms)] += 1
+        self.count += 1
+        self.sum += value_ms
+
+    def to_dict(self):
+        return {'buckets': [['+Inf' if le == float('inf') else le, n]
+                            for le, n in zip(BUCKETS_MS, self.counts)],
+                'count': self.count,
+                'sum': self.sum}
+
+
+class EndpointMetrics:
+    """ Aggregated measurements of all requests to one endpoint """
+
+    def __init__(self):
+        self.wall = Histogram()
+        self.sql = Histogram()
+        self.template = Histogram()
+        self.sql_count = 0
+        self.rows = 0
+        self.errors = 0
+
+    def record(self, metrics):
+        self.wall.observe(1000 * metrics.wall)
+        self.sql.observe(1000 * metrics.sql_time)
+        self.template.observe(1000 * metrics.template_time)
+        self.sql_count += metrics.sql_count
+        self.rows += metrics.rows
+        if metrics.status is None or metrics.status >= 500:
+            self.errors += 1
+
+    def to_dict(self):
+        return {'requests': self.wall.count,
+                'errors': self.errors,
+                'sql_statements': self.sql_count,
+                'rows': self.rows,
+                'wall_ms': self.wall.to_dict(),
+                'sql_ms': self.sql.to_dict(),
+                'template_ms': self.template.to_dict()}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, metrics):
+        with self._lock:
+            if endpoint not in self._endpoints:
+                self._endpoints[endpoint] = EndpointMetrics()
+            self._endpoints[endpoint].record(metrics)
+
+    def to_dict(self):
+        with self._lock:
+            return {endpoint: metrics.to_dict()
+                    for endpoint, metrics in sorted(self._endpoints.items())}
+
+    def to_prometheus(self):
+        lines = []
+        for endpoint, metrics in self.to_dict().items():
+            for name in ('wall_ms', 'sql_ms', 'template_ms'):
+                hist = metrics[name]
+                metric = 'bom_request_' + name
+                cumulative = 0
+                for le, n in hist['buckets']:
+                    cumulative += n
+                    lines.append('{}_bucket{{endpoint="{}",le="{}"}} {}'
+                                 .format(metric, endpoint, le, cumulative))
+                lines.append('{}_sum{{endpoint="{}"}} {}'
+                             .format(metric, endpoint, hist['sum']))
+                lines.append('{}_count{{endpoint="{}"}} {}'
+                             .format(metric, endpoint, hist['count']))
+            for name in ('errors', 'sql_statements', 'rows'):
+                lines.append('bom_request_{}_total{{endpoint="{}"}} {}'
+                             .format(name, endpoint, metrics[name]))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = MetricsRegistry()
+
+
+def _current():
+    if has_request_context():
+        return getattr(g, '_request_metrics', None)
+    return None
+
+
+@event.listens_for(db.engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if _current() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(db.engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    metrics = _current()
+    if metrics is None or not conn.info.get('query_start'):
+        return
+    metrics.sql_time += time.perf_counter() - conn.info['query_start'].pop()
+    metrics.sql_count += 1
+
+
+@event.listens_for(db.engine, 'after_execute')
+def _after_execute(conn, clauseelement, multiparams, params, result):
+    metrics = _current()
+    if metrics is None or not result.returns_rows:
+        return
+    # every fetch of a ResultProxy goes through process_rows, whichever
+    # of fetchone, fetchmany, fetchall, first or iteration is used
+    process_rows = result.process_rows
+
+    def _count_rows(rows):
+        rows = process_rows(rows)
+        metrics.rows += len(rows)
+        return rows
+    result.process_rows = _count_rows
+
+
+if signals_available:
+    @before_render_template.connect_via(app)
+    def _before_render_template(sender, template, context, **extra):
+        metrics = _current()
+        if metrics is not None:
+            metrics.template_starts.append(time.perf_counter())
+
+    @template_rendered.connect_via(app)
+    def _template_rendered(sender, template, context, **extra):
+        metrics = _current()
+        if metrics is not None and metrics.template_starts:
+            start = metrics.template_starts.pop()
+            # nested renders (eg. a table rendering a template inside a
+            # template) are only counted once
+            if not metrics.template_starts:
+                metrics.template_time += time.perf_counter() - start
+
+
+@app.before_request
+def _start_request():
+    if app.config['INSTRUMENTATION_ENABLED']:
+        g._request_metrics = RequestMetrics()
+
+
+@app.after_request
+def _add_server_timing(response):
+    metrics = _current()
+    if metrics is not None:
+        metrics.status = response.status_code
+        response.headers['Server-Timing'] = \
+            'db;dur={:.1f}, tpl;dur={:.1f}'.format(
+                1000 * metrics.sql_time, 1000 * metrics.template_time)
+    return response
+
+
+@app.teardown_request
+def _finish_request(exc):
+    metrics = _current()
+    if metrics is None:
+        return
+    g._request_metrics = None
+    metrics.wall = time.perf_counter() - metrics.start
+    if exc is not None:
+        metrics.status = 500
+    endpoint = request.endpoint or '<unmatched>'
+    registry.record(endpoint, metrics)
+    if 1000 * metrics.wall >= app.config['SLOW_REQUEST_THRESHOLD_MS']:
+        entry = metrics.to_dict()
+        entry.update({'timestamp': datetime.now().isoformat(),
+                      'endpoint': endpoint,
+                      'method': request.method,
+                      'path': request.full_path.rstrip('?')})
+        slow_log.warning(json.dumps(entry, sort_keys=True))
+
+
+@app.route('/metrics')
+def metrics():
+    """ Per endpoint histograms, only served to local clients
+
+    Behind a local reverse proxy (BOM_TLS=0) every request comes from a local
+    address, so requests forwarded by a proxy are refused too.
+    """
+    if request.remote_addr not in _local_addrs or \
+            any(header in request.headers for header in _forwarded_headers):
+        raise NotFound()
+    if request.args.get('format') == 'prometheus':
+        return Response(registry.to_prometheus(), mimetype='text/plain')
+    return jsonify(registry.to_dict())
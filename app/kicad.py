@@ -0,0 +1,357 @@
+""" Streaming readers for KiCAD 6+ schematics and exported netlists
+
+Legacy .sch sheets are parsed in models.py. The newer formats are read
+incrementally so memory stays bounded on very large designs:
+
+- .kicad_sch schematics (s-expressions) go through tokenize(), which reads
+  the file in chunks, and iter_lists(), which builds only the placed symbols
+  and skips everything else (eg. the library symbols) token by token.
+- .net netlists are either XML ("KiCad XML" export), read with iterparse and
+  every component discarded once it has been read, or s-expressions (the
+  default KiCad netlist), read like the schematics.
+
+Both return (fields, unsupported) like models.parse_kicad_schematic, so they
+feed the same BOMPart ingestion path.
+"""
+import io
+import re
+import codecs
+import hashlib
+import xml.etree.ElementTree as ET
+
+CHUNK_SIZE = 1 << 16
+
+# Fields every symbol has, which are never vendor fields
+STANDARD_FIELDS = {'Reference', 'Value', 'Footprint', 'Datasheet',
+                   'Description'}
+
+OPEN = object()
+CLOSE = object()
+
+# Every non-blank character is in a token. A string runs to the end of the
+# text if its closing quote is missing, so only the last token of a chunk can
+# be incomplete.
+_token = re.compile(r'[()]|"[^"\\]*(?:\\[\s\S]?[^"\\]*)*"?|[^\s()"]+')
+_string = re.compile(r'"(?:[^"\\]|\\[\s\S])*"')
+_escape = re.compile(r'\\(.)')
+_escapes = {'n': '\n', 't': '\t'}
+_parens = {'(': OPEN, ')': CLOSE}
+
+
+def _unescape(match):
+    char = match.group(1)
+    return _escapes.get(char, char)
+
+
+def tokenize(stream, chunk_size=CHUNK_SIZE):
+    """ Tokens of the s-expression text read from stream, chunk by chunk
+
+    Yields OPEN and CLOSE for parentheses and a str for every atom or quoted
+    string (unquoted and unescaped). Tokens may span chunks.
+    """
+    findall, paren = _token.findall, _parens.get
+    tail = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        tokens = findall(tail + chunk)
+        tail = ''
+        if chunk and tokens and (not chunk[-1].isspace() or
+                                 tokens[-1][0] == '"'):
+            # the last token may continue in the next chunk
+            tail = tokens.pop()
+        elif not chunk and tokens and tokens[-1][0] == '"' and \
+                not _string.fullmatch(tokens[-1]):
+            raise ValueError('Unterminated string: '
+                             '{!r}'.format(tokens[-1][:40]))
+        for token in tokens:
+            value = paren(token)
+            if value is not None:
+                yield value
+            elif token[0] == '"':
+                token = token[1:-1]
+                yield _escape.sub(_unescape, token) if '\\' in token \
+                    else token
+            else:
+                yield token
+        if not chunk:
+            return
+
+
+def _read_list(tokens):
+    """ The rest of a list, up to its CLOSE, as nested lists """
+    stack = [[]]
+    for token in tokens:
+        if token is OPEN:
+            stack.append([])
+        elif token is CLOSE:
+            done = stack.pop()
+            if not stack:
+                return done
+            stack[-1].append(done)
+        else:
+            stack[-1].append(token)
+    raise ValueError('Unexpected end of s-expression')
+
+
+def iter_lists(tokens, path):
+    """ The lists at path, built one at a time
+
+    Args:
+        tokens: as from tokenize
+        path: the heads of the enclosing lists and of the wanted ones, eg.
+            ('kicad_sch', 'symbol') for the symbols placed on a sheet but
+            not those in (kicad_sch (lib_symbols (symbol ...)))
+    Yields:
+        Every wanted list as a nested list of its tokens, head first.
+        Everything else is skipped without being built.
+    """
+    tokens = iter(tokens)
+    depth = matched = 0
+    for token in tokens:
+        if token is CLOSE:
+            if depth == matched:
+                matched -= 1
+            depth -= 1
+            continue
+        if token is not OPEN:
+            continue
+        depth += 1
+        head = next(tokens, CLOSE)
+        if head is CLOSE:
+            depth -= 1
+        elif head is OPEN:
+            depth += 1
+        elif depth == matched + 1 and head == path[matched]:
+            if matched + 1 == len(path):
+                yield [head] + _read_list(tokens)
+                depth -= 1
+            else:
+                matched += 1
+
+
+def _children(node, head):
+    return [child for child in node
+            if isinstance(child, list) and child and child[0] == head]
+
+
+def _child(node, head):
+    children = _children(node, head)
+    return children[0] if children else None
+
+
+def _lookup(named_fields, vendors):
+    """ The vendor field of a component, as parse_kicad_component
+
+    Returns:
+        A tuple of ((lookup_source, lookup_id), unsupported)
+    """
+    lookup_source = lookup_id = None
+    unsupported = []
+    for name, value in named_fields:
+        if not name or name in STANDARD_FIELDS or \
+                name.startswith(('ki_', 'Sim.')):
+            continue
+        if name not in vendors:
+            unsupported.append(name)
+            continue
+        lookup_source, lookup_id = name, value
+    return (lookup_source, lookup_id), unsupported
+
+
+def _collect(components, vendors):
+    """ (fields, unsupported) for (references, named_fields) pairs
+
+    Power symbols and other references starting with '#' are skipped, and
+    every reference is used once, so the units of a multi-unit symbol give
+    a single part.
+    """
+    fields, unsupported, seen = [], [], set()
+    for references, named_fields in components:
+        references = [reference for reference in references
+                      if reference and reference[0] != '#' and
+                      reference not in seen]
+        if not references:
+            continue
+        (source, lookup_id), names = _lookup(named_fields, vendors)
+        unsupported.extend(name for name in names if name not in unsupported)
+        for reference in references:
+            seen.add(reference)
+            fields.append((reference, source, lookup_id))
+    return fields, unsupported
+
+
+def schematic_components(stream):
+    """ (references, named_fields) of every placed symbol of a .kicad_sch
+    text stream, read incrementally
+    """
+    for symbol in iter_lists(tokenize(stream), ('kicad_sch', 'symbol')):
+        in_bom = _child(symbol, 'in_bom')
+        if in_bom is not None and in_bom[1:] == ['no']:
+            continue
+        properties = [(prop[1], prop[2])
+                      for prop in _children(symbol, 'property')
+                      if len(prop) >= 3]
+        # KiCAD 7+ lists the reference of every instance of the sheet
+        references = [reference[1]
+                      for instances in _children(symbol, 'instances')
+                      for project in _children(instances, 'project')
+                      for path in _children(project, 'path')
+                      for reference in _children(path, 'reference')
+                      if len(reference) > 1]
+        if not references:
+            references = [value for name, value in properties
+                          if name == 'Reference']
+        yield references, properties
+
+
+def parse_kicad_sch(stream, vendors):
+    """ Parse the placed symbols of a KiCAD 6+ .kicad_sch sheet
+
+    Args:
+        stream: the sheet, as a text stream
+        vendors: the supported vendor field names
+    Returns:
+        A tuple of (fields, unsupported) as for models.parse_kicad_schematic
+    """
+    return _collect(schematic_components(stream), vendors)
+
+
+def _sexpr_netlist_components(stream):
+    for comp in iter_lists(tokenize(stream),
+                           ('export', 'components', 'comp')):
+        excluded = any(name[1] == 'exclude_from_bom'
+                       for prop in _children(comp, 'property')
+                       for name in _children(prop, 'name') if len(name) > 1)
+        if excluded:
+            continue
+        ref = _child(comp, 'ref')
+        named_fields = []
+        for fields in _children(comp, 'fields'):
+            for field in _children(fields, 'field'):
+                name = _child(field, 'name')
+                values = [value for value in field[1:]
+                          if not isinstance(value, list)]
+                if name is not None and len(name) > 1:
+                    named_fields.append((name[1],
+                                         values[0] if values else ''))
+        yield [ref[1]] if ref is not None and len(ref) > 1 else [], \
+            named_fields
+
+
+def _xml_netlist_components(stream):
+    stack = []
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+        stack.pop()
+        if elem.tag == 'comp' and len(stack) == 2 and \
+                stack[-1].tag == 'components':
+            excluded = any(prop.get('name') == 'exclude_from_bom'
+                           for prop in elem.iter('property'))
+            if not excluded:
+                yield [elem.get('ref')], \
+                    [(field.get('name'), field.text or '')
+                     for field in elem.iterfind('fields/field')]
+        # drop every component, net, ... once read, and sections once done
+        if 1 <= len(stack) <= 2:
+            elem.clear()
+            stack[-1].remove(elem)
+
+
+def netlist_components(stream):
+    """ (references, named_fields) of every component of a netlist binary
+    stream, XML or s-expression, read incrementally
+    """
+    stream = io.BufferedReader(stream) if not hasattr(stream, 'peek') \
+        else stream
+    head = stream.peek(256)
+    if head.startswith(codecs.BOM_UTF8):
+        head = head[len(codecs.BOM_UTF8):]
+    if head.lstrip()[:1] == b'<':
+        return _xml_netlist_components(stream)
+    return _sexpr_netlist_components(
+        io.TextIOWrapper(stream, encoding='utf-8-sig'))
+
+
+def parse_kicad_netlist(stream, vendors):
+    """ Parse the components of an exported KiCAD netlist
+
+    Args:
+        stream: the netlist, as a binary stream, in the XML or the
+            s-expression format
+        vendors: the supported vendor field names
+    Returns:
+        A tuple of (fields, unsupported) as for models.parse_kicad_schematic
+    """
+    return _collect(netlist_components(stream), vendors)
+
+
+def schematic_files(filelist):
+    """ The members of a project archive to read the BOM from
+
+    A netlist, if there is one, covers the whole design (with every
+    instance of repeated sheets annotated), so only the newest one is read.
+    Otherwise the .kicad_sch sheets are read, or the legacy .sch sheets if
+    there are none.
+
+    Returns:
+        A tuple (kind, members), kind being 'net', 'kicad_sch' or 'sch'
+    """
+    for kind in ('net', 'kicad_sch', 'sch'):
+        members = [info for info in filelist
+                   if info.filename.endswith('.' + kind)]
+        if kind == 'net' and members:
+            members = [max(members, key=lambda info: info.date_time)]
+        if members:
+            return kind, members
+    return 'sch', []
+
+
+class HashingReader(io.RawIOBase):
+    """ A binary stream over f that feeds every byte read to digest """
+
+    def __init__(self, f, digest):
+        self._f = f
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._f.read(len(buffer))
+        buffer[:len(data)] = data
+        self.digest.update(data)
+        return len(data)
+
+
+def member_digest(zf, info):
+    """ sha1 of an archive member, read in chunks """
+    digest = hashlib.sha1()
+    with zf.open(info) as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_member(zf, info, kind, vendors):
+    """ Parse a .net or .kicad_sch archive member while unzipping it
+
+    The member is hashed from the same reads, so it is decompressed once.
+
+    Returns:
+        A tuple of (result, sha1), result being (fields, unsupported)
+    """
+    digest = hashlib.sha1()
+    with zf.open(info) as f:
+        stream = io.BufferedReader(HashingReader(f, digest), CHUNK_SIZE)
+        if kind == 'net':
+            result = parse_kicad_netlist(stream, vendors)
+        else:
+            result = parse_kicad_sch(io.TextIOWrapper(stream,
+                                                      encoding='utf-8'),
+                                     vendors)
+        # hash whatever the parser left unread
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return result, digest.hexdigest()
@@ -1,12 +1,23 @@
 import re
+import json
+import zlib
+import hashlib
 import zipfile
 from datetime import datetime
 from collections import namedtuple
 
 from flask import flash
-from passlib.hash import sha256_crypt
+from passlib.context import CryptContext
+from sqlalchemy import func
 
-from app import db
+from app import app, db
+from .utils import reference_sort_key
+from . import kicad
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Define the PriceBreak type. Too simple to make own model. Just pickle it and
 # store as a binary blob in db.
@@ -16,6 +27,97 @@ PriceBreak = namedtuple('PriceBreak', ('number', 'price_dollars'))
 # added to the schematic to define a vendor part number
 vendors = {'Digikey'}
 
+# Only pass on the hash settings of the configured schemes, so the settings
+# of optional schemes can stay in the config when they are not installed.
+_pwd_schemes = app.config['PASSWORD_SCHEMES']
+_pwd_settings = {key: value
+                 for key, value in app.config['PASSWORD_HASH_SETTINGS'].items()
+                 if key.split('__')[0] in _pwd_schemes}
+pwd_context = CryptContext(schemes=_pwd_schemes, deprecated='auto',
+                           **_pwd_settings)
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd codec requires the zstandard package')
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    elif codec == 'zlib':
+        return zlib.compress(data, 9)
+    raise ValueError('Unknown codec: {}'.format(codec))
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd codec requires the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError('Unknown codec: {}'.format(codec))
+
+
+_component_regex = re.compile(r'\$Comp\s*(.*?)\s*\$EndComp', flags=re.DOTALL)
+
+
+def parse_kicad_component(sch_string):
+    """ Parse a KiCAD Schematic Component string
+    For example:
+    ================================================
+    L QTH-090-01-F-D-A P1
+    U 1 1 55CCAA2D
+    P 2700 5850
+    F 0 "P1" H 2700 5750 50  0000 C CNN
+    F 1 "QTH-090-01-F-D-A" H 2700 5950 50  0000 C CNN
+    F 2 "extras:QTH-090-XX-X-D-A" H 2700 5850 50  0001 C CNN
+    F 3 "DOCUMENTATION" H 2700 5850 50  0001 C CNN
+    F 4 "SAM8195-ND" H 2700 5850 60  0001 C CNN "digipart"
+            1    2700 5850
+            1    0    0    -1
+    ================================================
+
+    Returns:
+        A tuple of ((reference, lookup_source, lookup_id), unsupported) where
+        unsupported lists vendor field names that are not in vendors.
+    """
+    reference = lookup_source = lookup_id = None
+    unsupported = []
+    for line in sch_string.split('\n'):
+        fields = line.split()
+        if fields[0] == 'L':
+            reference = fields[2]
+        if fields[0] == 'F':
+            try:
+                # field 10 is name(if present), also remove quotes
+                field_name = fields[10][1:-1]
+                field_value = fields[2][1:-1]
+                if field_name not in vendors:
+                    unsupported.append(field_name)
+                    continue
+                lookup_source = field_name
+                lookup_id = field_value
+            except IndexError:  # No valid field name/value
+                continue
+    return (reference, lookup_source, lookup_id), unsupported
+
+
+def parse_kicad_schematic(txt):
+    """ Parse all components of a KiCAD schematic sheet
+
+    Power symbols and other references starting with '#' are skipped.
+
+    Returns:
+        A tuple of (fields, unsupported) as for parse_kicad_component, but
+        with fields being a list.
+    """
+    parts, unsupported = [], []
+    for part_str in _component_regex.findall(txt):
+        fields, part_unsupported = parse_kicad_component(part_str)
+        unsupported.extend(part_unsupported)
+        if fields[0][0] != '#':
+            parts.append(fields)
+    return parts, unsupported
+
 
 class User(db.Model):
     __tablename__ = 'user'
@@ -25,21 +127,26 @@ class User(db.Model):
     pwd_hash = db.Column(db.String)
     boms = db.relationship('BillOfMaterials', back_populates='user')
     orders = db.relationship('Order', back_populates='user')
-    digikey_oauth_token = db.Column(db.String)
-    digikey_oauth_token_expire = db.Column(db.DateTime)
-    digikey_oauth_refresh_token = db.Column(db.String)
+    # Deferred, so the copy of a User in the user cache never holds tokens
+    # that another worker may have replaced since
+    digikey_oauth_token = db.deferred(db.Column(db.String), group='oauth')
+    digikey_oauth_token_expire = db.deferred(db.Column(db.DateTime),
+                                             group='oauth')
+    digikey_oauth_refresh_token = db.deferred(db.Column(db.String),
+                                              group='oauth')
 
     def __init__(self, name, email, password):
         self.name = name
         self.email = email
-        self.pwd_hash = sha256_crypt.encrypt(password)
+        self.pwd_hash = pwd_context.hash(password)
 
     @staticmethod
     def authenticate(email: str, password: str):
         """ Find and authenticate a user
 
         Finds a user with a known email and ensure that the password hash
-        matches the one on file
+        matches the one on file. If the hash on file uses a deprecated scheme
+        or settings it is replaced by a fresh hash.
 
         Returns:
             The matching uses if email/password matches one on file, otherwise
@@ -49,11 +156,14 @@ class User(db.Model):
         user = User.query.filter(User.email == email).first()
         if not user:
             return None
-        pwd_ok = sha256_crypt.verify(password, user.pwd_hash)
+        pwd_ok, new_hash = pwd_context.verify_and_update(password,
+                                                         user.pwd_hash)
         if not pwd_ok:
             return None
-        else:
-            return user
+        if new_hash is not None:
+            user.pwd_hash = new_hash
+            db.session.commit()
+        return user
 
     @property
     def is_authenticated(self):
@@ -77,15 +187,32 @@ class Part(db.Model):
     short_description = db.Column(db.String)
     manufacturer = db.Column(db.String)
     image_url = db.Column(db.String)
+    # sha256 of the locally cached copy of image_url, see app.images
+    image_hash = db.Column(db.String)
     manufacturer_part_number = db.Column(db.String)
     bomparts = db.relationship('BOMPart', back_populates='part')
     vendorparts = db.relationship('VendorPart', back_populates='part')
+    price_history = db.relationship('PriceHistory', back_populates='part',
+                                    order_by='PriceHistory.timestamp')
+
+
+class Manufacturer(db.Model):
+    """ Distinct Part manufacturers
+
+    Maintained by app.search whenever a Part is written so that the list of
+    manufacturers does not need a scan of the part table.
+    """
+    __tablename__ = 'manufacturer'
+    name = db.Column(db.String, primary_key=True)
 
 
 class BOMPart(db.Model):
     __tablename__ = 'bompart'
+    __table_args__ = (db.Index('ix_bompart_bom_reference_sort_key',
+                               'bom_id', 'reference_sort_key'),)
     id = db.Column(db.Integer, primary_key=True)
     reference = db.Column(db.String)
+    reference_sort_key = db.Column(db.String)
     lookup_source = db.Column(db.String)
     lookup_id = db.Column(db.String)
     bom_id = db.Column(db.Integer, db.ForeignKey('billofmaterials.id'))
@@ -96,38 +223,22 @@ class BOMPart(db.Model):
     @staticmethod
     def from_kicad_schematic_string(sch_string):
         """ Build a part from a KiCAD Schematic Component string
-        For example:
-        ================================================
-        L QTH-090-01-F-D-A P1
-        U 1 1 55CCAA2D
-        P 2700 5850
-        F 0 "P1" H 2700 5750 50  0000 C CNN
-        F 1 "QTH-090-01-F-D-A" H 2700 5950 50  0000 C CNN
-        F 2 "extras:QTH-090-XX-X-D-A" H 2700 5850 50  0001 C CNN
-        F 3 "DOCUMENTATION" H 2700 5850 50  0001 C CNN
-        F 4 "SAM8195-ND" H 2700 5850 60  0001 C CNN "digipart"
-                1    2700 5850
-                1    0    0    -1
-        ================================================
+
+        See parse_kicad_component for the expected format. Unsupported
+        vendor fields are flashed as warnings.
         """
+        fields, unsupported = parse_kicad_component(sch_string)
+        for vendor in unsupported:
+            flash('unsupported vendor: '+vendor, category='warning')
+        return BOMPart.from_fields(*fields)
+
+    @staticmethod
+    def from_fields(reference, lookup_source, lookup_id):
         part = BOMPart()
-        for line in sch_string.split('\n'):
-            fields = line.split()
-            if fields[0] == 'L':
-                part.reference = fields[2]
-            if fields[0] == 'F':
-                try:
-                    # field 10 is name(if present), also remove quotes
-                    field_name = fields[10][1:-1]
-                    field_value = fields[2][1:-1]
-                    if field_name not in vendors:
-                        flash('unsupported vendor: '+field_name,
-                              category='warning')
-                        continue
-                    part.lookup_source = field_name
-                    part.lookup_id = field_value
-                except IndexError:  # No valid field name/value
-                    continue
+        part.reference = reference
+        part.reference_sort_key = reference_sort_key(reference)
+        part.lookup_source = lookup_source
+        part.lookup_id = lookup_id
         return part
 
 
@@ -138,33 +249,121 @@ class BillOfMaterials(db.Model):
     zip_file = db.Column(db.String)
     version = db.Column(db.String)
     timestamp = db.Column(db.DateTime)
+    # Bumped whenever the parts are (re)populated so that anything derived
+    # from the bomparts (eg. cached tables) can be invalidated.
+    content_version = db.Column(db.Integer, default=0)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user = db.relationship('User', back_populates='boms')
-    bomparts = db.relationship('BOMPart', back_populates='bom')
+    bomparts = db.relationship('BOMPart', back_populates='bom',
+                               order_by='BOMPart.reference_sort_key')
     orders = db.relationship('Order_BOM', back_populates='bom')
+    revision = db.relationship('BOMRevision', back_populates='bom',
+                               uselist=False)
 
     @staticmethod
-    def from_kicad_archive(zip_filename):
-        zf = zipfile.ZipFile(zip_filename)
-
-        def get_parts_from_schematic(sch_file):
-            txt = zf.read(sch_file).decode('utf-8')
-            parts = []
-            regex = r'\$Comp\s*(.*?)\s*\$EndComp'
-            for part_str in re.findall(regex, txt, flags=re.DOTALL):
-                part = BOMPart.from_kicad_schematic_string(part_str)
-                if part.reference[0] != '#':
-                    parts.append(part)
-            return parts
+    def read_kicad_archive(zip_filename, sheet_cache=None):
+        """ Parse the schematic sheets in a KiCAD project archive
+
+        The BOM is read from the project's exported netlist (.net) if the
+        archive has one, else from its KiCAD 6+ .kicad_sch sheets, else from
+        its legacy .sch sheets, see kicad.schematic_files.
+
+        This does not touch the db or the request context so it is safe to
+        call from worker threads.
+
+        Args:
+            zip_filename: path to the zipped KiCAD project
+            sheet_cache: optional dict shared between calls that maps the
+                sha1 of a sheet's contents to its parse result, so identical
+                sheets in different archives are only parsed once. For the
+                newer formats it also maps the (CRC-32, size) of a member,
+                from the archive's directory, to the sha1 of its contents.
+        Returns:
+            A tuple of (fields, unsupported) where fields is a list of
+            (reference, lookup_source, lookup_id) tuples and unsupported is a
+            list of unsupported vendor names that were encountered.
+        """
+        fields, unsupported = [], []
+        with zipfile.ZipFile(zip_filename) as zf:
+            kind, members = kicad.schematic_files(zf.filelist)
+            for file_ in members:
+                if kind == 'sch':
+                    raw = zf.read(file_)
+                    key = hashlib.sha1(raw).hexdigest()
+                    result = sheet_cache.get(key) \
+                        if sheet_cache is not None else None
+                    if result is None:
+                        result = parse_kicad_schematic(raw.decode('utf-8'))
+                else:
+                    # the newer formats are parsed while unzipping, so they
+                    # are never held in memory as a whole, and hashed from
+                    # the same reads. A member with the CRC-32 and size of
+                    # one seen before is only hashed, to check it.
+                    seen = (file_.CRC, file_.file_size)
+                    key = sheet_cache.get(seen) \
+                        if sheet_cache is not None else None
+                    result = None
+                    if key is not None and \
+                            kicad.member_digest(zf, file_) == key:
+                        result = sheet_cache.get(key)
+                    if result is None:
+                        result, key = kicad.parse_member(zf, file_, kind,
+                                                         vendors)
+                        if sheet_cache is not None:
+                            sheet_cache[seen] = key
+                if sheet_cache is not None:
+                    sheet_cache[key] = result
+                fields.extend(result[0])
+                unsupported.extend(result[1])
+        return fields, unsupported
+
+    @staticmethod
+    def from_parsed_archive(zip_filename, fields):
         bom = BillOfMaterials()
         bom.zip_file = zip_filename
         bom.timestamp = datetime.now()
-        for file_ in zf.filelist:
-            if file_.filename.endswith('.sch'):
-                sch_parts = get_parts_from_schematic(file_)
-                bom.bomparts.extend(sch_parts)
+        bom.bomparts.extend(BOMPart.from_fields(*field) for field in fields)
         return bom
 
+    @staticmethod
+    def from_kicad_archive(zip_filename):
+        fields, unsupported = BillOfMaterials.read_kicad_archive(zip_filename)
+        for vendor in unsupported:
+            flash('unsupported vendor: '+vendor, category='warning')
+        return BillOfMaterials.from_parsed_archive(zip_filename, fields)
+
+    def condensed_parts(self):
+        """ Group the BOM's parts by Part in the db
+
+        Does the grouping and counting in a single GROUP BY query so that no
+        BOMPart/Part objects need to be created. group_concat does not keep
+        any order, so the references are sorted here. BOMParts that are not
+        linked to a Part are skipped.
+
+        Returns:
+            A list of dicts with keys manufacturer, manufacturer_part_number,
+            short_description, count, and references, ordered by manufacturer
+            and manufacturer part number.
+        """
+        query = db.session.query(Part.manufacturer,
+                                 Part.manufacturer_part_number,
+                                 Part.short_description,
+                                 func.count(BOMPart.reference),
+                                 func.group_concat(BOMPart.reference, ',')).\
+            join(BOMPart, BOMPart.part_id == Part.id).\
+            filter(BOMPart.bom_id == self.id).\
+            group_by(Part.id).\
+            order_by(Part.manufacturer, Part.manufacturer_part_number)
+        keys = ('manufacturer', 'manufacturer_part_number',
+                'short_description', 'count', 'references')
+        parts = []
+        for row in query:
+            part = dict(zip(keys, row))
+            part['references'] = ', '.join(sorted(
+                part['references'].split(','), key=reference_sort_key))
+            parts.append(part)
+        return parts
+
     def lookup_parts(self):
         for bompart in self.bomparts:
             vendor = vendors[bompart.lookup_source]
@@ -179,13 +378,87 @@ class BillOfMaterials(db.Model):
         db.commit()
 
 
+class BOMRevision(db.Model):
+    """ A revision of a project, linking the BOMs uploaded for it
+
+    Revisions of the same project (the BOM name) are numbered and point to
+    their parent. Each keeps a snapshot of its BOM's content, mapping every
+    reference to its (lookup_source, lookup_id), so revisions can be diffed
+    without loading their BOMParts. Where possible the snapshot is stored as
+    a delta against the parent's: the references added or changed, and the
+    ones removed. depth counts the deltas down to the nearest snapshot stored
+    in full. See revisions.py.
+    """
+    __tablename__ = 'bomrevision'
+    __table_args__ = (db.Index('ix_bomrevision_project_number',
+                               'project', 'number'),)
+    id = db.Column(db.Integer, primary_key=True)
+    bom_id = db.Column(db.Integer, db.ForeignKey('billofmaterials.id'),
+                       unique=True)
+    bom = db.relationship('BillOfMaterials', back_populates='revision')
+    project = db.Column(db.String)
+    number = db.Column(db.Integer)
+    parent_id = db.Column(db.Integer, db.ForeignKey('bomrevision.id'))
+    parent = db.relationship('BOMRevision', remote_side=[id],
+                             back_populates='children')
+    children = db.relationship('BOMRevision', back_populates='parent')
+    depth = db.Column(db.Integer, default=0)
+    entries = db.Column(db.Integer)
+    # sha256 of the full snapshot, identical revisions have the same digest
+    digest = db.Column(db.String)
+    codec = db.Column(db.String)
+    data = db.Column(db.LargeBinary)
+
+
+class VendorPayload(db.Model):
+    """ A raw vendor API response, compressed and deduplicated
+
+    Payloads are stored once per distinct content (by sha256 of the canonical
+    JSON) and shared by all VendorParts that received the same response.
+    """
+    __tablename__ = 'vendorpayload'
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String, unique=True, index=True)
+    codec = db.Column(db.String)
+    raw_size = db.Column(db.Integer)
+    data = db.Column(db.LargeBinary)
+    vendorparts = db.relationship('VendorPart', back_populates='payload')
+
+    @staticmethod
+    def from_response(response):
+        """ Find or create the payload for a decoded JSON response """
+        raw = json.dumps(response, sort_keys=True,
+                         separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(raw).hexdigest()
+        payload = VendorPayload.query.filter_by(sha256=digest).first()
+        if payload is None:
+            payload = VendorPayload()
+            payload.sha256 = digest
+            payload.codec = app.config['VENDOR_PAYLOAD_CODEC']
+            payload.raw_size = len(raw)
+            payload.data = compress(raw, payload.codec)
+        return payload
+
+    def decode(self):
+        return json.loads(decompress(self.data, self.codec).decode('utf-8'))
+
+
 class VendorPart(db.Model):
     __tablename__ = 'vendorpart'
+    __table_args__ = (db.Index('ix_vendorpart_part_vendor_fetch',
+                               'part_id', 'vendor', 'fetch_timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
+    # Uncompressed response of rows stored before VendorPayload existed
     json = db.Column(db.String)
+    payload_id = db.Column(db.Integer, db.ForeignKey('vendorpayload.id'),
+                           index=True)
+    payload = db.relationship('VendorPayload', back_populates='vendorparts')
     vendor = db.Column(db.String)
     vendor_part_number = db.Column(db.String)
+    # When this pricing and metadata was first fetched, and the most recent
+    # fetch that returned it unchanged
     fetch_timestamp = db.Column(db.DateTime)
+    last_seen = db.Column(db.DateTime)
     price_breaks = db.Column(db.PickleType)
     url = db.Column(db.String)
     part_id = db.Column(db.Integer, db.ForeignKey('part.id'))
@@ -193,6 +466,15 @@ class VendorPart(db.Model):
     orderparts = db.relationship('Order_VendorPart',
                                  back_populates='vendorpart')
 
+    @property
+    def response(self):
+        """ The decoded raw vendor response """
+        if self.payload is not None:
+            return self.payload.decode()
+        if self.json is not None:
+            return json.loads(self.json)
+        return None
+
     def get_pricebreak(self, n):
         breaks = []
         for break_ in self.price_breaks:
@@ -214,6 +496,40 @@ class VendorPart(db.Model):
                         for x in self.price_breaks)
 
 
+class PriceHistory(db.Model):
+    """ A change in a vendor's pricing of a part
+
+    One row is written per fetch whose price breaks differ from the previous
+    fetch of the same vendor part, so the table only grows with actual price
+    changes.
+    """
+    __tablename__ = 'pricehistory'
+    __table_args__ = (db.Index('ix_pricehistory_part_timestamp',
+                               'part_id', 'timestamp'),)
+    id = db.Column(db.Integer, primary_key=True)
+    part_id = db.Column(db.Integer, db.ForeignKey('part.id'))
+    part = db.relationship('Part', back_populates='price_history')
+    vendor = db.Column(db.String)
+    vendor_part_number = db.Column(db.String)
+    timestamp = db.Column(db.DateTime)
+    # Price at the smallest break quantity, for charting
+    unit_price = db.Column(db.Float)
+    # Price breaks in VendorPart.format_price_breaks format
+    price_breaks = db.Column(db.String)
+
+    @staticmethod
+    def from_vendorpart(vendorpart):
+        entry = PriceHistory()
+        entry.part = vendorpart.part
+        entry.vendor = vendorpart.vendor
+        entry.vendor_part_number = vendorpart.vendor_part_number
+        entry.timestamp = vendorpart.fetch_timestamp
+        entry.unit_price = (vendorpart.get_pricebreak(0)
+                            if vendorpart.price_breaks else None)
+        entry.price_breaks = vendorpart.format_price_breaks()
+        return entry
+
+
 class Order(db.Model):
     __tablename__ = 'order'
     id = db.Column(db.Integer, primary_key=True)
@@ -251,3 +567,30 @@ class Order_VendorPart(db.Model):
     order = db.relationship('Order', back_populates='vendorparts')
     vendorpart_id = db.Column(db.Integer, db.ForeignKey('vendorpart.id'))
     vendorpart = db.relationship('VendorPart', back_populates='orderparts')
+
+
+class PartBOMUsage(db.Model):
+    """ Where-used index: the number of references to a Part in a BOM
+
+    Maintained by where_used.py.
+    """
+    __tablename__ = 'partbomusage'
+    part_id = db.Column(db.Integer, db.ForeignKey('part.id'),
+                        primary_key=True)
+    bom_id = db.Column(db.Integer, db.ForeignKey('billofmaterials.id'),
+                       primary_key=True, index=True)
+    count = db.Column(db.Integer)
+
+
+class PartOrderUsage(db.Model):
+    """ Where-used index: the lines of an open Order for a Part
+
+    Maintained by where_used.py, archived orders are left out.
+    """
+    __tablename__ = 'partorderusage'
+    part_id = db.Column(db.Integer, db.ForeignKey('part.id'),
+                        primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'),
+                         primary_key=True, index=True)
+    lines = db.Column(db.Integer)
+    number_ordered = db.Column(db.Integer)
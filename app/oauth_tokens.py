@@ -0,0 +1,226 @@
+""" OAuth 2 access token refreshing for vendor APIs
+
+TokenManager hands out access tokens per user and refreshes them with the
+user's refresh token shortly before they expire. Concurrent callers that need
+a refresh for the same user share a single refresh request (single-flight),
+and the refreshed token is written back to the user table.
+
+Refresh tokens are single use, so across processes (eg. gunicorn workers)
+refreshes of a user's tokens are serialized with a lock file, and the tokens
+are re-read from the db before refreshing: a process holding a stale copy
+then picks up the tokens another process refreshed instead of spending the
+old refresh token again.
+"""
+import os
+import json
+import time
+import threading
+import contextlib
+import urllib.parse
+import urllib.request
+from types import SimpleNamespace
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from .models import User
+
+try:
+    import fcntl
+except ImportError:
+    # no lock files on Windows, where only the single process development
+    # server runs
+    fcntl = None
+
+Token = namedtuple('Token', ('access_token', 'refresh_token', 'expires'))
+
+
+class TokenRefreshError(Exception):
+    pass
+
+
+def _post_form(url, data, timeout):
+    body = urllib.parse.urlencode(data).encode('utf-8')
+    req = urllib.request.Request(
+        url, body, {'Content-Type': 'application/x-www-form-urlencoded',
+                    'Accept': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+
+class TokenManager:
+    """ Keeps per-user access tokens fresh
+
+    Args:
+        token_url: the provider's token endpoint
+        client_id, client_secret: the application's OAuth credentials
+        margin: tokens expiring within this timedelta are refreshed
+        post: function(url, data, timeout) -> dict performing the form POST,
+            replaceable to talk to a stub server
+        timeout: seconds to wait for the provider
+        lock_dir: directory for the lock files serializing refreshes across
+            processes, None to only serialize them within the process
+    """
+
+    def __init__(self, token_url, client_id, client_secret,
+                 margin=timedelta(minutes=5), post=_post_form, timeout=30,
+                 lock_dir=None):
+        self.token_url = token_url
+        self.lock_dir = lock_dir
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.margin = margin
+        self.post = post
+        self.timeout = timeout
+        self.refresh_latencies = deque(maxlen=1000)
+        self.refresh_count = 0
+        self.refresh_failures = 0
+        self._tokens = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _fresh(self, token):
+        return (token is not None and token.access_token is not None and
+                token.expires is not None and
+                token.expires - self.margin > datetime.now())
+
+    @staticmethod
+    def _from_user(user):
+        return Token(user.digikey_oauth_token,
+                     user.digikey_oauth_refresh_token,
+                     user.digikey_oauth_token_expire)
+
+    def get_token(self, user) -> str:
+        """ A valid access token for user, refreshing it if needed
+
+        Raises:
+            TokenRefreshError if the token is expired and can't be refreshed
+        """
+        with self._lock:
+            token = self._tokens.get(user.id)
+            user_token = self._from_user(user)
+            if token is None or (user_token.expires is not None and
+                                 token.expires is not None and
+                                 user_token.expires > token.expires):
+                token = self._tokens[user.id] = user_token
+            if self._fresh(token):
+                return token.access_token
+            flight = self._inflight.get(user.id)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[user.id] = Future()
+        if leader:
+            try:
+                token = self._refresh(user.id, token)
+                flight.set_result(token)
+            except Exception as e:
+                flight.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._inflight[user.id]
+        return flight.result(timeout=self.timeout).access_token
+
+    def for_user(self, user):
+        """ A callable returning user's current access token
+
+        Works from a snapshot of the user's token columns, so it can be
+        called from threads that don't own the user's session.
+        """
+        snapshot = SimpleNamespace(
+            id=user.id,
+            digikey_oauth_token=user.digikey_oauth_token,
+            digikey_oauth_refresh_token=user.digikey_oauth_refresh_token,
+            digikey_oauth_token_expire=user.digikey_oauth_token_expire)
+        return lambda: self.get_token(snapshot)
+
+    @contextlib.contextmanager
+    def _process_lock(self, user_id):
+        """ Hold the lock file of user_id's tokens """
+        if self.lock_dir is None or fcntl is None:
+            yield
+            return
+        os.makedirs(self.lock_dir, exist_ok=True)
+        path = os.path.join(self.lock_dir,
+                            'oauth_user_{}.lock'.format(user_id))
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _load(user_id):
+        table = User.__table__
+        row = db.engine.execute(
+            select([table.c.digikey_oauth_token,
+                    table.c.digikey_oauth_refresh_token,
+                    table.c.digikey_oauth_token_expire]).
+            where(table.c.id == user_id)).first()
+        return Token(*row) if row is not None else None
+
+    def _refresh(self, user_id, token):
+        with self._process_lock(user_id):
+            try:
+                # Read and written with core statements so it is safe from
+                # worker threads that don't share the request's session.
+                stored = self._load(user_id)
+            except SQLAlchemyError as e:
+                raise TokenRefreshError('Could not read tokens: {}'.format(e))
+            if stored is not None and self._fresh(stored):
+                # refreshed by another process
+                with self._lock:
+                    self._tokens[user_id] = stored
+                return stored
+            if stored is not None and stored.refresh_token is not None:
+                token = stored
+            token = self._request(token)
+            try:
+                db.engine.execute(
+                    User.__table__.update().
+                    where(User.__table__.c.id == user_id).
+                    values(digikey_oauth_token=token.access_token,
+                           digikey_oauth_refresh_token=token.refresh_token,
+                           digikey_oauth_token_expire=token.expires))
+            except SQLAlchemyError as e:
+                with self._lock:
+                    self.refresh_failures += 1
+                raise TokenRefreshError('Could not store tokens: {}'.format(e))
+        with self._lock:
+            self._tokens[user_id] = token
+            self.refresh_count += 1
+        return token
+
+    def _request(self, token):
+        """ Refresh token with the provider """
+        if token.refresh_token is None:
+            raise TokenRefreshError('No refresh token available')
+        data = {'grant_type': 'refresh_token',
+                'refresh_token': token.refresh_token,
+                'client_id': self.client_id,
+                'client_secret': self.client_secret}
+        start = time.perf_counter()
+        try:
+            resp = self.post(self.token_url, data, self.timeout)
+            lifetime = timedelta(seconds=int(resp['expires_in']))
+            return Token(resp['access_token'],
+                         resp.get('refresh_token', token.refresh_token),
+                         datetime.now() + lifetime)
+        except Exception as e:
+            with self._lock:
+                self.refresh_failures += 1
+            raise TokenRefreshError('Token refresh failed: {}'.format(e))
+        finally:
+            self.refresh_latencies.append(time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        latencies = sorted(self.refresh_latencies)
+        return {'refreshes': self.refresh_count,
+                'failures': self.refresh_failures,
+                'latency_mean_s': (sum(latencies) / len(latencies)
+                                   if latencies else None),
+                'latency_max_s': latencies[-1] if latencies else None}
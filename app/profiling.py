@@ -0,0 +1,149 @@
+""" Opt-in cProfile profiling of requests
+
+A request is profiled if its endpoint is listed in PROFILE_ENDPOINTS, or if
+a user listed in ADMIN_EMAILS sends the PROFILE_HEADER header. Profiles are
+written to PROFILE_DIR, of which only the newest PROFILE_KEEP are kept, and
+can be listed and downloaded by admins on /admin/profiles.
+
+When no endpoints are listed and the header can't be used (no header name or
+no admins) the request hooks are not registered at all, so profiling adds no
+overhead.
+"""
+import os
+import re
+import json
+import time
+import pstats
+import cProfile
+from io import StringIO
+from datetime import datetime
+from functools import wraps
+
+from flask import g, request, render_template, send_file, Response
+from flask.helpers import NotFound
+from flask_login import current_user, login_required
+
+from app import app
+
+_profile_name = re.compile(r'^[\w.-]+\.prof$')
+_sort_keys = ('cumulative', 'tottime', 'ncalls')
+
+
+def is_admin(user):
+    return (user is not None and user.is_authenticated and
+            user.email in app.config['ADMIN_EMAILS'])
+
+
+app.jinja_env.globals['is_admin'] = is_admin
+
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin(current_user):
+            raise NotFound()
+        return view(*args, **kwargs)
+    return login_required(wrapper)
+
+
+def _wants_profile():
+    if request.endpoint in app.config['PROFILE_ENDPOINTS']:
+        return True
+    header = app.config['PROFILE_HEADER']
+    return bool(header and request.headers.get(header) and
+                is_admin(current_user))
+
+
+def _rotate(directory, keep):
+    profiles = sorted(name for name in os.listdir(directory)
+                      if name.endswith('.prof'))
+    for name in profiles[:max(len(profiles) - keep, 0)]:
+        for path in (name, name[:-len('.prof')] + '.json'):
+            try:
+                os.remove(os.path.join(directory, path))
+            except FileNotFoundError:
+                pass
+
+
+def save_profile(profile, endpoint, wall):
+    """ Write a finished profile and its request details to PROFILE_DIR """
+    directory = app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.now()
+    name = '{}_{}_{:.0f}ms'.format(now.strftime('%Y%m%dT%H%M%S_%f'),
+                                   endpoint, 1000 * wall)
+    profile.dump_stats(os.path.join(directory, name + '.prof'))
+    with open(os.path.join(directory, name + '.json'), 'w') as f:
+        json.dump({'timestamp': now.isoformat(),
+                   'endpoint': endpoint,
+                   'method': request.method,
+                   'path': request.full_path.rstrip('?'),
+                   'user': getattr(current_user, 'email', None),
+                   'wall_ms': 1000 * wall}, f)
+    _rotate(directory, app.config['PROFILE_KEEP'])
+    return name + '.prof'
+
+
+def _start_profile():
+    if _wants_profile():
+        g._profile = cProfile.Profile()
+        g._profile_start = time.perf_counter()
+        g._profile.enable()
+
+
+def _finish_profile(exc):
+    profile = g.pop('_profile', None)
+    if profile is None:
+        return
+    profile.disable()
+    wall = time.perf_counter() - g._profile_start
+    save_profile(profile, request.endpoint or 'unmatched', wall)
+
+
+if app.config['PROFILE_ENDPOINTS'] or (app.config['PROFILE_HEADER'] and
+                                       app.config['ADMIN_EMAILS']):
+    app.before_request(_start_profile)
+    app.teardown_request(_finish_profile)
+
+
+def list_profiles():
+    directory = app.config['PROFILE_DIR']
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith('.prof'):
+            continue
+        try:
+            with open(os.path.join(directory,
+                                   name[:-len('.prof')] + '.json')) as f:
+                info = json.load(f)
+        except (IOError, ValueError):
+            info = {}
+        info['name'] = name
+        profiles.append(info)
+    return profiles
+
+
+@app.route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    return render_template('admin_profiles.html', profiles=list_profiles())
+
+
+@app.route('/admin/profiles/<name>')
+@admin_required
+def admin_profile(name):
+    """ Download a profile, or with ?format=text view its top functions """
+    path = os.path.join(app.config['PROFILE_DIR'], name)
+    if not _profile_name.match(name) or not os.path.exists(path):
+        raise NotFound()
+    if request.args.get('format') == 'text':
+        out = StringIO()
+        stats = pstats.Stats(path, stream=out)
+        sort = request.args.get('sort')
+        stats.sort_stats(sort if sort in _sort_keys else 'cumulative').\
+            print_stats(60)
+        return Response(out.getvalue(), mimetype='text/plain')
+    return send_file(path, mimetype='application/octet-stream',
+                     as_attachment=True, attachment_filename=name)
@@ -0,0 +1,231 @@
+""" BOM revisions and their diffs
+
+A snapshot is a dict mapping each reference of a BOM to its
+(lookup_source, lookup_id). Revisions store their snapshot compressed, as a
+delta against the parent revision's snapshot when that is less than half the
+size of the full snapshot and the chain of deltas to the nearest full
+snapshot stays below BOM_REVISION_KEYFRAME_INTERVAL.
+
+Diffs are set operations on the snapshots: references only in one of them
+were added or removed, and references whose (reference, lookup) item is not
+in the other snapshot were changed. Decoded snapshots are kept in a small LRU
+cache keyed by the revision digest, so diffing a revision against its
+neighbours decodes every snapshot once.
+"""
+import json
+import hashlib
+from collections import Counter, OrderedDict
+from threading import Lock
+
+from sqlalchemy import select
+
+from app import app, db
+from .models import (BOMPart, BOMRevision, Part, VendorPart, compress,
+                     decompress)
+from .utils import chunks, reference_sort_key
+
+SNAPSHOT_CACHE_SIZE = 32
+
+_snapshots = OrderedDict()
+_snapshots_lock = Lock()
+
+
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+def bom_snapshot(bom):
+    """ Snapshot of a BOM's parts
+
+    Unless the BOM's parts are already loaded (eg. for a new BOM), the
+    columns are read directly so no BOMParts are created. Flush pending
+    changes to them first.
+    """
+    if bom.id is None or 'bomparts' in bom.__dict__:
+        return {bompart.reference: (bompart.lookup_source, bompart.lookup_id)
+                for bompart in bom.bomparts}
+    table = BOMPart.__table__
+    query = select([table.c.reference, table.c.lookup_source,
+                    table.c.lookup_id]).where(table.c.bom_id == bom.id)
+    return {reference: (source, lookup_id)
+            for reference, source, lookup_id in
+            db.session.execute(query)}
+
+
+def snapshot_digest(snapshot):
+    return hashlib.sha256(_dumps(snapshot).encode('utf-8')).hexdigest()
+
+
+def delta(old, new):
+    """ The changes from snapshot old to new, as stored for a revision """
+    return {'set': dict(new.items() - old.items()),
+            'removed': sorted(old.keys() - new.keys())}
+
+
+def _store(revision, snapshot, parent_snapshot=None):
+    """ Encode snapshot into revision, as a delta against parent_snapshot
+    if that pays off
+    """
+    content = {'set': snapshot}
+    revision.depth = 0
+    parent = revision.parent
+    if (parent_snapshot is not None and
+            parent.depth + 1 < app.config['BOM_REVISION_KEYFRAME_INTERVAL']):
+        changes = delta(parent_snapshot, snapshot)
+        if 2 * (len(changes['set']) + len(changes['removed'])) < \
+                len(snapshot):
+            content = changes
+            revision.depth = parent.depth + 1
+    revision.entries = len(snapshot)
+    revision.digest = snapshot_digest(snapshot)
+    revision.codec = app.config['BOM_REVISION_CODEC']
+    revision.data = compress(_dumps(content).encode('utf-8'), revision.codec)
+
+
+def get_snapshot(revision):
+    """ The snapshot of a revision, applying its deltas to its parent's """
+    key = (revision.id, revision.digest)
+    with _snapshots_lock:
+        if key in _snapshots:
+            _snapshots.move_to_end(key)
+            return dict(_snapshots[key])
+    content = json.loads(decompress(revision.data, revision.codec).
+                         decode('utf-8'))
+    if revision.depth:
+        snapshot = get_snapshot(revision.parent)
+        for reference in content['removed']:
+            del snapshot[reference]
+    else:
+        snapshot = {}
+    snapshot.update((reference, tuple(lookup))
+                    for reference, lookup in content['set'].items())
+    if revision.id is not None:
+        with _snapshots_lock:
+            _snapshots[key] = snapshot
+            while len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+                _snapshots.popitem(last=False)
+    return dict(snapshot)
+
+
+def latest_revision(project):
+    return BOMRevision.query.filter_by(project=project).\
+        order_by(BOMRevision.number.desc()).first()
+
+
+def record_revision(bom, parent=None):
+    """ Add a revision for a new BOM
+
+    Args:
+        bom: the new BillOfMaterials, its name is the project
+        parent: the revision it derives from, by default the latest revision
+            of the project
+    Returns:
+        The new BOMRevision, added to the session
+    """
+    project = bom.name or ''
+    if parent is None and project:
+        parent = latest_revision(project)
+    revision = BOMRevision()
+    revision.bom = bom
+    revision.project = project
+    revision.number = parent.number + 1 if parent is not None else 1
+    revision.parent = parent
+    _store(revision, bom_snapshot(bom),
+           get_snapshot(parent) if parent is not None else None)
+    db.session.add(revision)
+    return revision
+
+
+def refresh_revision(bom):
+    """ Update the snapshot of a BOM whose parts were edited
+
+    Revisions stored as deltas against it are first stored in full, since
+    their deltas were taken against its old snapshot.
+    """
+    revision = bom.revision
+    if revision is None:
+        return record_revision(bom)
+    for child in revision.children:
+        if child.depth:
+            _store(child, get_snapshot(child))
+    parent = revision.parent
+    _store(revision, bom_snapshot(bom),
+           get_snapshot(parent) if parent is not None else None)
+    return revision
+
+
+def _entry(reference, lookup):
+    return {'reference': reference,
+            'lookup_source': lookup[0],
+            'lookup_id': lookup[1]}
+
+
+def diff_snapshots(old, new):
+    """ Differences between two snapshots
+
+    Apart from counting the old snapshot's lookups, only the references that
+    differ are looked at after the set differences.
+
+    Returns:
+        A dict with the added, removed and changed references (each sorted
+        by reference), and under parts, every (lookup_source, lookup_id)
+        whose number of references changed, with its old and new count.
+    """
+    added = new.keys() - old.keys()
+    removed = old.keys() - new.keys()
+    changed = {reference for reference, _ in new.items() - old.items()
+               if reference in old}
+    # only the lookups of the references above can change their count
+    counts = Counter(new[reference] for reference in added | changed)
+    counts.subtract(old[reference] for reference in removed | changed)
+    old_counts = Counter(old.values()) if counts else {}
+    parts = [{'lookup_source': lookup[0],
+              'lookup_id': lookup[1],
+              'old_count': old_counts.get(lookup, 0),
+              'new_count': old_counts.get(lookup, 0) + change}
+             for lookup, change in counts.items() if change]
+    parts.sort(key=lambda part: (part['lookup_source'] or '',
+                                 part['lookup_id'] or ''))
+    return {'added': [_entry(reference, new[reference])
+                      for reference in sorted(added, key=reference_sort_key)],
+            'removed': [_entry(reference, old[reference])
+                        for reference in sorted(removed,
+                                                key=reference_sort_key)],
+            'changed': [{'reference': reference,
+                         'old': _entry(reference, old[reference]),
+                         'new': _entry(reference, new[reference])}
+                        for reference in sorted(changed,
+                                                key=reference_sort_key)],
+            'parts': parts}
+
+
+def diff_revisions(old, new):
+    """ diff_snapshots of two revisions, skipped if their digests match """
+    if old.digest == new.digest:
+        return diff_snapshots({}, {})
+    return diff_snapshots(get_snapshot(old), get_snapshot(new))
+
+
+def describe_lookups(lookups):
+    """ Manufacturer part number and description of vendor part numbers
+
+    Args:
+        lookups: (lookup_source, lookup_id) tuples
+    Returns:
+        A dict mapping the lookups known in the db to
+        (manufacturer_part_number, short_description)
+    """
+    wanted = set(lookups)
+    described = {}
+    for chunk in chunks(sorted({lookup_id for _, lookup_id in wanted
+                                if lookup_id is not None}), 500):
+        query = db.session.query(VendorPart.vendor,
+                                 VendorPart.vendor_part_number,
+                                 Part.manufacturer_part_number,
+                                 Part.short_description).\
+            join(Part, VendorPart.part_id == Part.id).\
+            filter(VendorPart.vendor_part_number.in_(chunk))
+        for vendor, vendor_part_number, mpn, description in query:
+            if (vendor, vendor_part_number) in wanted:
+                described[(vendor, vendor_part_number)] = (mpn, description)
+    return described
@@ -0,0 +1,214 @@
+""" Part search backed by an SQLite FTS5 index
+
+The part_search virtual table holds one row per Part (rowid == part.id) with
+the manufacturer part number, description, manufacturer and all vendor part
+numbers of the part. It is kept up to date by mapper events on Part and
+VendorPart, so it never needs a full rebuild outside of migrations. If the
+SQLite build lacks FTS5, searches fall back to LIKE matching.
+"""
+import re
+import difflib
+import logging
+from collections import defaultdict
+
+from sqlalchemy import event, text, or_, and_, func
+from sqlalchemy.orm import defer
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from .models import Part, VendorPart, Manufacturer
+
+log = logging.getLogger(__name__)
+
+MAX_RESULTS = 1000
+_token_regex = re.compile(r'[\w\-\.]+', flags=re.UNICODE)
+
+_create_index_sql = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS part_search USING fts5("
+    "manufacturer_part_number, short_description, manufacturer, "
+    "vendor_part_numbers, "
+    "tokenize = \"unicode61 tokenchars '-.'\", prefix = '2 3 4')")
+_create_vocab_sql = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS part_search_vocab "
+    "USING fts5vocab(part_search, 'row')")
+_fts_available = None
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_search_index(target, connection, **kw):
+    global _fts_available
+    try:
+        connection.execute(text(_create_index_sql))
+        connection.execute(text(_create_vocab_sql))
+    except OperationalError as e:
+        log.warning('FTS5 unavailable, part search will use LIKE: %s', e)
+    _fts_available = None
+
+
+def fts_available(connection=None):
+    global _fts_available
+    if _fts_available is None:
+        executor = connection if connection is not None else db.session
+        query = text("SELECT 1 FROM sqlite_master "
+                     "WHERE type = 'table' AND name = 'part_search'")
+        try:
+            _fts_available = executor.execute(query).first() is not None
+        except OperationalError:
+            _fts_available = False
+    return _fts_available
+
+
+def reindex_part(connection, part_id):
+    """ Replace the index row of a single part """
+    if part_id is None or not fts_available(connection):
+        return
+    connection.execute(text("DELETE FROM part_search WHERE rowid = :id"),
+                       id=part_id)
+    connection.execute(text(
+        "INSERT INTO part_search(rowid, manufacturer_part_number, "
+        "short_description, manufacturer, vendor_part_numbers) "
+        "SELECT part.id, part.manufacturer_part_number, "
+        "part.short_description, part.manufacturer, "
+        "(SELECT group_concat(DISTINCT vendorpart.vendor_part_number) "
+        " FROM vendorpart WHERE vendorpart.part_id = part.id) "
+        "FROM part WHERE part.id = :id"), id=part_id)
+
+
+def record_manufacturer(connection, manufacturer):
+    if manufacturer is None:
+        return
+    table = Manufacturer.__table__
+    connection.execute(table.insert().prefix_with('OR IGNORE'),
+                       name=manufacturer)
+
+
+@event.listens_for(Part, 'after_insert')
+@event.listens_for(Part, 'after_update')
+def _part_changed(mapper, connection, target):
+    record_manufacturer(connection, target.manufacturer)
+    reindex_part(connection, target.id)
+
+
+@event.listens_for(Part, 'after_delete')
+def _part_deleted(mapper, connection, target):
+    if fts_available(connection):
+        connection.execute(text("DELETE FROM part_search WHERE rowid = :id"),
+                           id=target.id)
+
+
+@event.listens_for(VendorPart, 'after_insert')
+@event.listens_for(VendorPart, 'after_update')
+def _vendorpart_changed(mapper, connection, target):
+    reindex_part(connection, target.part_id)
+
+
+def manufacturers():
+    """ The sorted list of distinct manufacturers of all parts """
+    query = db.session.query(Manufacturer.name).order_by(Manufacturer.name)
+    return [name for name, in query]
+
+
+def _tokens(query_string):
+    return [token.lower() for token in _token_regex.findall(query_string)]
+
+
+def _fuzzy_terms(token, n=3, cutoff=0.75):
+    """ Find indexed terms close to token that share its first character """
+    query = text("SELECT term FROM part_search_vocab "
+                 "WHERE term >= :lo AND term < :hi")
+    first = token[0]
+    rows = db.session.execute(query, {'lo': first,
+                                      'hi': chr(ord(first)+1)})
+    terms = [term for term, in rows]
+    return difflib.get_close_matches(token, terms, n=n, cutoff=cutoff)
+
+
+def _match_expression(token_groups):
+    """ Build an FTS5 MATCH expression, AND-ing groups of OR-ed terms """
+    groups = []
+    for terms in token_groups:
+        alternatives = ['"{}"*'.format(term.replace('"', '""'))
+                        for term in terms]
+        groups.append('(' + ' OR '.join(alternatives) + ')')
+    return ' AND '.join(groups)
+
+
+def _fts_search(token_groups, limit):
+    query = text("SELECT rowid FROM part_search WHERE part_search MATCH :q "
+                 "ORDER BY bm25(part_search, 10.0, 2.0, 1.0, 5.0) "
+                 "LIMIT :limit")
+    rows = db.session.execute(query, {'q': _match_expression(token_groups),
+                                      'limit': limit})
+    return [id_ for id_, in rows]
+
+
+def _like_search(tokens, limit):
+    query = db.session.query(Part.id).\
+        outerjoin(VendorPart, VendorPart.part_id == Part.id)
+    for token in tokens:
+        pattern = '%{}%'.format(token)
+        query = query.filter(or_(Part.manufacturer_part_number.ilike(pattern),
+                                 Part.short_description.ilike(pattern),
+                                 VendorPart.vendor_part_number.ilike(pattern)))
+    query = query.distinct().order_by(Part.manufacturer_part_number)
+    return [id_ for id_, in query.limit(limit)]
+
+
+def search_part_ids(query_string, fuzzy=True, limit=MAX_RESULTS):
+    """ Search parts by MPN, description and vendor part numbers
+
+    Every word of the query must match (as a prefix) one of the indexed
+    fields. Results are ranked with bm25, weighting matches on the
+    manufacturer part number and vendor part numbers highest. If nothing
+    matches and fuzzy is set, each word is replaced by the closest indexed
+    terms and the search is repeated.
+
+    Returns:
+        A list of matching Part ids, best match first
+    """
+    tokens = _tokens(query_string)
+    if not tokens:
+        return []
+    if not fts_available():
+        return _like_search(tokens, limit)
+    ids = _fts_search([[token] for token in tokens], limit)
+    if ids or not fuzzy:
+        return ids
+    token_groups = []
+    for token in tokens:
+        terms = _fuzzy_terms(token)
+        if not terms:
+            return []
+        token_groups.append(terms)
+    return _fts_search(token_groups, limit)
+
+
+def latest_vendorparts(part_ids):
+    """ Load the most recent VendorPart of every vendor for the given parts
+
+    Uses a single query regardless of the number of parts and skips the
+    fetch history, so only the displayed price breaks get unpickled.
+
+    Returns:
+        A dict mapping part ids to lists of VendorParts sorted by vendor
+    """
+    if not part_ids:
+        return {}
+    latest = db.session.query(
+        VendorPart.part_id,
+        VendorPart.vendor,
+        func.max(VendorPart.fetch_timestamp).label('fetch_timestamp')).\
+        filter(VendorPart.part_id.in_(part_ids)).\
+        group_by(VendorPart.part_id, VendorPart.vendor).\
+        subquery()
+    query = VendorPart.query.\
+        join(latest, and_(VendorPart.part_id == latest.c.part_id,
+                          VendorPart.vendor == latest.c.vendor,
+                          VendorPart.fetch_timestamp ==
+                          latest.c.fetch_timestamp)).\
+        options(defer(VendorPart.json)).\
+        order_by(VendorPart.vendor)
+    vendorparts = defaultdict(list)
+    for vendorpart in query:
+        vendorparts[vendorpart.part_id].append(vendorpart)
+    return vendorparts
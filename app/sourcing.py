@@ -0,0 +1,197 @@
+""" Cheapest-offer sourcing of orders across vendors
+
+An order needs every Part of its BOMs in the sum, over the BOMs, of the BOM
+count times the number of references to the part. For each Part the latest
+VendorPart of every vendor is an offer, priced with its price breaks at the
+needed quantity, and the cheapest priced offer is ordered. The order is
+then split by vendor.
+
+Everything is computed from two queries for the whole order (the quantities
+and the offers), so no BOMParts or VendorParts are loaded.
+"""
+from bisect import bisect_right
+from collections import namedtuple, defaultdict
+
+from sqlalchemy import select, func, and_
+
+from app import db
+from .models import BOMPart, VendorPart
+from .utils import chunks
+
+Offer = namedtuple('Offer', ('vendorpart_id', 'part_id', 'vendor',
+                             'vendor_part_number', 'quantities', 'prices'))
+
+# unit_price and cost are None when no offer has a price break at quantity
+Line = namedtuple('Line', ('part_id', 'quantity', 'vendorpart_id', 'vendor',
+                           'vendor_part_number', 'unit_price', 'cost'))
+
+
+def make_offer(vendorpart_id, part_id, vendor, vendor_part_number,
+               price_breaks):
+    breaks = sorted((break_['BreakQuantity'], break_['UnitPrice'])
+                    for break_ in price_breaks or ())
+    return Offer(vendorpart_id, part_id, vendor, vendor_part_number,
+                 tuple(quantity for quantity, _ in breaks),
+                 tuple(price for _, price in breaks))
+
+
+def unit_price(offer, quantity):
+    """ The unit price of an offer for quantity, as
+    VendorPart.get_pricebreak, or None if quantity is below its smallest
+    price break
+    """
+    if not offer.quantities:
+        return None
+    if quantity == 0:
+        return offer.prices[0]
+    i = bisect_right(offer.quantities, quantity)
+    return offer.prices[i-1] if i else None
+
+
+def latest_offers(part_ids):
+    """ The latest VendorPart of every vendor for the given parts
+
+    Returns:
+        A dict mapping part ids to lists of Offers sorted by vendor
+    """
+    table = VendorPart.__table__
+    offers = defaultdict(dict)
+    for chunk in chunks(sorted(set(part_ids)), 500):
+        latest = select([table.c.part_id, table.c.vendor,
+                         func.max(table.c.fetch_timestamp).
+                         label('fetch_timestamp')]).\
+            where(table.c.part_id.in_(chunk)).\
+            group_by(table.c.part_id, table.c.vendor).\
+            alias()
+        query = select([table.c.id, table.c.part_id, table.c.vendor,
+                        table.c.vendor_part_number, table.c.price_breaks]).\
+            select_from(table.join(latest, and_(
+                table.c.part_id == latest.c.part_id,
+                table.c.vendor == latest.c.vendor,
+                table.c.fetch_timestamp == latest.c.fetch_timestamp))).\
+            order_by(table.c.id)
+        for row in db.session.execute(query):
+            # on equal fetch timestamps the newest row wins
+            offers[row.part_id][row.vendor] = make_offer(*row)
+    return {part_id: [by_vendor[vendor] for vendor in sorted(by_vendor)]
+            for part_id, by_vendor in offers.items()}
+
+
+def required_quantities(bom_counts):
+    """ The quantity of every Part needed for bom_counts
+
+    Args:
+        bom_counts: a dict mapping BOM ids to the number of boards ordered
+    Returns:
+        A tuple (quantities, sources, unlinked). quantities maps part ids to
+        the quantity needed, sources maps part ids to the set of vendors
+        named in the schematics, and unlinked maps the
+        (lookup_source, lookup_id) of BOMParts without a Part to the
+        quantity needed.
+    """
+    table = BOMPart.__table__
+    quantities, sources = defaultdict(int), defaultdict(set)
+    unlinked = defaultdict(int)
+    for chunk in chunks(sorted(bom_counts), 500):
+        query = select([table.c.bom_id, table.c.part_id,
+                        table.c.lookup_source, table.c.lookup_id,
+                        func.count()]).\
+            where(table.c.bom_id.in_(chunk)).\
+            group_by(table.c.bom_id, table.c.part_id, table.c.lookup_source,
+                     table.c.lookup_id)
+        for bom_id, part_id, source, lookup_id, count in \
+                db.session.execute(query):
+            if part_id is None:
+                unlinked[(source, lookup_id)] += count * bom_counts[bom_id]
+                continue
+            quantities[part_id] += count * bom_counts[bom_id]
+            if source is not None:
+                sources[part_id].add(source)
+    return dict(quantities), dict(sources), dict(unlinked)
+
+
+def choose_offer(quantity, offers, preferred=()):
+    """ The cheapest of offers for quantity
+
+    Ties go to the preferred vendors, then by vendor name. If no offer has a
+    price at quantity, an offer of a preferred vendor (or else the first
+    one) is returned with no price, so the part still appears in the order.
+
+    Returns:
+        A tuple (offer, unit_price), (None, None) without offers
+    """
+    best, best_key = None, None
+    for offer in offers:
+        price = unit_price(offer, quantity)
+        if price is None:
+            continue
+        key = (price * quantity, offer.vendor not in preferred, offer.vendor)
+        if best_key is None or key < best_key:
+            best, best_key = (offer, price), key
+    if best is not None:
+        return best
+    for offer in offers:
+        if offer.vendor in preferred:
+            return offer, None
+    return (offers[0], None) if offers else (None, None)
+
+
+class Sourcing:
+    """ The offers chosen for an order
+
+    Attributes:
+        lines: a list of Lines, one per Part, sorted by vendor and vendor
+            part number
+        unlinked: a dict mapping the (lookup_source, lookup_id) of BOMParts
+            that were not looked up yet to the quantity needed
+        missing: a dict mapping the ids of Parts without any VendorPart to
+            the quantity needed
+    """
+
+    def __init__(self, lines, unlinked, missing):
+        self.lines = lines
+        self.unlinked = unlinked
+        self.missing = missing
+
+    def by_vendor(self):
+        """ The lines split by vendor, a dict mapping vendors to lines """
+        split = defaultdict(list)
+        for line in self.lines:
+            split[line.vendor].append(line)
+        return dict(split)
+
+    def totals(self):
+        """ A dict mapping vendors to the total cost of their priced lines """
+        totals = defaultdict(float)
+        for line in self.lines:
+            totals[line.vendor] += line.cost or 0
+        return dict(totals)
+
+    @property
+    def unpriced(self):
+        """ The lines without a price break at their quantity """
+        return [line for line in self.lines if line.cost is None]
+
+
+def source_order(bom_counts):
+    """ Choose the cheapest offer for every Part of an order
+
+    Args:
+        bom_counts: a dict mapping BOM ids to the number of boards ordered
+    Returns:
+        A Sourcing
+    """
+    quantities, sources, unlinked = required_quantities(bom_counts)
+    offers = latest_offers(quantities)
+    lines, missing = [], {}
+    for part_id, quantity in quantities.items():
+        offer, price = choose_offer(quantity, offers.get(part_id, ()),
+                                    sources.get(part_id, ()))
+        if offer is None:
+            missing[part_id] = quantity
+            continue
+        lines.append(Line(part_id, quantity, offer.vendorpart_id,
+                          offer.vendor, offer.vendor_part_number, price,
+                          price * quantity if price is not None else None))
+    lines.sort(key=lambda line: (line.vendor, line.vendor_part_number or ''))
+    return Sourcing(lines, unlinked, missing)
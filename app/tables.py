@@ -1,6 +1,3 @@
-import re
-from itertools import groupby
-
 from flask import flash
 from flask_table import Table, Col, LinkCol, DatetimeCol, BoolCol
 from flask.ext.wtf import Form
@@ -156,32 +153,8 @@ class BOMPartTableShort(Table):
     count = Col('Count', td_kwargs={'class': 'text-right'})
     references = Col('Refs')
 
-    def __init__(self, items, **kwargs):
-        items.sort(key=lambda x: int(re.findall('[0-9]+', x.reference)[0]))
-        items.sort(key=lambda x: re.findall('[A-Z]+', x.reference)[0])
-        item_dicts = []
-
-        def keyfunc(item):
-            if item.part is None:
-                return ('', '')
-            return (item.part.manufacturer, item.part.manufacturer_part_number)
-        groups = groupby(sorted(items, key=keyfunc), keyfunc)
-        for key, item_list in groups:
-            if key == ('', ''):
-                continue
-            manufacturer, manufacturer_part_number = key
-
-            item_list = list(item_list)
-            short_description = item_list[0].part.short_description
-            count = len(item_list)
-            references = ', '.join(part.reference for part in item_list)
-            item_dict = {'manufacturer': manufacturer,
-                         'short_description': short_description,
-                         'manufacturer_part_number': manufacturer_part_number,
-                         'count': count,
-                         'references': references}
-            item_dicts.append(item_dict)
-        super().__init__(item_dicts, **kwargs)
+    def __init__(self, bom, **kwargs):
+        super().__init__(bom.condensed_parts(), **kwargs)
 
 
 class BOMPartTableFull(Table):
@@ -194,8 +167,6 @@ class BOMPartTableFull(Table):
     manufacturer_part_number = Col('Manufacturer Part #')
 
     def __init__(self, items, **kwargs):
-        items.sort(key=lambda x: int(re.findall("[0-9]+", x.reference)[0]))
-        items.sort(key=lambda x: re.findall("[A-Z]+", x.reference)[0])
         item_dicts = []
         for item in items:
             if item.lookup_id is None:
@@ -1,3 +1,4 @@
+import re
 import string
 from typing import List
 
@@ -40,3 +41,28 @@ def sanitize_filename(filename: str, ext: str = None) -> str:
         return "{}.{}".format(sane_fname, ext)
     else:
         return sane_fname
+
+
+_reference_regex = re.compile(r'^([^0-9]*)([0-9]*)(.*)$', flags=re.DOTALL)
+
+
+def reference_sort_key(reference: str) -> str:
+    """ Build a natural-sort key for a schematic reference
+
+    Splits the reference into a non-numeric prefix, a number, and a suffix
+    (eg. 'R12a' -> 'R', '12', 'a') and combines them into a string that sorts
+    naturally with plain string comparison, so it can be stored in the db and
+    used directly in an ORDER BY. References without a number (eg. 'U' or
+    '#PWR') sort before numbered references with the same prefix.
+
+    Args:
+        reference: the component reference (eg. 'C12')
+    Returns:
+        the sort key
+    """
+    if reference is None:
+        return None
+    prefix, number, suffix = _reference_regex.match(reference).groups()
+    if number:
+        number = number.zfill(10)
+    return '{} {}{}'.format(prefix, number, suffix)
@@ -1,13 +1,18 @@
-import json
 from datetime import datetime, timedelta
 from collections import defaultdict
-from urllib.parse import quote_plus
 from flask import redirect, flash, url_for, g
-from sqlalchemy import desc
-from app import app, oauth, db
-from .models import VendorPart, Part, Order_VendorPart, Order
+from sqlalchemy import func, case, select
+from app import app, db
+from .models import (VendorPart, VendorPayload, Part, PriceHistory,
+                     Order_VendorPart, Order)
+from .utils import chunks
+from .images import prefetch_part_images
+from . import where_used
+from .oauth_tokens import TokenManager
+from .async_fetch import Credentials, LookupFailed, fetch_parts
 
 ONE_DAY = timedelta(days=1)
+MISSING_PART_IMAGE = '/static/missing_part.png'
 
 
 class Digikey():
@@ -20,11 +25,30 @@ class Digikey():
     form_info['website'] = 'www.digikey.com'
 
     def __init__(self):
-        self.oauth = oauth.remote_app('Digikey',
-                                      app_key='DIGIKEY',
-                                      request_token_url=None,)
-        self.oauth.tokengetter(Digikey.tokengetter)
+        self._oauth = None
         self.name = 'Digikey'
+        margin = timedelta(seconds=app.config['OAUTH_REFRESH_MARGIN'])
+        self.tokens = TokenManager(app.config['DIGIKEY_ACCESS_TOKEN_URL'],
+                                   app.config['DIGIKEY_CONSUMER_KEY'],
+                                   app.config['DIGIKEY_CONSUMER_SECRET'],
+                                   margin=margin,
+                                   lock_dir=app.config['OAUTH_LOCK_DIR'])
+
+    @property
+    def oauth(self):
+        """ The flask_oauthlib remote app, registered on first use
+
+        Only the login flow needs it, so scripts and workers that only read
+        parts don't import flask_oauthlib.
+        """
+        if self._oauth is None:
+            from flask_oauthlib.client import OAuth
+            oauth = app.extensions.get('oauthlib.client') or OAuth(app)
+            self._oauth = oauth.remote_app('Digikey',
+                                           app_key='DIGIKEY',
+                                           request_token_url=None,)
+            self._oauth.tokengetter(self.tokengetter)
+        return self._oauth
 
     def login(self):
         """ User Authorization.
@@ -60,27 +84,36 @@ class Digikey():
     def logged_on(self):
         """ Checks if logged on
 
-        Returns True if the user has authorized the app
+        Returns True if the user has authorized the app. An expired token
+        still counts if it can be refreshed.
         """
         if g.user.digikey_oauth_token is None:
             return False
+        elif g.user.digikey_oauth_refresh_token is not None:
+            return True
         elif g.user.digikey_oauth_token_expire < datetime.now():
             return False
         else:
             return True
 
-    @staticmethod
-    def tokengetter():
-        return g.user.digikey_oauth_token, ''
+    def tokengetter(self):
+        return self.tokens.get_token(g.user), ''
 
-    def part_from_response(self, response):
-        vendorpart = VendorPart()
-        vendorpart.json = json.dumps(response)
-        vendorpart.vendor = 'Digikey'
-        vendorpart.vendor_part_number = response['vendor_part_number']
-        vendorpart.fetch_timestamp = datetime.now()
-        vendorpart.price_breaks = response['Pricing']
-        vendorpart.url = response['PartDetailUrl']
+    def credentials(self, user):
+        """ Credentials for the async fetch engine on behalf of user """
+        return Credentials(app.config['DIGIKEY_CONSUMER_KEY'],
+                           self.tokens.for_user(user))
+
+    def part_from_response(self, response, previous=None):
+        """ Build a VendorPart from a raw part dict
+
+        If previous, the most recent VendorPart for the same vendor part
+        number, has the same part, price breaks and url it is updated in
+        place and returned instead of creating a new row.
+        """
+        now = datetime.now()
+        price_breaks = response['Pricing']
+        url = response['PartDetailUrl']
         manufacturer = response['ManufacturerName']['Text']
         mpn = response['ManufacturerPartNumber']
         query = Part.query
@@ -95,64 +128,42 @@ class Digikey():
             try:
                 part.image_url = response['PrimaryPhoto']['smallPhotoField']
             except KeyError:
-                part.image_url = url_for('static', filename='missing_part.png')
+                part.image_url = MISSING_PART_IMAGE
+        payload = VendorPayload.from_response(response)
+        if previous is not None and previous.part is part and \
+                previous.price_breaks == price_breaks and previous.url == url:
+            # Nothing we track changed, only note that it's still current
+            previous.payload = payload
+            previous.last_seen = now
+            return previous
+        vendorpart = VendorPart()
+        vendorpart.payload = payload
+        vendorpart.vendor = 'Digikey'
+        vendorpart.vendor_part_number = response['vendor_part_number']
+        vendorpart.fetch_timestamp = now
+        vendorpart.last_seen = now
+        vendorpart.price_breaks = price_breaks
+        vendorpart.url = url
         vendorpart.part = part
+        if previous is None or previous.price_breaks != price_breaks:
+            part.price_history.append(PriceHistory.from_vendorpart(vendorpart))
         return vendorpart
 
-    def query(self, bompart):
-        """ Query API for part info
-
-        Takes a BOMPart object and uses the lookup_id field to
-        query the Digikey API for more part info. Returns a
-        newly created VendorPart. Will also create a Part
-        if necessary. Returns None if problems were encountered.
-        """
-        if not self.logged_on:
-            return None
-
-        headers = {
-            'accept': "*/*",
-            'x-ibm-client-id': self.oauth.consumer_key,
-            'X-DIGIKEY-Locale-Language': 'en',
-            'X-DIGIKEY-Locale-Site': 'us',
-            'X-DIGIKEY-Locale-Currency': 'usd',
-            'X-DIGIKEY-Locale-ShipToCountry': 'us',
-            'content-type': "application/json",
-            }
-        data = {'PartNumber': quote_plus(bompart.lookup_id),
-                'Quantity': 1,
-                'PartPreference': 'CT'}
-
-        try:
-            resp = self.oauth.post('search',
-                                   format='json',
-                                   data=data,
-                                   headers=headers)
-        except json.decoder.JSONDecodeError as e:
-            flash(('Error Looking up part {}! '
-                   'JSONDecodeError {}').format(bompart.lookup_id, e),
-                  category='warning')
-            return None
-        if resp.status != 200:
-            flash(('Error Looking up part {}! '
-                   'API returned {}').format(bompart.lookup_id, resp.status),
-                  category='warning')
-            return None
-        part_raw = resp.data['Parts'][0]
-        part_raw['vendor'] = 'Digikey'
-        part_raw['vendor_part_number'] = bompart.lookup_id
-        vendorpart = self.part_from_response(part_raw)
-        bompart.part = vendorpart.part
-        db.session.add(vendorpart.part)
-        db.session.add(bompart)
-        db.session.add(vendorpart)
-        db.session.commit()
-        return vendorpart
 
 # This maps the vendor names to the vendor objects
 vendors = {'Digikey': Digikey()}
 
 
+def form_info(vendor_name):
+    """ The address and contact details of a vendor for requisition forms """
+    vendor = vendors.get(vendor_name)
+    if vendor is not None:
+        return vendor.form_info
+    info = defaultdict(str)
+    info['long_name'] = vendor_name
+    return info
+
+
 @app.route("/oauth_callback/<vendor_name>", methods=["GET"])
 def oauth_callback(vendor_name=""):
     """ Retrieve an access token.
@@ -166,40 +177,188 @@ def oauth_callback(vendor_name=""):
     return vendor.callback()
 
 
-def populate_part(bompart):
-    # First, search for matching vendorpart
-    query = VendorPart.query
-    vendorpart = db.session.query(VendorPart).\
-        filter(VendorPart.vendor == bompart.lookup_source,
-               VendorPart.vendor_part_number == bompart.lookup_id).\
-        order_by(desc(VendorPart.fetch_timestamp)).first()
-    if vendorpart and (datetime.now() - vendorpart.fetch_timestamp) < ONE_DAY:
-        # found a matching vendorpart *and* it is not outdated
-        bompart.part = vendorpart.part
-        db.session.add(bompart)
-    elif bompart.lookup_source is not None:
-        # no matching and up-to-date vendorpart found.
-        # Search for a new one, and if needed update any
-        # non-archived Order_VendorParts in db
-        vendorpart = vendors[bompart.lookup_source].query(bompart)
-        if vendorpart is None:
-            fmt = "Error Looking up Part {} from {}."
-            flash(fmt.format(bompart.lookup_id, bompart.lookup_source))
-            return
-        vendor = vendorpart.vendor
-        vpn = vendorpart.vendor_part_number
-        query = db.session.query(Order_VendorPart).\
-            join(VendorPart, Order_VendorPart.vendorpart_id == VendorPart.id).\
+def latest_by_vendor_part_number(keys):
+    """ The most recent VendorPart for each (vendor, vendor_part_number) key
+
+    Returns:
+        A dict mapping the keys to VendorParts, keys without any VendorPart
+        are left out.
+    """
+    keys = set(keys)
+    vpns = sorted({vpn for _, vpn in keys})
+    latest = {}
+    for vpns_chunk in chunks(vpns, 500):
+        newest = db.session.query(
+            VendorPart.vendor,
+            VendorPart.vendor_part_number,
+            func.max(VendorPart.fetch_timestamp).label('fetch_timestamp')).\
+            filter(VendorPart.vendor_part_number.in_(vpns_chunk)).\
+            group_by(VendorPart.vendor, VendorPart.vendor_part_number).\
+            subquery()
+        query = VendorPart.query.join(
+            newest, (VendorPart.vendor == newest.c.vendor) &
+            (VendorPart.vendor_part_number == newest.c.vendor_part_number) &
+            (VendorPart.fetch_timestamp == newest.c.fetch_timestamp))
+        for vendorpart in query:
+            key = (vendorpart.vendor, vendorpart.vendor_part_number)
+            if key in keys:
+                latest[key] = vendorpart
+    return latest
+
+
+def refresh_vendorparts(keys, credentials, max_age=ONE_DAY, **kwargs):
+    """ Look up outdated vendor parts concurrently and store the results
+
+    Vendors without an API (not in vendors) are never looked up, their
+    latest VendorParts are kept as they are.
+
+    Args:
+        keys: (vendor, vendor_part_number) tuples to refresh
+        credentials: a dict mapping vendor names to async_fetch.Credentials
+        max_age: VendorParts fetched more recently than this are reused
+        kwargs: passed on to the fetch engine
+    Returns:
+        A tuple of (latest, fetched, errors, stats). latest maps every key
+        with a VendorPart to its newest VendorPart, fetched lists the keys
+        that were looked up successfully, errors is a list of error messages,
+        and stats is a list of the engines' FetchStats.
+    """
+    keys = set(keys)
+    latest = latest_by_vendor_part_number(keys)
+    now = datetime.now()
+    stale = sorted(key for key in keys
+                   if key not in latest or
+                   now - latest[key].last_seen >= max_age)
+    fetched, errors, stats = [], [], []
+    by_vendor = defaultdict(list)
+    for vendor, vpn in stale:
+        by_vendor[vendor].append(vpn)
+    for vendor_name, vpns in by_vendor.items():
+        if vendor_name not in vendors:
+            errors.extend('Unknown vendor {} for part {}'.format(vendor_name,
+                                                                 vpn)
+                          for vpn in vpns
+                          if (vendor_name, vpn) not in latest)
+            continue
+        if vendor_name not in credentials:
+            errors.extend('Not logged into {} for part {}'.format(vendor_name,
+                                                                   vpn)
+                          for vpn in vpns)
+            continue
+        results, vendor_stats = fetch_parts(vpns, credentials[vendor_name],
+                                            **kwargs)
+        stats.append(vendor_stats)
+        vendor = vendors[vendor_name]
+        for vpn, result in results.items():
+            if isinstance(result, LookupFailed):
+                errors.append(str(result))
+                continue
+            vendorpart = vendor.part_from_response(
+                result, latest.get((vendor_name, vpn)))
+            db.session.add(vendorpart)
+            latest[(vendor_name, vpn)] = vendorpart
+            fetched.append((vendor_name, vpn))
+    db.session.flush()
+    return latest, fetched, errors, stats
+
+
+def repoint_open_orders_bulk(vendorparts):
+    """ Re-point the lines of all open orders at refreshed VendorParts
+
+    Finds the open order lines whose VendorPart has the same vendor and
+    vendor part number as one of the given VendorParts and updates them with
+    a single CASE based UPDATE (split only to stay below SQLite's bound
+    parameter limit).
+
+    Args:
+        vendorparts: a dict mapping (vendor, vendor_part_number) to the new,
+            flushed, VendorPart
+    Returns:
+        The number of order lines updated
+    """
+    if not vendorparts:
+        return 0
+    new_ids = {key: vendorpart.id for key, vendorpart in vendorparts.items()}
+    vpns = sorted({vpn for _, vpn in new_ids})
+    old_to_new = {}
+    for vpns_chunk in chunks(vpns, 500):
+        query = db.session.query(VendorPart.id,
+                                 VendorPart.vendor,
+                                 VendorPart.vendor_part_number).\
+            join(Order_VendorPart,
+                 Order_VendorPart.vendorpart_id == VendorPart.id).\
             join(Order, Order_VendorPart.order_id == Order.id).\
-            filter(VendorPart.vendor == vendor).\
-            filter(VendorPart.vendor_part_number == vpn).\
-            filter(Order.archived == False)
-        for order_vendorpart in query.all():
-            order_vendorpart.vendorpart = vendorpart
-            db.session.add(order_vendorpart)
+            filter(Order.archived == False).\
+            filter(VendorPart.vendor_part_number.in_(vpns_chunk)).\
+            distinct()
+        for old_id, vendor, vpn in query:
+            new_id = new_ids.get((vendor, vpn))
+            if new_id is not None and new_id != old_id:
+                old_to_new[old_id] = new_id
+    table = Order_VendorPart.__table__
+    orders = Order.__table__
+    open_orders = select([orders.c.id]).where(orders.c.archived == False)
+    updated = 0
+    order_ids = set()
+    for old_ids in chunks(sorted(old_to_new), 300):
+        lines = select([table.c.order_id]).\
+            where(table.c.vendorpart_id.in_(old_ids)).\
+            where(table.c.order_id.in_(open_orders)).\
+            distinct()
+        order_ids.update(id_ for id_, in db.session.execute(lines))
+        stmt = table.update().\
+            where(table.c.vendorpart_id.in_(old_ids)).\
+            where(table.c.order_id.in_(open_orders)).\
+            values(vendorpart_id=case(
+                [(table.c.vendorpart_id == old_id, old_to_new[old_id])
+                 for old_id in old_ids],
+                else_=table.c.vendorpart_id))
+        updated += db.session.execute(stmt).rowcount
+    # the UPDATE bypasses the session, so the where-used index is not kept
+    # in sync by its flush hook
+    where_used.rebuild_orders(db.session.connection(), order_ids)
+    return updated
+
+
+def refresh_bomparts(bomparts, credentials, **kwargs):
+    """ Link BOMParts to Parts, looking up outdated vendor parts concurrently
+
+    Vendor parts fetched within the last day are reused. All others are
+    looked up at once with the async fetch engine and stored as new
+    VendorParts, and the open order lines of all of them are re-pointed with
+    one set-based UPDATE. Works without a request context.
+
+    Args:
+        bomparts: the BOMParts to populate
+        credentials: a dict mapping vendor names to async_fetch.Credentials
+        kwargs: passed on to the fetch engine
+    Returns:
+        A tuple of (errors, stats) with a list of error messages and a list
+        of the engines' FetchStats
+    """
+    bomparts = [bompart for bompart in bomparts
+                if bompart.lookup_source is not None]
+    keys = {(bompart.lookup_source, bompart.lookup_id)
+            for bompart in bomparts}
+    latest, fetched, errors, stats = refresh_vendorparts(keys, credentials,
+                                                         **kwargs)
+    repoint_open_orders_bulk({key: latest[key] for key in fetched})
+    for bompart in bomparts:
+        vendorpart = latest.get((bompart.lookup_source, bompart.lookup_id))
+        if vendorpart is not None:
+            bompart.part = vendorpart.part
     db.session.commit()
+    return errors, stats
 
 
 def populate_parts(bom):
-    for bompart in bom.bomparts:
-        populate_part(bompart)
+    user = g.user
+    credentials = {name: vendor.credentials(user)
+                   for name, vendor in vendors.items()
+                   if vendor.logged_on}
+    errors, _ = refresh_bomparts(bom.bomparts, credentials)
+    for error in errors:
+        flash(error, category='warning')
+    prefetch_part_images(bompart.part for bompart in bom.bomparts)
+    bom.content_version = (bom.content_version or 0) + 1
+    db.session.commit()
@@ -1,14 +1,15 @@
-from collections import defaultdict
 from datetime import datetime as dt
 
-from flask import (request, redirect, url_for, g,
+from flask import (request, redirect, url_for, g, jsonify, Markup,
                    render_template, flash, make_response)
 from flask.helpers import NotFound
 from flask_login import login_user, logout_user, current_user, login_required
+from sqlalchemy import event
 
-from app import app, db, uploads, login_manager
-from .models import (BillOfMaterials, Order, Order_VendorPart, Order_BOM, Part,
-                     User)
+from app import (app, db, uploads, login_manager, fragment_cache,
+                 user_cache)
+from .models import (BillOfMaterials, BOMRevision, Order, Order_VendorPart,
+                     Order_BOM, Part, User)
 from .forms import (UploadForm, PartSearchForm, LoginForm, RegisterUserForm,
                     BOMActionForm)
 from .tables import (BOMTable, BOMPartTableShort, BOMPartTableFull,
@@ -16,7 +17,10 @@ from .tables import (BOMTable, BOMPartTableShort, BOMPartTableFull,
                      OrderPartTable)
 from .vendor_fetch import vendors, populate_parts
 from .generate_requisition import UNLRequisition, DigikeyCart
+from .revisions import record_revision, diff_revisions, describe_lookups
+from .sourcing import source_order
 from .utils import sanitize_filename
+from . import search, where_used
 
 
 @app.route("/")
@@ -90,10 +94,17 @@ def bom_summary():
             disposition = "attachment; filename={}".format(fname)
             response.headers['Content-Disposition'] = disposition
             return response
-        if display == 'condensed':
-            parts_table = BOMPartTableShort(bom.bomparts)
-        else:
-            parts_table = BOMPartTableFull(bom.bomparts)
+        if display != 'condensed':
+            display = 'full'
+        cache_key = (bom.id, display, bom.content_version)
+        parts_table = fragment_cache.get(cache_key)
+        if parts_table is None:
+            if display == 'condensed':
+                table = BOMPartTableShort(bom)
+            else:
+                table = BOMPartTableFull(bom.bomparts)
+            parts_table = Markup(table.__html__())
+            fragment_cache.put(cache_key, parts_table)
         return render_template('bom_summary.html',
                                form=form,
                                bom=bom,
@@ -102,6 +113,38 @@ def bom_summary():
         raise NotFound()
 
 
+@app.route("/bom_diff")
+@login_required
+def bom_diff():
+    """ Differences between a BOM and another revision of its project
+
+    Compares against the BOM given by ?against=, by default the parent
+    revision.
+    """
+    bom = BillOfMaterials.query.get(request.args.get('id', type=int))
+    if bom is None or bom.revision is None:
+        raise NotFound()
+    revision = bom.revision
+    against = request.args.get('against', type=int)
+    if against is not None:
+        other = BillOfMaterials.query.get(against)
+        if other is None or other.revision is None:
+            raise NotFound()
+        old = other.revision
+    else:
+        old = revision.parent
+    diff, described = None, {}
+    if old is not None:
+        diff = diff_revisions(old, revision)
+        described = describe_lookups((part['lookup_source'], part['lookup_id'])
+                                     for part in diff['parts'])
+    revisions = BOMRevision.query.filter_by(project=revision.project).\
+        order_by(BOMRevision.number).all()
+    return render_template('bom_diff.html', bom=bom, revision=revision,
+                           old=old, diff=diff, described=described,
+                           revisions=revisions)
+
+
 @app.route('/order_summary', methods=['GET', 'POST'])
 @login_required
 def order_summary():
@@ -161,6 +204,7 @@ def upload():
         bom.version = form.version.data
         bom.user = g.user
         db.session.add(bom)
+        record_revision(bom)
         db.session.commit()
         flash("File {} successfully processed.".format(filename),
               category='success')
@@ -187,8 +231,6 @@ def new_order():
         count_lookup = {id_: count for id_, count in bom_data}
         bom_ids, _ = zip(*bom_data)
         query = BillOfMaterials.query.filter(BillOfMaterials.id.in_(bom_ids))
-        vendorparts = {}
-        vendorparts_count = defaultdict(int)
         order = Order()
         order.order_name = form.order_name.data
         order.description = form.description.data
@@ -205,27 +247,33 @@ def new_order():
             order_bom.bom_count = count_lookup[bom.id]
             order.boms.append(order_bom)
             db.session.add(order_bom)
-            for bompart in bom.bomparts:
-                try:
-                    vendorpart = [part for part in bompart.part.vendorparts
-                                  if part.vendor == bompart.lookup_source][0]
-                    key = (vendorpart.vendor, vendorpart.vendor_part_number)
-                    vendorparts[key] = vendorpart
-                    vendorparts_count[key] += count_lookup[bom.id]
-                except (AttributeError, IndexError) as e:
-                    print(e)
         order.archived = False
         order.timestamp = dt.now()
         db.session.add(order)
-        for key, count in vendorparts_count.items():
+        # the cheapest offer of any vendor for each part
+        sourcing = source_order(count_lookup)
+        for line in sourcing.lines:
             order_vendorpart = Order_VendorPart()
-            order_vendorpart.number_used = count
-            order_vendorpart.number_ordered = count
+            order_vendorpart.number_used = line.quantity
+            order_vendorpart.number_ordered = line.quantity
             order_vendorpart.order = order
-            order_vendorpart.vendorpart = vendorparts[key]
+            order_vendorpart.vendorpart_id = line.vendorpart_id
             order.vendorparts.append(order_vendorpart)
             db.session.add(order_vendorpart)
         db.session.commit()
+        totals = sourcing.totals()
+        if len(totals) > 1:
+            flash('Order split between vendors: ' +
+                  ', '.join('{} (${:.2f})'.format(vendor, total)
+                            for vendor, total in sorted(totals.items())),
+                  category='info')
+        unsourced = ['{} {}'.format(*lookup) for lookup in
+                     sorted(sourcing.unlinked, key=str)]
+        unsourced.extend('part {}'.format(id_)
+                         for id_ in sorted(sourcing.missing))
+        if unsourced:
+            flash('No vendor offers, look up the BOM parts first: ' +
+                  ', '.join(unsourced), category='warning')
         return redirect(url_for('order_summary', id=order.id))
 
     return render_template('new_order.html',
@@ -236,24 +284,49 @@ def new_order():
 @app.route('/search_part', methods=['GET', 'POST'])
 def search_part():
     form = PartSearchForm()
-    manufacturers = sorted(m[0] for m in
-                           set(db.session.query(Part.manufacturer).all()))
+    manufacturers = search.manufacturers()
     manufacturers.insert(0, '*')
     manufacturers = [(m, m) for m in manufacturers]
     form.manufacturer.choices = manufacturers
     form.manufacturer.default = '*'
-    parts = []
+    parts, vendorparts, used, pages = [], {}, {}, []
     if form.is_submitted():
-        query = Part.query
         manufacturers = form.manufacturer.data
-        if '*' not in manufacturers:
-            print(manufacturers)
-            query = query.filter(Part.manufacturer.in_(manufacturers))
-        if form.manufacturer_part_number.validate(form):
-            mpn = form.manufacturer_part_number.data
-            query = query.filter(Part.manufacturer_part_number == mpn)
-        parts = query.all()
-    return render_template('search_part.html', form=form, parts=parts)
+        per_page = app.config['SEARCH_RESULTS_PER_PAGE']
+        if form.query.data and form.query.data.strip():
+            ids = search.search_part_ids(form.query.data,
+                                         fuzzy=form.fuzzy.data)
+            if ids and manufacturers and '*' not in manufacturers:
+                query = db.session.query(Part.id).\
+                    filter(Part.id.in_(ids),
+                           Part.manufacturer.in_(manufacturers))
+                allowed = {id_ for id_, in query}
+                ids = [id_ for id_ in ids if id_ in allowed]
+            total = len(ids)
+        else:
+            # no query lists every part of the chosen manufacturers
+            query = db.session.query(Part.id)
+            if manufacturers and '*' not in manufacturers:
+                query = query.filter(Part.manufacturer.in_(manufacturers))
+            total = query.count()
+            ids = None
+        pages = list(range(1, (total+per_page-1)//per_page + 1))
+        page = min(max(form.page.data or 1, 1), max(len(pages), 1))
+        if ids is None:
+            ids = [id_ for id_, in query.
+                   order_by(Part.manufacturer, Part.manufacturer_part_number,
+                            Part.id).
+                   offset((page-1)*per_page).limit(per_page)]
+        else:
+            ids = ids[(page-1)*per_page:page*per_page]
+        rank = {id_: i for i, id_ in enumerate(ids)}
+        parts = sorted(Part.query.filter(Part.id.in_(ids)),
+                       key=lambda part: rank[part.id])
+        vendorparts = search.latest_vendorparts(ids)
+        used = where_used.where_used(ids)
+        form.page.data = page
+    return render_template('search_part.html', form=form, parts=parts,
+                           vendorparts=vendorparts, used=used, pages=pages)
 
 
 @app.route("/vendor_login", methods=['GET', 'POST'])
@@ -267,6 +340,12 @@ def vendor_login():
         return render_template('vendor_login.html', vendor_login_table=table)
 
 
+@app.route("/cache_stats")
+@login_required
+def cache_stats():
+    return jsonify(fragment_cache.stats())
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
@@ -280,7 +359,30 @@ def internal_error(error):
 
 @login_manager.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    """ Load the logged in user, reusing a cached copy for a short time
+
+    The cached User is kept detached from any session so that commits don't
+    expire it, and a session-bound copy is handed out via merge(load=False),
+    which does not query the db. Its OAuth tokens are not cached, they are
+    loaded from the db on first use in every request, as they may have been
+    refreshed by another worker.
+    """
+    user = user_cache.get(id)
+    if user is None:
+        user = User.query.get(int(id))
+        if user is None:
+            return None
+        db.session.expire(user, ['digikey_oauth_token',
+                                 'digikey_oauth_token_expire',
+                                 'digikey_oauth_refresh_token'])
+        db.session.expunge(user)
+        user_cache.put(id, user)
+    return db.session.merge(user, load=False)
+
+
+@event.listens_for(User, 'after_update')
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate(str(target.id))
 
 
 @login_manager.unauthorized_handler
@@ -0,0 +1,169 @@
+""" Where-used index from Parts to the BOMs and open Orders using them
+
+partbomusage holds the number of references to each Part per BOM, and
+partorderusage the lines and quantity ordered of each Part per open Order.
+Both are keyed by part first, so finding where parts are used only reads
+their index rows, however many BOMParts there are.
+
+The rows of a BOM (or Order) are rebuilt with a single GROUP BY after every
+flush that touched its BOMParts (or its lines, their VendorPart's part or
+its archived flag), eg. on upload, when refresh_bomparts links the parts, or
+when an order is created.
+Bulk Core statements that bypass the session, like
+vendor_fetch.repoint_open_orders_bulk, call rebuild_orders themselves.
+"""
+from itertools import chain
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, select, func, inspect
+
+from app import db
+from .models import (BillOfMaterials, BOMPart, Order, Order_VendorPart,
+                     VendorPart, PartBOMUsage, PartOrderUsage)
+from .utils import chunks
+
+
+def _ids(ids):
+    return sorted(id_ for id_ in set(ids) if id_ is not None)
+
+
+def rebuild_boms(connection, bom_ids):
+    """ Recount the parts of the given BOMs """
+    usage = PartBOMUsage.__table__
+    bompart = BOMPart.__table__
+    for chunk in chunks(_ids(bom_ids), 500):
+        connection.execute(usage.delete().where(usage.c.bom_id.in_(chunk)))
+        counts = select([bompart.c.part_id, bompart.c.bom_id,
+                         func.count()]).\
+            where(bompart.c.bom_id.in_(chunk)).\
+            where(bompart.c.part_id.isnot(None)).\
+            group_by(bompart.c.bom_id, bompart.c.part_id)
+        connection.execute(usage.insert().from_select(
+            ['part_id', 'bom_id', 'count'], counts))
+
+
+def touch_boms(connection, part_ids):
+    """ Bump the content_version of every BOM using the given parts, so their
+    cached tables are rendered again in every worker
+    """
+    bom = BillOfMaterials.__table__
+    usage = PartBOMUsage.__table__
+    for chunk in chunks(_ids(part_ids), 500):
+        using = select([usage.c.bom_id]).where(usage.c.part_id.in_(chunk))
+        connection.execute(bom.update().
+                           where(bom.c.id.in_(using)).
+                           values(content_version=func.coalesce(
+                               bom.c.content_version, 0) + 1))
+
+
+def rebuild_orders(connection, order_ids):
+    """ Recount the parts of the given Orders, dropping archived ones """
+    usage = PartOrderUsage.__table__
+    line = Order_VendorPart.__table__
+    vendorpart = VendorPart.__table__
+    order = Order.__table__
+    for chunk in chunks(_ids(order_ids), 500):
+        connection.execute(usage.delete().where(usage.c.order_id.in_(chunk)))
+        counts = select([vendorpart.c.part_id, line.c.order_id, func.count(),
+                         func.sum(line.c.number_ordered)]).\
+            select_from(line.join(vendorpart,
+                                  line.c.vendorpart_id == vendorpart.c.id).
+                        join(order, line.c.order_id == order.c.id)).\
+            where(line.c.order_id.in_(chunk)).\
+            where(order.c.archived == False).\
+            where(vendorpart.c.part_id.isnot(None)).\
+            group_by(line.c.order_id, vendorpart.c.part_id)
+        connection.execute(usage.insert().from_select(
+            ['part_id', 'order_id', 'lines', 'number_ordered'], counts))
+
+
+def rebuild_all(connection):
+    """ Recreate the whole index, eg. after bulk inserts """
+    connection.execute(PartBOMUsage.__table__.delete())
+    connection.execute(PartOrderUsage.__table__.delete())
+    rebuild_boms(connection, [id_ for id_, in connection.execute(
+        select([BillOfMaterials.__table__.c.id]))])
+    rebuild_orders(connection, [id_ for id_, in connection.execute(
+        select([Order.__table__.c.id]))])
+
+
+# load the replaced value when these are set, so moving a row also rebuilds
+# the BOM or Order it is moved from
+@event.listens_for(BOMPart.bom_id, 'set', active_history=True)
+@event.listens_for(Order_VendorPart.order_id, 'set', active_history=True)
+@event.listens_for(VendorPart.part_id, 'set', active_history=True)
+def _moved(target, value, oldvalue, initiator):
+    pass
+
+
+def _values(obj, key):
+    """ The current and any replaced value of an attribute, without loading
+    anything
+    """
+    state = inspect(obj)
+    values = list(state.attrs[key].history.deleted or ())
+    values.append(state.dict.get(key))
+    return values
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    bom_ids, order_ids, vendorpart_ids = [], [], []
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, BOMPart):
+            bom_ids.extend(_values(obj, 'bom_id'))
+        elif isinstance(obj, Order_VendorPart):
+            order_ids.extend(_values(obj, 'order_id'))
+        elif isinstance(obj, Order):
+            order_ids.append(obj.id)
+        elif (isinstance(obj, VendorPart) and obj in session.dirty and
+              inspect(obj).attrs.part_id.history.has_changes()):
+            vendorpart_ids.append(obj.id)
+    if not (bom_ids or order_ids or vendorpart_ids):
+        return
+    connection = session.connection()
+    line = Order_VendorPart.__table__
+    for chunk in chunks(sorted(vendorpart_ids), 500):
+        order_ids.extend(id_ for id_, in connection.execute(
+            select([line.c.order_id]).
+            where(line.c.vendorpart_id.in_(chunk)).distinct()))
+    rebuild_boms(connection, bom_ids)
+    rebuild_orders(connection, order_ids)
+
+
+def where_used(part_ids):
+    """ The BOMs and open Orders using each of the given parts
+
+    Returns:
+        A dict mapping every part id to a dict with a list of boms (id,
+        name, version and count of references) sorted by name, and a list of
+        orders (id, order_name, lines and number_ordered) sorted by id.
+    """
+    part_ids = _ids(part_ids)
+    used = {id_: {'boms': [], 'orders': []} for id_ in part_ids}
+    for chunk in chunks(part_ids, 500):
+        boms = db.session.query(PartBOMUsage.part_id, BillOfMaterials.id,
+                                BillOfMaterials.name,
+                                BillOfMaterials.version,
+                                PartBOMUsage.count).\
+            join(BillOfMaterials,
+                 PartBOMUsage.bom_id == BillOfMaterials.id).\
+            filter(PartBOMUsage.part_id.in_(chunk)).\
+            order_by(BillOfMaterials.name, BillOfMaterials.id)
+        for part_id, id_, name, version, count in boms:
+            used[part_id]['boms'].append({'id': id_,
+                                          'name': name,
+                                          'version': version,
+                                          'count': count})
+        orders = db.session.query(PartOrderUsage.part_id, Order.id,
+                                  Order.order_name, PartOrderUsage.lines,
+                                  PartOrderUsage.number_ordered).\
+            join(Order, PartOrderUsage.order_id == Order.id).\
+            filter(PartOrderUsage.part_id.in_(chunk)).\
+            order_by(Order.id)
+        for part_id, id_, order_name, lines, number_ordered in orders:
+            used[part_id]['orders'].append({'id': id_,
+                                            'order_name': order_name,
+                                            'lines': lines,
+                                            'number_ordered': number_ordered})
+    return used
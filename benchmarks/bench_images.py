@@ -0,0 +1,127 @@
+#!flask/bin/python3
+""" Part image cache against the stub image server, offline
+
+Seeds --parts parts whose images (--distinct of them) are served by the
+stub vendor (stub_digikey.py), then:
+    cache       cache_part_images for every image, downloading, storing and
+                resizing them
+    serve       GET /part_image/<digest>/<size> for every cached image
+and checks that every part got the digest of its image, that the stored
+thumbnails fit IMAGE_THUMBNAIL_SIZES (with Pillow installed), and that the
+images are served with their type and long-lived cache headers. Fails on
+the first check that does not hold.
+
+usage: bench_images.py [--parts 200] [--distinct 50] [--latency 0.0]
+                       [--repeat 3] [--seed 0] [--output FILE]
+"""
+import os
+import shutil
+import hashlib
+import argparse
+import tempfile
+import urllib.request
+
+from common import scratch_app, measure, emit, Timer
+import synthetic
+import stub_digikey
+
+
+def check_thumbnail(path, size):
+    """ The thumbnail exists and fits size, if Pillow can make them """
+    try:
+        from PIL import Image
+    except ImportError:
+        return
+    with Image.open(path) as img:
+        assert max(img.size) <= size, (path, img.size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--parts', type=int, default=200)
+    parser.add_argument('--distinct', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='file to append the JSON results to')
+    args = parser.parse_args()
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    output = os.path.abspath(args.output) if args.output else None
+
+    app = scratch_app()
+    from app.models import Part
+    from app.images import cache_part_images, image_path, ONE_YEAR
+    db, flask_app = app.db, app.app
+    synthetic.seed_database(app, boms=1, components=1,
+                            vendorparts=args.parts, orders=0, seed=args.seed)
+    server, state = stub_digikey.start(latency=args.latency)
+    host = 'http://{}:{}'.format(*server.server_address)
+    workdir = tempfile.mkdtemp(prefix='bom_bench_')
+    flask_app.config['IMAGE_CACHE_DIR'] = os.path.join(workdir, 'images')
+    sizes = flask_app.config['IMAGE_THUMBNAIL_SIZES']
+
+    urls = {}
+    for part in Part.query:
+        part.image_url = '{}/images/{}.png'.format(
+            host, part.id % args.distinct)
+        urls[part.id] = part.image_url
+    db.session.commit()
+    image_urls = sorted(set(urls.values()))
+
+    with Timer() as cold:
+        cache_part_images(image_urls)
+    fetched = state.counts['image']
+
+    # every part has the digest of its own image, and its thumbnails
+    digests = {}
+    for url in image_urls:
+        with urllib.request.urlopen(url) as resp:
+            digests[url] = hashlib.sha256(resp.read()).hexdigest()
+    assert len(set(digests.values())) == len(image_urls)
+    for part in Part.query:
+        assert part.image_hash == digests[urls[part.id]], part.id
+    for digest in digests.values():
+        assert os.path.exists(image_path(digest))
+        for size in sizes:
+            check_thumbnail(image_path(digest, size), size)
+
+    client = flask_app.test_client()
+    base_url = 'https://localhost'
+
+    def serve():
+        for digest in digests.values():
+            for size in sizes:
+                response = client.get('/part_image/{}/{}'.format(
+                    digest, size), base_url=base_url)
+                assert response.status_code == 200, response.status
+                assert response.mimetype == 'image/png', response.mimetype
+                cache_control = response.headers['Cache-Control']
+                assert 'max-age={}'.format(ONE_YEAR) in cache_control
+                assert 'immutable' in cache_control
+                response.close()
+        return len(digests) * len(sizes)
+
+    served = measure(serve, args.repeat)
+    served.pop('result')
+    for path in ('/part_image/' + '0'*64, '/part_image/not-a-digest'):
+        assert client.get(path, base_url=base_url).status_code == 404
+
+    results = {'cache_s': cold.elapsed,
+               'images': len(image_urls),
+               'fetched': fetched,
+               'images_per_second': (len(image_urls) / cold.elapsed
+                                     if cold.elapsed else 0.0),
+               'serve': served,
+               'thumbnails': sum(os.path.exists(image_path(digest, size))
+                                 for digest in digests.values()
+                                 for size in sizes)}
+    emit('images', results, params, output)
+    server.shutdown()
+    shutil.rmtree(workdir)
+    db.session.remove()
+    os.remove(db.engine.url.database)
+
+
+if __name__ == '__main__':
+    main()
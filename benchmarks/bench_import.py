@@ -0,0 +1,117 @@
+#!flask/bin/python3
+""" Startup time of the app, with a budget
+
+Times, each in --repeat fresh interpreters:
+    import_app    import app, as done by the CLI scripts (db_create.py,
+                  refresh_parts.py, ...)
+    create_app    import app and app.create_app(), as done by every server
+                  worker
+
+and checks that the modules that are only needed by some requests (LAZY) are
+not imported by either. The slowest modules, by their own import time, are
+listed from a -X importtime run of create_app.
+
+Exits with 1 if the fastest run of either goes over its budget, or if a lazy
+module was imported, so it can guard startup time in CI.
+
+usage: bench_import.py [--repeat 5] [--import-budget-ms 400]
+                       [--create-budget-ms 800] [--top 15] [--output FILE]
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+from common import ROOT, emit
+
+# only needed to fetch parts, log into a vendor, export requisitions and
+# make thumbnails
+LAZY = ('aiohttp', 'flask_oauthlib', 'openpyxl', 'PIL')
+
+_probe = """
+import sys, time, json
+start = time.perf_counter()
+import app
+{}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'s': elapsed,
+                  'lazy': [m for m in {!r} if m in sys.modules]}}))
+"""
+_targets = {'import_app': '',
+            'create_app': 'app.create_app()'}
+
+
+def _run(code, *options):
+    result = subprocess.run([sys.executable, '-W', 'ignore'] + list(options) +
+                            ['-c', code], cwd=ROOT, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    return result.stdout, result.stderr
+
+
+def time_import(target, repeat):
+    code = _probe.format(_targets[target], LAZY)
+    runs = [json.loads(_run(code)[0].splitlines()[-1])
+            for _ in range(repeat)]
+    timings = [run['s'] for run in runs]
+    return {'runs': repeat,
+            'min_s': min(timings),
+            'mean_s': sum(timings) / len(timings),
+            'max_s': max(timings),
+            'lazy_imported': sorted(set().union(*(run['lazy']
+                                                  for run in runs)))}
+
+
+def slowest_modules(n):
+    """ The n modules with the largest own import time, in ms """
+    _, importtime = _run(_probe.format(_targets['create_app'], LAZY),
+                         '-X', 'importtime')
+    modules = []
+    for line in importtime.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            own = int(fields[0])
+        except ValueError:  # the header line
+            continue
+        modules.append((own / 1000, fields[2].strip()))
+    modules.sort(reverse=True)
+    return [[name, ms] for ms, name in modules[:n]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--import-budget-ms', type=float, default=400,
+                        help='budget for import app')
+    parser.add_argument('--create-budget-ms', type=float, default=800,
+                        help='budget for import app and create_app()')
+    parser.add_argument('--top', type=int, default=15,
+                        help='number of slowest modules to list')
+    parser.add_argument('--output', default=None,
+                        help='file to append the JSON results to')
+    args = parser.parse_args()
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+
+    budgets = {'import_app': args.import_budget_ms,
+               'create_app': args.create_budget_ms}
+    results = {}
+    failures = []
+    for target, budget in budgets.items():
+        results[target] = time_import(target, args.repeat)
+        if 1000 * results[target]['min_s'] > budget:
+            failures.append('{} took {:.0f}ms, over the budget of {:.0f}ms'
+                            .format(target, 1000 * results[target]['min_s'],
+                                    budget))
+        for module in results[target]['lazy_imported']:
+            failures.append('{} imported {}'.format(target, module))
+    results['slowest_modules_ms'] = slowest_modules(args.top)
+    emit('startup', results, params, args.output)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
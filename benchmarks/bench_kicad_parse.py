@@ -0,0 +1,136 @@
+#!flask/bin/python3
+""" Parse throughput and memory of the KiCAD schematic and netlist readers
+
+Writes a synthetic design of --components components in every supported
+format and parses each file --repeat times:
+    sch         legacy .sch sheet, read whole (models.parse_kicad_schematic)
+    kicad_sch   KiCAD 7 .kicad_sch sheet, streamed (kicad.parse_kicad_sch)
+    net_xml     KiCad XML netlist, streamed (kicad.parse_kicad_netlist)
+    net_sexpr   s-expression netlist, streamed (kicad.parse_kicad_netlist)
+reporting MB/s and components/s. The peak traced memory of reading every
+component is then measured at --components and at --scale times as many
+components: it grows with the file for the legacy reader and for loading
+the XML as a whole (ElementTree.parse, for comparison), and stays flat for
+the streaming readers.
+
+usage: bench_kicad_parse.py [--components 5000] [--scale 4] [--repeat 3]
+                            [--seed 0] [--output FILE]
+"""
+import os
+import random
+import argparse
+import tempfile
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from common import scratch_app, measure, emit
+import synthetic
+
+
+def write_files(directory, n_components, seed):
+    """ The design in every format, as a dict of name to path """
+    components = synthetic.bom_fields(n_components, seed=seed)
+    texts = {
+        'sch': lambda: [synthetic.make_schematic(
+            components, 1, 1, random.Random(seed))],
+        'kicad_sch': lambda: synthetic.iter_kicad_sch(
+            components, rng=random.Random(seed)),
+        'net_xml': lambda: synthetic.iter_kicad_netlist(
+            components, random.Random(seed), 'xml'),
+        'net_sexpr': lambda: synthetic.iter_kicad_netlist(
+            components, random.Random(seed), 'sexpr'),
+    }
+    paths = {}
+    for name, text in texts.items():
+        paths[name] = os.path.join(directory, '{}_{}.{}'.format(
+            name, n_components, name.split('_')[0]))
+        with open(paths[name], 'w', encoding='utf-8') as f:
+            f.writelines(text())
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--components', type=int, default=5000)
+    parser.add_argument('--scale', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='file to append the JSON results to')
+    args = parser.parse_args()
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    output = os.path.abspath(args.output) if args.output else None
+
+    app = scratch_app()
+    from app import kicad
+    from app.models import parse_kicad_schematic, vendors
+
+    def read_sch(path):
+        with open(path, encoding='utf-8') as f:
+            return parse_kicad_schematic(f.read())
+
+    def read_kicad_sch(path):
+        with open(path, encoding='utf-8') as f:
+            return kicad.parse_kicad_sch(f, vendors)
+
+    def read_net(path):
+        with open(path, 'rb') as f:
+            return kicad.parse_kicad_netlist(f, vendors)
+
+    parsers = {'sch': read_sch, 'kicad_sch': read_kicad_sch,
+               'net_xml': read_net, 'net_sexpr': read_net}
+
+    def stream_sch(path):
+        return len(read_sch(path)[0])
+
+    def stream_kicad_sch(path):
+        with open(path, encoding='utf-8') as f:
+            return sum(1 for _ in kicad.schematic_components(f))
+
+    def stream_net(path):
+        with open(path, 'rb') as f:
+            return sum(1 for _ in kicad.netlist_components(f))
+
+    def load_xml(path):
+        return len(ET.parse(path).getroot().find('components'))
+
+    readers = {'sch': stream_sch, 'kicad_sch': stream_kicad_sch,
+               'net_xml': stream_net, 'net_sexpr': stream_net,
+               'net_xml_whole': load_xml}
+
+    def peak(fn, path):
+        tracemalloc.start()
+        try:
+            fn(path)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bom_bench_') as directory:
+        small = write_files(directory, args.components, args.seed)
+        large = write_files(directory, args.components * args.scale,
+                            args.seed)
+        for name, path in sorted(small.items()):
+            size = os.path.getsize(path)
+            result = measure(lambda: parsers[name](path), args.repeat)
+            fields = result.pop('result')[0]
+            assert len(fields) == args.components, (name, len(fields))
+            result['bytes'] = size
+            result['mb_per_s'] = size / result['min_s'] / 1e6
+            result['components_per_s'] = len(fields) / result['min_s']
+            results[name] = result
+        small['net_xml_whole'] = small['net_xml']
+        large['net_xml_whole'] = large['net_xml']
+        results['peak_kib'] = {
+            name: {str(args.components): peak(reader, small[name]) // 1024,
+                   str(args.components * args.scale):
+                       peak(reader, large[name]) // 1024}
+            for name, reader in sorted(readers.items())}
+    emit('kicad_parse', results, params, output)
+    app.db.session.remove()
+    os.remove(app.db.engine.url.database)
+
+
+if __name__ == '__main__':
+    main()
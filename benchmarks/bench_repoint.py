@@ -0,0 +1,106 @@
+#!flask/bin/python3
+""" Benchmark re-pointing open order lines after a vendor part refresh
+
+Seeds --orders open orders with --lines lines each, spread over --parts
+vendor parts, stores a fresh VendorPart for every vendor part and then
+times repoint_open_orders_bulk against the old per-part loop that assigned
+each Order_VendorPart individually.
+
+usage: bench_repoint.py [--orders 2000] [--lines 20] [--parts 1000]
+"""
+import argparse
+from datetime import datetime
+
+from common import scratch_app, reset_db, Timer, emit
+
+
+def seed(app, n_orders, n_lines, n_parts):
+    from app.models import Order, Order_VendorPart, VendorPart, Part
+    db = app.db
+    part = Part()
+    part.manufacturer = 'Bench'
+    part.manufacturer_part_number = 'BENCH'
+    db.session.add(part)
+    db.session.flush()
+    vendorparts = []
+    for i in range(n_parts):
+        vendorpart = VendorPart()
+        vendorpart.vendor = 'Digikey'
+        vendorpart.vendor_part_number = 'BENCH-{}-ND'.format(i)
+        vendorpart.fetch_timestamp = datetime(2000, 1, 1)
+        vendorpart.price_breaks = []
+        vendorpart.part_id = part.id
+        vendorparts.append(vendorpart)
+    db.session.add_all(vendorparts)
+    db.session.flush()
+    order_table = Order.__table__
+    line_table = Order_VendorPart.__table__
+    db.session.execute(order_table.insert(),
+                       [{'id': i+1, 'archived': i % 10 == 0,
+                         'order_name': 'bench {}'.format(i)}
+                        for i in range(n_orders)])
+    db.session.execute(line_table.insert(),
+                       [{'order_id': i+1,
+                         'vendorpart_id': vendorparts[(i*n_lines+j) %
+                                                      n_parts].id,
+                         'number_used': 1, 'number_ordered': 1}
+                        for i in range(n_orders) for j in range(n_lines)])
+    fresh = {}
+    for vendorpart in vendorparts:
+        new = VendorPart()
+        new.vendor = vendorpart.vendor
+        new.vendor_part_number = vendorpart.vendor_part_number
+        new.fetch_timestamp = datetime.now()
+        new.price_breaks = []
+        new.part_id = part.id
+        fresh[(new.vendor, new.vendor_part_number)] = new
+    db.session.add_all(fresh.values())
+    db.session.commit()
+    return fresh
+
+
+def per_part_loop(app, fresh):
+    """ The previous implementation: one query and N assignments per part """
+    from app.models import Order, Order_VendorPart, VendorPart
+    db = app.db
+    for (vendor, vpn), vendorpart in fresh.items():
+        query = db.session.query(Order_VendorPart).\
+            join(VendorPart, Order_VendorPart.vendorpart_id == VendorPart.id).\
+            join(Order, Order_VendorPart.order_id == Order.id).\
+            filter(VendorPart.vendor == vendor).\
+            filter(VendorPart.vendor_part_number == vpn).\
+            filter(Order.archived == False)
+        for order_vendorpart in query.all():
+            order_vendorpart.vendorpart = vendorpart
+            db.session.add(order_vendorpart)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--lines', type=int, default=20)
+    parser.add_argument('--parts', type=int, default=1000)
+    args = parser.parse_args()
+    params = vars(args)
+
+    results = {}
+    app = scratch_app()
+    from app.vendor_fetch import repoint_open_orders_bulk
+    fresh = seed(app, args.orders, args.lines, args.parts)
+    with Timer() as t:
+        updated = repoint_open_orders_bulk(fresh)
+        app.db.session.commit()
+    results['bulk_s'] = t.elapsed
+    results['lines_updated'] = updated
+
+    reset_db(app)
+    fresh = seed(app, args.orders, args.lines, args.parts)
+    with Timer() as t:
+        per_part_loop(app, fresh)
+    results['per_part_loop_s'] = t.elapsed
+    emit('repoint_open_orders', results, params)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!flask/bin/python3
+""" Storage and diff speed of BOM revisions
+
+Uploads --revisions revisions of one synthetic --components part project,
+each changing --changes references of its parent (a third each changed,
+added and removed), and reports:
+    record        recording each revision (snapshot, delta and compression)
+    full_bytes    stored size of the first, full, snapshot
+    delta_bytes   mean stored size of the following revisions
+    diff_parent   diff of the last revision against its parent, with an
+                  empty snapshot cache (cold) and again (warm)
+    diff_first    diff of the last revision against the first, through the
+                  chain of deltas
+    diff_columns  the same diff computed from the BOMPart columns of both
+                  BOMs instead of the snapshots, for comparison
+
+usage: bench_revisions.py [--components 10000] [--revisions 10]
+                          [--changes 100] [--repeat 5] [--seed 0]
+                          [--output FILE]
+"""
+import os
+import random
+import argparse
+
+from common import scratch_app, measure, emit
+import synthetic
+
+
+def revise(fields, changes, rng, serial):
+    """ A copy of fields with changes references changed, added and
+    removed
+    """
+    fields = list(fields)
+    for i in range(changes):
+        kind = i % 3
+        if kind == 0:
+            j = rng.randrange(len(fields))
+            reference, source, _ = fields[j]
+            fields[j] = (reference, source,
+                         synthetic.vendor_part_number(rng.randrange(10**5)))
+        elif kind == 1:
+            fields.append(('X{}_{}'.format(serial, i), 'Digikey',
+                           synthetic.vendor_part_number(rng.randrange(10**5))))
+        else:
+            fields.pop(rng.randrange(len(fields)))
+    return fields
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--components', type=int, default=10000)
+    parser.add_argument('--revisions', type=int, default=10)
+    parser.add_argument('--changes', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='file to append the JSON results to')
+    args = parser.parse_args()
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    output = os.path.abspath(args.output) if args.output else None
+
+    app = scratch_app()
+    from app.models import BillOfMaterials
+    from app import revisions
+    db = app.db
+    rng = random.Random(args.seed)
+
+    fields = synthetic.bom_fields(args.components, seed=args.seed)
+    boms = []
+
+    def record():
+        nonlocal fields
+        if boms:
+            fields = revise(fields, args.changes, rng, len(boms))
+        bom = BillOfMaterials.from_parsed_archive('', fields)
+        bom.name = 'bench project'
+        db.session.add(bom)
+        revisions.record_revision(bom)
+        db.session.commit()
+        boms.append(bom)
+
+    results = {'record': measure(record, args.revisions)}
+    results['record'].pop('result')
+    sizes = [len(bom.revision.data) for bom in boms]
+    results['full_bytes'] = sizes[0]
+    results['delta_bytes'] = (sum(sizes[1:]) / (len(sizes) - 1)
+                              if len(sizes) > 1 else None)
+    results['depths'] = [bom.revision.depth for bom in boms]
+
+    first, parent, last = (boms[0].revision, boms[-2].revision,
+                           boms[-1].revision)
+
+    def clear_cache():
+        db.session.expire_all()
+        revisions._snapshots.clear()
+
+    results['diff_parent_cold'] = measure(
+        lambda: revisions.diff_revisions(parent, last), args.repeat,
+        setup=clear_cache)
+    results['diff_parent_warm'] = measure(
+        lambda: revisions.diff_revisions(parent, last), args.repeat)
+    results['diff_first'] = measure(
+        lambda: revisions.diff_revisions(first, last), args.repeat,
+        setup=clear_cache)
+    results['diff_columns'] = measure(
+        lambda: revisions.diff_snapshots(
+            revisions.bom_snapshot(boms[-2]), revisions.bom_snapshot(boms[-1])),
+        args.repeat, setup=db.session.expire_all)
+    diff = results['diff_parent_warm'].pop('result')
+    for name in ('diff_parent_cold', 'diff_first', 'diff_columns'):
+        results[name].pop('result')
+    results['changes'] = {kind: len(diff[kind])
+                          for kind in ('added', 'removed', 'changed', 'parts')}
+    emit('bom_revisions', results, params, output)
+    db.session.remove()
+    os.remove(db.engine.url.database)
+
+
+if __name__ == '__main__':
+    main()
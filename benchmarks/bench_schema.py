@@ -0,0 +1,59 @@
+#!flask/bin/python3
+""" Time to get an empty database with the full schema
+
+Compares, each --repeat times on a scratch file:
+    create_all       db.create_all() from the models, as db_create.py used to
+    baseline         running db_repository/baseline.sql (app.baseline.
+                     create_database), as db_create.py does now
+    clone_template   copying the template database built from the baseline
+                     (app.baseline.clone_database), as the benchmarks do
+
+usage: bench_schema.py [--repeat 10] [--output FILE]
+"""
+import os
+import argparse
+import tempfile
+
+from common import scratch_app, reset_db, measure, emit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', default=None,
+                        help='file to append the JSON results to')
+    args = parser.parse_args()
+    params = {'repeat': args.repeat}
+    output = os.path.abspath(args.output) if args.output else None
+
+    app = scratch_app()
+    from app.baseline import create_database, template_path
+    db_path = app.db.engine.url.database
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='bom_bench_')
+    os.close(fd)
+
+    def remove_scratch():
+        app.db.session.remove()
+        app.db.engine.dispose()
+        os.remove(db_path)
+
+    def remove_path():
+        if os.path.exists(path):
+            os.remove(path)
+
+    template_path()  # built once, outside of the timings
+    results = {
+        'create_all': measure(app.db.create_all, args.repeat,
+                              setup=remove_scratch),
+        'baseline': measure(lambda: create_database(path), args.repeat,
+                            setup=remove_path),
+        'clone_template': measure(lambda: reset_db(app), args.repeat)}
+    for timing in results.values():
+        timing.pop('result')
+    emit('empty_schema', results, params, output)
+    remove_path()
+    os.remove(db_path)
+
+
+if __name__ == '__main__':
+    main()
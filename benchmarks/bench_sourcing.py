@@ -0,0 +1,96 @@
+#!flask/bin/python3
+""" Multi-vendor sourcing of an order
+
+Seeds a synthetic database, stocks the local fake vendor (fake_vendor.py)
+with an offer for every part, and sources an order of --order-boms BOMs,
+--count boards each:
+    source_order    the batched sourcing engine (app/sourcing.py)
+    per_row         the previous per-BOMPart traversal (bompart.part.
+                    vendorparts, first offer of the schematic's vendor), on
+                    a fresh session, for comparison
+and reports the order's lines and cost per vendor against ordering
+everything from the schematic's vendor.
+
+usage: bench_sourcing.py [--boms 20] [--components 500]
+                         [--vendorparts 2000] [--order-boms 10]
+                         [--count 5] [--repeat 5] [--seed 0]
+                         [--output FILE]
+"""
+import os
+import argparse
+from collections import defaultdict
+
+from common import scratch_app, measure, emit
+from fake_vendor import FakeVendor
+import synthetic
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--boms', type=int, default=20)
+    parser.add_argument('--components', type=int, default=500)
+    parser.add_argument('--vendorparts', type=int, default=2000)
+    parser.add_argument('--order-boms', type=int, default=10)
+    parser.add_argument('--count', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='file to append the JSON results to')
+    args = parser.parse_args()
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    output = os.path.abspath(args.output) if args.output else None
+
+    app = scratch_app()
+    from app.models import BillOfMaterials
+    from app import sourcing
+    db = app.db
+    synthetic.seed_database(app, boms=args.boms, components=args.components,
+                            vendorparts=args.vendorparts, orders=0,
+                            seed=args.seed)
+    stocked = FakeVendor('Fakey').stock()
+    db.session.commit()
+    bom_counts = {id_: args.count
+                  for id_ in range(1, min(args.order_boms, args.boms)+1)}
+
+    def per_row():
+        counts = defaultdict(int)
+        boms = BillOfMaterials.query.filter(
+            BillOfMaterials.id.in_(bom_counts))
+        for bom in boms:
+            for bompart in bom.bomparts:
+                vendorpart = [part for part in bompart.part.vendorparts
+                              if part.vendor == bompart.lookup_source][0]
+                key = (vendorpart.vendor, vendorpart.vendor_part_number)
+                counts[key] += bom_counts[bom.id]
+        return counts
+
+    results = {'source_order': measure(
+                   lambda: sourcing.source_order(bom_counts), args.repeat,
+                   setup=db.session.remove),
+               'per_row': measure(per_row, args.repeat,
+                                  setup=db.session.remove)}
+    result = results['source_order'].pop('result')
+    results['per_row'].pop('result')
+
+    quantities, sources, _ = sourcing.required_quantities(bom_counts)
+    offers = sourcing.latest_offers(quantities)
+    single = 0
+    for part_id, quantity in quantities.items():
+        own = [offer for offer in offers[part_id]
+               if offer.vendor in sources[part_id]]
+        _, price = sourcing.choose_offer(quantity, own)
+        single += price * quantity if price is not None else 0
+    split = result.by_vendor()
+    results['stocked'] = len(stocked)
+    results['lines'] = {vendor: len(lines) for vendor, lines in split.items()}
+    results['cost'] = {vendor: round(total, 2)
+                       for vendor, total in result.totals().items()}
+    results['single_vendor_cost'] = round(single, 2)
+    results['unpriced'] = len(result.unpriced)
+    emit('sourcing', results, params, output)
+    db.session.remove()
+    os.remove(db.engine.url.database)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+#!flask/bin/python3
+""" Benchmark suite for the main upload, refresh, order and export paths
+
+Times, on synthetic data (see synthetic.py):
+    from_kicad_archive   BillOfMaterials.from_kicad_archive on a generated
+                         --components/--sheets archive
+    new_order            POSTing /new_order with --order-boms seeded BOMs
+    order_table_render   OrderPartTable.render and its HTML for an order with
+                         --lines lines
+    requisition          UNLRequisition.get_form for the same order, with a
+                         blank local workbook standing in for the form
+                         downloaded from the physics website
+    populate_parts       populate_parts on the generated BOM against the stub
+                         vendor (stub_digikey.py), cold then warm
+
+Each benchmark prints one JSON line (see common.emit), and appends it to
+--output if given, so results can be compared across commits with
+compare.py.
+
+usage: bench_suite.py [--only NAME ...] [--repeat 3] [--output FILE]
+                      [--components 500] [--sheets 4] [--users 5]
+                      [--boms 20] [--bom-components 200]
+                      [--vendorparts 2000] [--orders 20] [--lines 100]
+                      [--order-boms 5] [--latency 0.0] [--seed 0]
+"""
+import os
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from common import scratch_app, reset_db, measure, emit, Timer
+import stub_digikey
+import synthetic
+
+BENCHMARKS = ('from_kicad_archive', 'new_order', 'order_table_render',
+              'requisition', 'populate_parts')
+
+
+def bench_from_kicad_archive(app, args, workdir):
+    from app.models import BillOfMaterials
+    path = os.path.join(workdir, 'from_kicad_archive.zip')
+    synthetic.make_kicad_archive(path, args.components, args.sheets,
+                                 seed=args.seed)
+    with app.app.test_request_context():
+        results = measure(
+            lambda: len(BillOfMaterials.from_kicad_archive(path).bomparts),
+            args.repeat)
+    results['components'] = results.pop('result')
+    results['components_per_second'] = (results['components'] /
+                                        results['min_s'])
+    return results
+
+
+def _seeded(app, args):
+    reset_db(app)
+    return synthetic.seed_database(app, args.users, args.boms,
+                                   args.bom_components, args.vendorparts,
+                                   args.orders, args.lines, args.seed)
+
+
+def bench_new_order(app, args, workdir):
+    from app.models import Order
+    flask_app = app.app
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    seeded = _seeded(app, args)
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = str(seeded['users'][0])
+    data = {'order_name': 'bench', 'description': 'bench',
+            'delivery_date': '01/31/2030', 'cost_object': '12-3456',
+            'requestor_name': 'Bench', 'requestor_phone': '555-0100',
+            'supervisor_name': 'Bench', 'submit': 'Submit'}
+    for bom_id in seeded['boms'][:args.order_boms]:
+        data['selector_{}'.format(bom_id)] = 'y'
+        data['count_{}'.format(bom_id)] = '2'
+
+    def new_order():
+        response = client.post('/new_order', data=data,
+                               base_url='https://localhost')
+        if response.status_code != 302:
+            raise RuntimeError('new_order returned {}'
+                               .format(response.status_code))
+
+    results = measure(new_order, args.repeat)
+    results.pop('result')
+    order = Order.query.order_by(Order.id.desc()).first()
+    results['order_lines'] = len(order.vendorparts)
+    return results
+
+
+def bench_order_table_render(app, args, workdir):
+    from app.models import Order
+    from app.tables import OrderPartTable
+    seeded = _seeded(app, args)
+    order = Order.query.get(seeded['orders'][0])
+    with app.app.test_request_context():
+        table = OrderPartTable(order)
+        # expire the session first so loading the lines is included
+        render = measure(table.render, args.repeat,
+                         setup=app.db.session.expire_all)
+        html = measure(lambda: len(table.__html__()), args.repeat)
+    render.pop('result')
+    return {'render': render,
+            'html': html,
+            'html_bytes': html.pop('result'),
+            'order_lines': len(order.vendorparts)}
+
+
+def bench_requisition(app, args, workdir):
+    from openpyxl import Workbook
+    from openpyxl.writer.excel import save_virtual_workbook
+    from app.models import Order
+    from app.generate_requisition import UNLRequisition
+    UNLRequisition._blank_form_raw = save_virtual_workbook(Workbook())
+    seeded = _seeded(app, args)
+    order = Order.query.get(seeded['orders'][0])
+    results = measure(lambda: len(UNLRequisition(order).get_form()[1]),
+                      args.repeat, setup=app.db.session.expire_all)
+    results['zip_bytes'] = results.pop('result')
+    results['order_lines'] = len(order.vendorparts)
+    return results
+
+
+def bench_populate_parts(app, args, workdir):
+    from flask import g
+    from app.models import User, BillOfMaterials
+    from app.vendor_fetch import vendors, populate_parts
+    server, state = stub_digikey.start(latency=args.latency)
+    host = 'http://{}:{}'.format(*server.server_address)
+    flask_app = app.app
+    flask_app.config['DIGIKEY_BASE_URL'] = host + '/services/basicsearch/v1/'
+    flask_app.config['IMAGE_CACHE_DIR'] = os.path.join(workdir, 'images')
+    vendors['Digikey'].tokens.token_url = host + '/as/token.oauth2'
+
+    reset_db(app)
+    user = User('Bench', 'populate@example.com', 'bench')
+    user.digikey_oauth_token = 'stub-access'
+    user.digikey_oauth_refresh_token = 'stub-refresh'
+    user.digikey_oauth_token_expire = datetime.now() + timedelta(hours=1)
+    path = os.path.join(workdir, 'populate_parts.zip')
+    synthetic.make_kicad_archive(path, args.components, args.sheets,
+                                 seed=args.seed)
+    with flask_app.test_request_context():
+        bom = BillOfMaterials.from_kicad_archive(path)
+        bom.user = user
+        app.db.session.add(bom)
+        app.db.session.commit()
+        g.user = user
+        with Timer() as cold:
+            populate_parts(bom)
+        lookups = state.counts['search']
+        # everything is fresh now, so this only checks the db
+        warm = measure(lambda: populate_parts(bom), args.repeat)
+        n_bomparts = len(bom.bomparts)
+    warm.pop('result')
+    server.shutdown()
+    return {'cold_s': cold.elapsed,
+            'warm': warm,
+            'bomparts': n_bomparts,
+            'lookups': lookups,
+            'lookups_per_second': (lookups / cold.elapsed
+                                   if cold.elapsed else 0.0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--only', action='append', choices=BENCHMARKS,
+                        help='run only this benchmark, may be repeated')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None,
+                        help='file to append the JSON results to')
+    parser.add_argument('--components', type=int, default=500,
+                        help='components of the generated archive')
+    parser.add_argument('--sheets', type=int, default=4)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--boms', type=int, default=20)
+    parser.add_argument('--bom-components', type=int, default=200,
+                        help='components of each seeded BOM')
+    parser.add_argument('--vendorparts', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=20)
+    parser.add_argument('--lines', type=int, default=100,
+                        help='lines of each seeded order')
+    parser.add_argument('--order-boms', type=int, default=5,
+                        help='BOMs included by the new_order benchmark')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='stub vendor response latency in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    params = {k: v for k, v in vars(args).items()
+              if k not in ('only', 'output')}
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix='bom_bench_')
+    try:
+        app = scratch_app(os.path.join(workdir, 'bench.db'))
+        for name in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            results = globals()['bench_' + name](app, args, workdir)
+            emit(name, results, params, output)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
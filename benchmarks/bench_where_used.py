@@ -0,0 +1,99 @@
+#!flask/bin/python3
+""" Where-used lookups and the cost of keeping their index up to date
+
+Seeds a synthetic database with --boms BOMs of --components parts and
+--orders open orders, then reports:
+    lookup        where_used for --parts random parts, from the index
+    scan          the same counts computed by grouping the BOMPart and order
+                  line rows, as without the index, for comparison
+    rebuild_bom   recounting one BOM, as done after a flush that touched it
+    rebuild_all   recreating the whole index
+
+The lookup should stay flat as --boms grows, while the scan grows with the
+total number of BOMParts.
+
+usage: bench_where_used.py [--boms 200] [--components 500]
+                           [--vendorparts 5000] [--orders 50] [--lines 100]
+                           [--parts 20] [--repeat 5] [--seed 0]
+                           [--output FILE]
+"""
+import os
+import random
+import argparse
+
+from common import scratch_app, measure, emit
+import synthetic
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--boms', type=int, default=200)
+    parser.add_argument('--components', type=int, default=500)
+    parser.add_argument('--vendorparts', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=50)
+    parser.add_argument('--lines', type=int, default=100)
+    parser.add_argument('--parts', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='file to append the JSON results to')
+    args = parser.parse_args()
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    output = os.path.abspath(args.output) if args.output else None
+
+    app = scratch_app()
+    from sqlalchemy import func
+    from app.models import BOMPart, Order, Order_VendorPart, VendorPart
+    from app import where_used
+    db = app.db
+    synthetic.seed_database(app, boms=args.boms, components=args.components,
+                            vendorparts=args.vendorparts, orders=args.orders,
+                            lines=args.lines, seed=args.seed)
+    part_ids = random.Random(args.seed).sample(range(1, args.vendorparts+1),
+                                               args.parts)
+
+    def scan():
+        boms = db.session.query(BOMPart.part_id, BOMPart.bom_id,
+                                func.count()).\
+            filter(BOMPart.part_id.in_(part_ids)).\
+            group_by(BOMPart.part_id, BOMPart.bom_id).all()
+        orders = db.session.query(VendorPart.part_id,
+                                  Order_VendorPart.order_id,
+                                  func.sum(Order_VendorPart.number_ordered)).\
+            join(Order_VendorPart,
+                 Order_VendorPart.vendorpart_id == VendorPart.id).\
+            join(Order, Order_VendorPart.order_id == Order.id).\
+            filter(Order.archived == False).\
+            filter(VendorPart.part_id.in_(part_ids)).\
+            group_by(VendorPart.part_id, Order_VendorPart.order_id).all()
+        return boms, orders
+
+    def rebuild_bom():
+        where_used.rebuild_boms(db.session.connection(), [1])
+        db.session.commit()
+
+    def rebuild_all():
+        where_used.rebuild_all(db.session.connection())
+        db.session.commit()
+
+    results = {'lookup': measure(lambda: where_used.where_used(part_ids),
+                                 args.repeat),
+               'scan': measure(scan, args.repeat),
+               'rebuild_bom': measure(rebuild_bom, args.repeat),
+               'rebuild_all': measure(rebuild_all, args.repeat)}
+    used = results['lookup'].pop('result')
+    boms, orders = results['scan'].pop('result')
+    for name in ('rebuild_bom', 'rebuild_all'):
+        results[name].pop('result')
+    results['bom_usages'] = sum(len(u['boms']) for u in used.values())
+    results['order_usages'] = sum(len(u['orders']) for u in used.values())
+    results['consistent'] = (results['bom_usages'] == len(boms) and
+                             results['order_usages'] == len(orders))
+    results['bomparts'] = db.session.query(BOMPart).count()
+    emit('where_used', results, params, output)
+    db.session.remove()
+    os.remove(db.engine.url.database)
+
+
+if __name__ == '__main__':
+    main()
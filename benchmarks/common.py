@@ -0,0 +1,101 @@
+""" Shared setup for the benchmark scripts
+
+Benchmarks run against a scratch SQLite database, never app.db. Import this
+module before anything from app.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def scratch_app(db_path=None):
+    """ Point the app at a fresh scratch database, cloned from the baseline
+
+    Returns:
+        The app module
+    """
+    if db_path is None:
+        fd, db_path = tempfile.mkstemp(suffix='.db', prefix='bom_bench_')
+        os.close(fd)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.environ['BOM_DATABASE_URI'] = 'sqlite:///' + db_path
+    os.chdir(ROOT)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app
+    from app.baseline import clone_database
+    app.create_app()
+    clone_database(db_path)
+    return app
+
+
+def reset_db(app):
+    """ Replace the scratch database with an empty copy of the baseline """
+    app.db.session.remove()
+    app.db.engine.dispose()
+    from app.baseline import clone_database
+    clone_database(app.db.engine.url.database)
+
+
+class Timer:
+    """ Context manager recording the wall time of a block in seconds """
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def measure(fn, repeat=3, setup=None):
+    """ Time fn() repeat times, calling setup() untimed before each run
+
+    Returns:
+        A dict with the min, mean and max wall time in seconds, and the
+        result of the last call under 'result'
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with Timer() as t:
+            result = fn()
+        timings.append(t.elapsed)
+    return {'runs': repeat,
+            'min_s': min(timings),
+            'mean_s': sum(timings) / len(timings),
+            'max_s': max(timings),
+            'result': result}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL
+                                       ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def emit(name, results, params, output=None):
+    """ Print a benchmark result as one JSON line
+
+    The line is also appended to the file output, if given, so results of
+    runs on different commits can be collected and compared.
+    """
+    line = json.dumps({'benchmark': name,
+                       'commit': git_commit(),
+                       'params': params,
+                       'results': results}, sort_keys=True)
+    print(line)
+    if output is not None:
+        with open(output, 'a') as f:
+            f.write(line + '\n')
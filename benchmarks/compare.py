@@ -0,0 +1,71 @@
+#!flask/bin/python3
+""" Compare two sets of benchmark results
+
+Reads the JSON lines written by the benchmarks (eg. bench_suite.py
+--output) for a baseline and a candidate run, and prints every timing
+(keys ending in _s) side by side. The last result per benchmark in each file
+is used. Exits with 1 if any timing regressed by more than --threshold.
+
+usage: compare.py BASELINE.jsonl CANDIDATE.jsonl [--threshold 0.2]
+"""
+import sys
+import json
+import argparse
+
+
+def load(path):
+    results = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                results[entry['benchmark']] = entry
+    return results
+
+
+def timings(results, prefix=''):
+    """ Flatten nested results into {'a.b_s': seconds} """
+    flat = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(timings(value, name + '.'))
+        elif key.endswith('_s') and isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    regressions = 0
+    row = '{:<24} {:<28} {:>10} {:>10} {:>8}'
+    print(row.format('benchmark', 'timing', 'baseline', 'candidate',
+                     'change'))
+    for name in sorted(set(baseline) & set(candidate)):
+        if baseline[name]['params'] != candidate[name]['params']:
+            print('{}: parameters differ, skipped'.format(name))
+            continue
+        old = timings(baseline[name]['results'])
+        new = timings(candidate[name]['results'])
+        for key in sorted(set(old) & set(new)):
+            change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+            flag = ''
+            if change > args.threshold:
+                regressions += 1
+                flag = ' !'
+            print(row.format(name, key, '{:.4f}'.format(old[key]),
+                             '{:.4f}'.format(new[key]),
+                             '{:+.0%}'.format(change)) + flag)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+""" A local stand-in for a second vendor, to exercise multi-vendor sourcing
+without another vendor account
+
+Import after common.scratch_app(), the offers are written to the app's
+database.
+"""
+import zlib
+from datetime import datetime
+
+
+class FakeVendor():
+    """ A vendor without an API, whose offers are made up locally
+
+    stock() copies the latest offer of another vendor for each part, with
+    every price scaled by a factor between 0.8 and 1.2 that is fixed per
+    vendor part number, so it is cheaper for some parts and more expensive
+    for others. For a third of the parts its smallest price break is raised
+    to 10, so small quantities must be bought elsewhere.
+    """
+
+    def __init__(self, name='Fakey'):
+        self.name = name
+
+    def price_breaks(self, vendor_part_number, price_breaks):
+        """ The price breaks offered for another vendor's price_breaks """
+        seed = zlib.crc32(vendor_part_number.encode('utf-8'))
+        factor = 0.8 + 0.4 * (seed % 1000) / 1000
+        breaks = [{'BreakQuantity': break_['BreakQuantity'],
+                   'UnitPrice': round(break_['UnitPrice'] * factor, 5)}
+                  for break_ in sorted(price_breaks,
+                                       key=lambda b: b['BreakQuantity'])]
+        if breaks and seed % 3 == 0 and breaks[0]['BreakQuantity'] < 10:
+            breaks = [b for b in breaks if b['BreakQuantity'] >= 10] or \
+                [dict(breaks[-1], BreakQuantity=10)]
+        return breaks
+
+    def stock(self, part_ids=None):
+        """ Offer every given part (by default all parts with an offer) that
+        another vendor offers under a vendor part number
+
+        Returns:
+            The new VendorParts, added to the session
+        """
+        from app import db
+        from app.models import VendorPart
+        from app.sourcing import latest_offers
+        if part_ids is None:
+            part_ids = [id_ for id_, in db.session.query(
+                VendorPart.part_id).filter(VendorPart.part_id.isnot(None)).
+                distinct()]
+        now = datetime.now()
+        stocked = []
+        for part_id, offers in latest_offers(part_ids).items():
+            others = [offer for offer in offers if offer.vendor != self.name]
+            if len(others) < len(offers):
+                # already stocked
+                continue
+            others = [offer for offer in others
+                      if offer.vendor_part_number is not None]
+            if not others:
+                continue
+            offer = others[0]
+            vendorpart = VendorPart()
+            vendorpart.vendor = self.name
+            vendorpart.vendor_part_number = 'FK-' + offer.vendor_part_number
+            vendorpart.fetch_timestamp = now
+            vendorpart.last_seen = now
+            vendorpart.price_breaks = self.price_breaks(
+                vendorpart.vendor_part_number,
+                [{'BreakQuantity': quantity, 'UnitPrice': price}
+                 for quantity, price in zip(offer.quantities, offer.prices)])
+            vendorpart.part_id = part_id
+            stocked.append(vendorpart)
+        db.session.add_all(stocked)
+        return stocked
@@ -0,0 +1,156 @@
+#!flask/bin/python3
+""" Load test for logging in and for authenticated page views
+
+Each worker logs in with the given credentials and then requests the index
+page repeatedly, against the live server at --url.
+
+Without --url, gunicorn is started on a scratch database whose user has a
+password hash made with the previous sha256_crypt default of 535000 rounds.
+The first login then rehashes it with the current settings, and the report
+shows that login against the later ones and the rounds of the stored hash
+before and after.
+
+usage: load_login.py [--url https://localhost:8080 --email EMAIL
+                      --password PASSWORD] [--workers 8]
+                     [--logins 20] [--views 200]
+"""
+import os
+import re
+import ssl
+import json
+import time
+import argparse
+import statistics
+import http.cookiejar
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# passlib's sha256_crypt default, which hashes made before
+# PASSWORD_HASH_SETTINGS used
+LEGACY_ROUNDS = 535000
+
+_csrf_regex = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def _opener():
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    jar = http.cookiejar.CookieJar()
+    return urllib.request.build_opener(
+        urllib.request.HTTPSHandler(context=context),
+        urllib.request.HTTPCookieProcessor(jar))
+
+
+def login(opener, url, email, password):
+    page = opener.open(url + '/login').read().decode('utf-8')
+    match = _csrf_regex.search(page)
+    data = {'email': email, 'password': password}
+    if match:
+        data['csrf_token'] = match.group(1)
+    body = urllib.parse.urlencode(data).encode('utf-8')
+    start = time.perf_counter()
+    page = opener.open(url + '/login', body).read()
+    elapsed = time.perf_counter() - start
+    if b'Failed to log in' in page:
+        raise RuntimeError('Login failed for {}'.format(email))
+    return elapsed
+
+
+def view(opener, url):
+    start = time.perf_counter()
+    opener.open(url + '/index').read()
+    return time.perf_counter() - start
+
+
+def _summary(timings, wall):
+    timings = sorted(timings)
+    return {'count': len(timings),
+            'wall_s': wall,
+            'per_s': len(timings) / wall if wall else 0.0,
+            'mean_ms': 1000 * statistics.mean(timings),
+            'p50_ms': 1000 * timings[len(timings) // 2],
+            'p95_ms': 1000 * timings[int(len(timings) * 0.95)]}
+
+
+def run(url, email, password, workers, logins, views):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        login_timings = list(executor.map(
+            lambda _: login(_opener(), url, email, password), range(logins)))
+        login_wall = time.perf_counter() - start
+
+        opener = _opener()
+        login(opener, url, email, password)
+        start = time.perf_counter()
+        view_timings = list(executor.map(lambda _: view(opener, url),
+                                         range(views)))
+        view_wall = time.perf_counter() - start
+    return {'login': _summary(login_timings, login_wall),
+            'authenticated_view': _summary(view_timings, view_wall)}
+
+
+def _rounds(app, email):
+    from passlib.hash import sha256_crypt
+    from app.models import User
+    app.db.session.remove()
+    pwd_hash = User.query.filter(User.email == email).one().pwd_hash
+    return sha256_crypt.from_string(pwd_hash).rounds
+
+
+def run_legacy(workers, logins, views):
+    """ run() against a local server, starting from a legacy hash """
+    from passlib.hash import sha256_crypt
+    from common import scratch_app
+    from load_workers import EMAIL, PASSWORD, start_server, stop_server
+    import synthetic
+
+    app = scratch_app()
+    db_path = app.db.engine.url.database
+    synthetic.seed_database(app, users=1, boms=1, components=10,
+                            vendorparts=20, orders=0)
+    from app.models import User
+    user = User.query.filter(User.email == EMAIL).one()
+    user.pwd_hash = sha256_crypt.using(rounds=LEGACY_ROUNDS).hash(PASSWORD)
+    app.db.session.commit()
+    before = _rounds(app, EMAIL)
+
+    server, url = start_server(db_path, 1)
+    try:
+        first = login(_opener(), url, EMAIL, PASSWORD)
+        after = _rounds(app, EMAIL)
+        results = run(url, EMAIL, PASSWORD, workers, logins, views)
+    finally:
+        stop_server(server)
+    app.db.session.remove()
+    os.remove(db_path)
+    if after == before:
+        raise RuntimeError('The legacy hash was not rehashed on login')
+    results['rehash'] = {'rounds_before': before,
+                         'rounds_after': after,
+                         'first_login_ms': 1000 * first}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default=None)
+    parser.add_argument('--email')
+    parser.add_argument('--password')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=20)
+    parser.add_argument('--views', type=int, default=200)
+    args = parser.parse_args()
+    if args.url is None:
+        results = run_legacy(args.workers, args.logins, args.views)
+    elif not (args.email and args.password):
+        parser.error('--url needs --email and --password')
+    else:
+        results = run(args.url.rstrip('/'), args.email, args.password,
+                      args.workers, args.logins, args.views)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
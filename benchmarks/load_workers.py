@@ -0,0 +1,124 @@
+#!flask/bin/python3
+""" Throughput of the production server for different worker counts
+
+Seeds a scratch database (see synthetic.py), then for each --workers count
+starts gunicorn with gunicorn.conf.py on it, logs in and requests --path
+--requests times from --clients concurrent clients, and reports the
+requests per second and latencies. The output shows how throughput scales
+with the number of pre-forked workers.
+
+usage: load_workers.py [--workers 1 2 4 8] [--clients 16]
+                       [--requests 400] [--path /order_summary?id=1]
+                       [--output FILE]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+from common import ROOT, scratch_app, emit
+from load_login import _opener, _summary, login
+import synthetic
+
+EMAIL, PASSWORD = 'user0@example.com', 'bench'
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(db_path, workers):
+    port = _free_port()
+    env = dict(os.environ,
+               BOM_DATABASE_URI='sqlite:///' + db_path,
+               BOM_BIND='127.0.0.1:{}'.format(port),
+               BOM_WORKERS=str(workers),
+               BOM_TLS='1')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         '--access-logfile', '/dev/null', 'wsgi:application'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    url = 'https://127.0.0.1:{}'.format(port)
+    deadline = time.time() + 60
+    while True:
+        try:
+            _opener().open(url + '/login', timeout=5).read()
+            return server, url
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            if server.poll() is not None or time.time() > deadline:
+                server.kill()
+                raise RuntimeError('gunicorn did not start')
+            time.sleep(0.2)
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def run(url, path, clients, requests):
+    opener = _opener()
+    login(opener, url, EMAIL, PASSWORD)
+    # warm the workers up before measuring
+    for _ in range(clients):
+        _get(opener, url + path)
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        start = time.perf_counter()
+        timings = list(executor.map(lambda _: _get(opener, url + path),
+                                    range(requests)))
+        wall = time.perf_counter() - start
+    return _summary(timings, wall)
+
+
+def _get(opener, url):
+    start = time.perf_counter()
+    opener.open(url).read()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--path', default='/order_summary?id=1')
+    parser.add_argument('--output', default=None,
+                        help='file to append the JSON results to')
+    args = parser.parse_args()
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    output = os.path.abspath(args.output) if args.output else None
+
+    app = scratch_app()
+    db_path = app.db.engine.url.database
+    synthetic.seed_database(app, users=1, boms=5, vendorparts=1000,
+                            orders=2, lines=100)
+    app.db.session.remove()
+
+    results = {}
+    for workers in args.workers:
+        server, url = start_server(db_path, workers)
+        try:
+            results[str(workers)] = run(url, args.path, args.clients,
+                                        args.requests)
+        finally:
+            stop_server(server)
+    base = results[str(args.workers[0])]['per_s']
+    for summary in results.values():
+        summary['speedup'] = summary['per_s'] / base if base else 0.0
+    emit('load_workers', results, params, output)
+    os.remove(db_path)
+
+
+if __name__ == '__main__':
+    main()
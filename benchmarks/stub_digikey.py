@@ -0,0 +1,162 @@
+#!flask/bin/python3
+""" Local stand-in for the Digikey OAuth and search APIs
+
+Serves, on http://127.0.0.1:<port>:
+    POST /as/token.oauth2                  refresh_token grant
+    POST /services/basicsearch/v1/search   part lookup
+    GET  /images/<name>.png                a 400x300 part image, distinct
+                                           per name
+
+Responses are generated from the requested part number, so any part number
+resolves. Useful to exercise token refreshing, part lookups and the image
+cache without network access, eg. by pointing DIGIKEY_ACCESS_TOKEN_URL and
+DIGIKEY_BASE_URL at it.
+
+usage: stub_digikey.py [--port 8765] [--latency 0.05] [--token-lifetime 3600]
+"""
+import json
+import time
+import zlib
+import struct
+import functools
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+def _png(width=4, height=4, rgb=(200, 40, 40)):
+    raw = b''.join(b'\x00' + bytes(rgb) * width for _ in range(height))
+
+    def chunk(kind, data):
+        body = kind + data
+        return (struct.pack('>I', len(data)) + body +
+                struct.pack('>I', zlib.crc32(body) & 0xffffffff))
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0,
+                                       0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw)) +
+            chunk(b'IEND', b''))
+
+
+@functools.lru_cache(maxsize=64)
+def _image(path):
+    """ A distinct 400x300 PNG for every image path """
+    seed = zlib.crc32(path.encode('utf-8'))
+    return _png(400, 300, (seed & 0xff, (seed >> 8) & 0xff,
+                           (seed >> 16) & 0xff))
+
+
+def part_response(part_number, base_url):
+    """ A fake search response for part_number """
+    seed = zlib.crc32(part_number.encode('utf-8'))
+    unit = 0.01 + (seed % 1000) / 100
+    return {'Parts': [{
+        'ManufacturerName': {'Text': 'Stub Mfg {}'.format(seed % 20)},
+        'ManufacturerPartNumber': 'MPN-{}'.format(part_number),
+        'ProductDescription': 'Stub part {}'.format(part_number),
+        'PartDetailUrl': '{}/parts/{}'.format(base_url, part_number),
+        'PrimaryPhoto': {
+            'smallPhotoField': '{}/images/{}.png'.format(base_url,
+                                                         seed % 50)},
+        'Pricing': [{'BreakQuantity': q, 'UnitPrice': round(unit / f, 4)}
+                    for q, f in ((1, 1), (10, 1.2), (100, 1.5),
+                                 (1000, 2.0))],
+    }]}
+
+
+class StubState:
+    def __init__(self, latency, token_lifetime):
+        self.latency = latency
+        self.token_lifetime = token_lifetime
+        self.counts = {'token': 0, 'search': 0, 'image': 0}
+        self.lock = threading.Lock()
+        self.serial = 0
+
+    def count(self, kind):
+        with self.lock:
+            self.counts[kind] += 1
+            self.serial += 1
+            return self.serial
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type='application/json'):
+            if isinstance(body, dict):
+                body = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return self.rfile.read(length).decode('utf-8')
+
+        def do_POST(self):
+            time.sleep(state.latency)
+            if self.path.endswith('/token.oauth2'):
+                form = urllib.parse.parse_qs(self._body())
+                if form.get('grant_type') != ['refresh_token'] or \
+                        'refresh_token' not in form:
+                    return self._send(400, {'error': 'invalid_grant'})
+                serial = state.count('token')
+                return self._send(200, {
+                    'access_token': 'stub-access-{}'.format(serial),
+                    'refresh_token': 'stub-refresh-{}'.format(serial),
+                    'expires_in': state.token_lifetime,
+                    'token_type': 'Bearer'})
+            if self.path.endswith('/search'):
+                data = json.loads(self._body() or '{}')
+                part_number = urllib.parse.unquote_plus(
+                    data.get('PartNumber', ''))
+                if not part_number:
+                    return self._send(400, {'error': 'missing PartNumber'})
+                state.count('search')
+                host = 'http://{}:{}'.format(*self.server.server_address)
+                return self._send(200, part_response(part_number, host))
+            self._send(404, {'error': 'not found'})
+
+        def do_GET(self):
+            if self.path.startswith('/images/'):
+                state.count('image')
+                return self._send(200, _image(self.path), 'image/png')
+            if self.path == '/stats':
+                return self._send(200, dict(state.counts))
+            self._send(404, {'error': 'not found'})
+    return Handler
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start(port=0, latency=0.0, token_lifetime=3600):
+    """ Start the stub in a background thread, returns (server, state) """
+    state = StubState(latency, token_lifetime)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--token-lifetime', type=int, default=3600)
+    args = parser.parse_args()
+    state = StubState(args.latency, args.token_lifetime)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(state))
+    print('Stub Digikey listening on http://127.0.0.1:{}'.format(args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
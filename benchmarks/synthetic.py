@@ -0,0 +1,449 @@
+#!flask/bin/python3
+""" Synthetic data for the benchmarks
+
+Generates zipped KiCAD projects of a given size and number of sheets (in
+the legacy or the KiCAD 7 formats, optionally with a netlist), and
+seeds a scratch database with users, BOMs, parts, vendor parts and orders.
+Everything is derived from --seed, so runs on different commits see the same
+data.
+
+usage: synthetic.py archive OUT.zip [--components 500] [--sheets 4]
+                                    [--distinct N] [--seed 0]
+                                    [--format sch|kicad_sch|net|net_sexpr]
+       synthetic.py database OUT.db [--users 5] [--boms 20]
+                                    [--components 200] [--vendorparts 2000]
+                                    [--orders 20] [--lines 100] [--seed 0]
+"""
+import os
+import random
+import zipfile
+import argparse
+from datetime import datetime, timedelta
+
+_prefixes = ('R', 'C', 'U', 'D', 'L', 'J', 'Q', 'Y')
+_sch_header = """EESchema Schematic File Version 2
+LIBS:synthetic
+EELAYER 25 0
+EELAYER END
+$Descr A4 11693 8268
+encoding utf-8
+Sheet {sheet} {sheets}
+Title "Synthetic sheet {sheet}"
+$EndDescr
+"""
+_component = """$Comp
+L {value} {reference}
+U 1 1 {stamp:08X}
+P {x} {y}
+F 0 "{reference}" H {x} {y} 50  0000 C CNN
+F 1 "{value}" H {x} {y} 50  0000 C CNN
+F 2 "synthetic:{value}" H {x} {y} 50  0001 C CNN
+F 3 "" H {x} {y} 50  0001 C CNN
+F 4 "{lookup_id}" H {x} {y} 60  0001 C CNN "{lookup_source}"
+	1    {x} {y}
+	1    0    0    -1
+$EndComp
+"""
+_power = """$Comp
+L GND #PWR{n:03d}
+U 1 1 {stamp:08X}
+P {x} {y}
+F 0 "#PWR{n:03d}" H {x} {y} 50  0001 C CNN
+F 1 "GND" H {x} {y} 50  0000 C CNN
+	1    {x} {y}
+	1    0    0    -1
+$EndComp
+"""
+
+
+def vendor_part_number(i):
+    return 'SYN{:06d}-ND'.format(i)
+
+
+def price_breaks(i):
+    unit = 0.01 + (i * 7919 % 1000) / 100
+    return [{'BreakQuantity': q, 'UnitPrice': round(unit / f, 4)}
+            for q, f in ((1, 1), (10, 1.2), (100, 1.5), (1000, 2.0))]
+
+
+def make_schematic(components, sheet=1, sheets=1, rng=None):
+    """ A KiCAD schematic sheet
+
+    Args:
+        components: (reference, lookup_source, lookup_id) tuples
+    """
+    rng = rng or random.Random(0)
+    out = [_sch_header.format(sheet=sheet, sheets=sheets)]
+    for n, (reference, lookup_source, lookup_id) in enumerate(components):
+        x, y = rng.randrange(0, 11000, 50), rng.randrange(0, 8000, 50)
+        out.append(_component.format(
+            value='V' + lookup_id, reference=reference,
+            stamp=rng.getrandbits(32), x=x, y=y,
+            lookup_id=lookup_id, lookup_source=lookup_source))
+        if n % 20 == 0:
+            out.append(_power.format(n=n, stamp=rng.getrandbits(32),
+                                     x=x, y=y + 200))
+    out.append('$EndSCHEMATC\n')
+    return ''.join(out)
+
+
+_kicad_sch_header = """(kicad_sch (version 20230121) (generator eeschema)
+
+  (uuid {uuid})
+
+  (paper "A4")
+
+  (title_block
+    (title "Synthetic sheet {sheet} of {sheets}")
+  )
+
+  (lib_symbols
+"""
+_kicad_lib_symbol = """    (symbol "synthetic:{name}" (pin_names (offset 0)) (in_bom yes) (on_board yes)
+      (property "Reference" "{prefix}" (at 2.032 0 90)
+        (effects (font (size 1.27 1.27)))
+      )
+      (property "Value" "{name}" (at 0 0 90)
+        (effects (font (size 1.27 1.27)))
+      )
+      (symbol "{name}_0_1"
+        (rectangle (start -1.016 -2.54) (end 1.016 2.54)
+          (stroke (width 0.254) (type default))
+          (fill (type none))
+        )
+      )
+      (symbol "{name}_1_1"
+        (pin passive line (at 0 3.81 270) (length 1.27)
+          (name "~" (effects (font (size 1.27 1.27))))
+          (number "1" (effects (font (size 1.27 1.27))))
+        )
+      )
+    )
+"""
+_kicad_symbol = """  (symbol (lib_id "synthetic:{prefix}") (at {x} {y} 0) (unit {unit})
+    (in_bom {in_bom}) (on_board yes) (dnp no)
+    (uuid {uuid})
+    (property "Reference" "{reference}" (at {x} {y} 0)
+      (effects (font (size 1.27 1.27)) (justify left))
+    )
+    (property "Value" "{value}" (at {x} {y} 0)
+      (effects (font (size 1.27 1.27)) (justify left))
+    )
+    (property "Footprint" "synthetic:{value}" (at {x} {y} 0)
+      (effects (font (size 1.27 1.27)) hide)
+    )
+    (property "Datasheet" "~" (at {x} {y} 0)
+      (effects (font (size 1.27 1.27)) hide)
+    )
+    (property "{lookup_source}" "{lookup_id}" (at {x} {y} 0)
+      (effects (font (size 1.27 1.27)) hide)
+    )
+    (pin "1" (uuid {pin_uuid}))
+    (instances
+      (project "synthetic"
+        (path "/{sheet_uuid}" (reference "{reference}") (unit {unit}))
+      )
+    )
+  )
+"""
+
+
+def _uuid(rng):
+    return '{:08x}-{:04x}-{:04x}-{:04x}-{:012x}'.format(
+        rng.getrandbits(32), rng.getrandbits(16), rng.getrandbits(16),
+        rng.getrandbits(16), rng.getrandbits(48))
+
+
+def iter_kicad_sch(components, sheet=1, sheets=1, rng=None):
+    """ A KiCAD 7 .kicad_sch sheet, in pieces
+
+    Every tenth U also gets a second unit, and every twentieth component a
+    power symbol, neither of which adds a BOM part.
+
+    Args:
+        components: (reference, lookup_source, lookup_id) tuples
+    """
+    rng = rng or random.Random(0)
+    sheet_uuid = _uuid(rng)
+    yield _kicad_sch_header.format(uuid=sheet_uuid, sheet=sheet,
+                                   sheets=sheets)
+    for prefix in _prefixes + ('PWR',):
+        yield _kicad_lib_symbol.format(name=prefix, prefix=prefix)
+    yield '  )\n\n'
+    for n, (reference, lookup_source, lookup_id) in enumerate(components):
+        x = rng.randrange(0, 280000) / 1000
+        y = rng.randrange(0, 200000) / 1000
+        units = 2 if reference[0] == 'U' and n % 10 == 0 else 1
+        for unit in range(1, units + 1):
+            yield _kicad_symbol.format(
+                prefix=reference[0], reference=reference, unit=unit,
+                in_bom='yes', value='V' + lookup_id, x=x, y=y,
+                uuid=_uuid(rng), pin_uuid=_uuid(rng), sheet_uuid=sheet_uuid,
+                lookup_id=lookup_id, lookup_source=lookup_source)
+        if n % 20 == 0:
+            yield _kicad_symbol.format(
+                prefix='PWR', reference='#PWR{:04d}'.format(n), unit=1,
+                in_bom='yes', value='GND', x=x, y=y + 5,
+                uuid=_uuid(rng), pin_uuid=_uuid(rng), sheet_uuid=sheet_uuid,
+                lookup_id='', lookup_source='Digikey')
+    yield '  (sheet_instances\n    (path "/" (page "{}"))\n  )\n)\n'.format(
+        sheet)
+
+
+def _nets(components, rng):
+    """ Two node nets between random pins, as (name, [(ref, pin)]) """
+    references = [reference for reference, _, _ in components]
+    for i, reference in enumerate(references):
+        other = rng.choice(references)
+        yield ('Net-({}-Pad1)'.format(reference),
+               [(reference, '1'), (other, '2')])
+
+
+def iter_kicad_netlist(components, rng=None, fmt='xml'):
+    """ An exported KiCAD netlist, in pieces
+
+    Args:
+        components: (reference, lookup_source, lookup_id) tuples
+        fmt: 'xml' for the KiCad XML export, 'sexpr' for the default
+            s-expression netlist
+    """
+    rng = rng or random.Random(0)
+    if fmt == 'xml':
+        yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<export version="E">\n'
+               '  <design>\n'
+               '    <source>synthetic.kicad_sch</source>\n'
+               '    <tool>Eeschema 7.0</tool>\n'
+               '  </design>\n'
+               '  <components>\n')
+        for reference, lookup_source, lookup_id in components:
+            yield ('    <comp ref="{0}">\n'
+                   '      <value>V{2}</value>\n'
+                   '      <footprint>synthetic:V{2}</footprint>\n'
+                   '      <fields>\n'
+                   '        <field name="{1}">{2}</field>\n'
+                   '      </fields>\n'
+                   '      <libsource lib="synthetic" part="{3}" '
+                   'description="Synthetic part"/>\n'
+                   '      <property name="Sheetname" value=""/>\n'
+                   '      <sheetpath names="/" tstamps="/"/>\n'
+                   '      <tstamps>{4}</tstamps>\n'
+                   '    </comp>\n').format(reference, lookup_source,
+                                           lookup_id, reference[0],
+                                           _uuid(rng))
+        yield '  </components>\n  <nets>\n'
+        for code, (name, nodes) in enumerate(_nets(components, rng), 1):
+            yield '    <net code="{}" name="{}">\n{}    </net>\n'.format(
+                code, name, ''.join(
+                    '      <node ref="{}" pin="{}" pintype="passive"/>\n'.
+                    format(ref, pin) for ref, pin in nodes))
+        yield '  </nets>\n</export>\n'
+    else:
+        yield ('(export (version "E")\n'
+               '  (design\n'
+               '    (source "synthetic.kicad_sch")\n'
+               '    (tool "Eeschema 7.0"))\n'
+               '  (components\n')
+        for reference, lookup_source, lookup_id in components:
+            yield ('    (comp (ref "{0}")\n'
+                   '      (value "V{2}")\n'
+                   '      (footprint "synthetic:V{2}")\n'
+                   '      (fields\n'
+                   '        (field (name "{1}") "{2}"))\n'
+                   '      (libsource (lib "synthetic") (part "{3}") '
+                   '(description "Synthetic part"))\n'
+                   '      (property (name "Sheetname") (value ""))\n'
+                   '      (sheetpath (names "/") (tstamps "/"))\n'
+                   '      (tstamps "{4}"))\n').format(
+                       reference, lookup_source, lookup_id, reference[0],
+                       _uuid(rng))
+        yield '  )\n  (nets\n'
+        for code, (name, nodes) in enumerate(_nets(components, rng), 1):
+            yield '    (net (code "{}") (name "{}")\n{})\n'.format(
+                code, name, ''.join(
+                    '      (node (ref "{}") (pin "{}") (pintype "passive"))'
+                    '\n'.format(ref, pin) for ref, pin in nodes))
+        yield '  )\n)\n'
+
+
+def bom_fields(n_components, n_distinct=None, seed=0):
+    """ (reference, lookup_source, lookup_id) for a synthetic BOM
+
+    Components draw their vendor part numbers from a pool of n_distinct
+    parts (default a quarter of the components), so parts repeat.
+    """
+    rng = random.Random(seed)
+    n_distinct = n_distinct or max(1, n_components // 4)
+    counters = {}
+    fields = []
+    for _ in range(n_components):
+        prefix = rng.choice(_prefixes)
+        counters[prefix] = counters.get(prefix, 0) + 1
+        reference = '{}{}'.format(prefix, counters[prefix])
+        lookup_id = vendor_part_number(rng.randrange(n_distinct))
+        fields.append((reference, 'Digikey', lookup_id))
+    return fields
+
+
+def make_kicad_archive(path, n_components, n_sheets=1, n_distinct=None,
+                       seed=0, fmt='sch'):
+    """ Write a zipped KiCAD project with n_components over n_sheets sheets
+
+    Args:
+        fmt: 'sch' for legacy sheets, 'kicad_sch' for KiCAD 7 sheets, or
+            'net' / 'net_sexpr' for KiCAD 7 sheets and an XML /
+            s-expression netlist of the whole design
+    Returns:
+        The list of (reference, lookup_source, lookup_id) in the archive
+    """
+    rng = random.Random(seed)
+    fields = bom_fields(n_components, n_distinct, seed)
+    per_sheet = -(-n_components // n_sheets)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        if fmt == 'sch':
+            zf.writestr('synthetic/synthetic.pro', 'update=synthetic\n')
+        else:
+            zf.writestr('synthetic/synthetic.kicad_pro', '{}\n')
+        for sheet in range(n_sheets):
+            components = fields[sheet*per_sheet:(sheet+1)*per_sheet]
+            ext = 'sch' if fmt == 'sch' else 'kicad_sch'
+            name = ('synthetic/synthetic.' + ext if sheet == 0 else
+                    'synthetic/sheet{}.{}'.format(sheet, ext))
+            if fmt == 'sch':
+                text = make_schematic(components, sheet+1, n_sheets, rng)
+            else:
+                text = ''.join(iter_kicad_sch(components, sheet+1, n_sheets,
+                                              rng))
+            zf.writestr(name, text)
+        if fmt in ('net', 'net_sexpr'):
+            zf.writestr('synthetic/synthetic.net', ''.join(
+                iter_kicad_netlist(fields, rng,
+                                   'xml' if fmt == 'net' else 'sexpr')))
+    return fields
+
+
+def _insert(db, model, rows):
+    if rows:
+        db.session.execute(model.__table__.insert(), rows)
+
+
+def seed_database(app, users=5, boms=20, components=200, vendorparts=2000,
+                  orders=20, lines=100, seed=0):
+    """ Fill the app's (scratch) database with synthetic rows
+
+    Rows are written with core INSERTs, so the part search index is not
+    maintained for them. The where-used index is rebuilt once at the end.
+
+    Returns:
+        A dict with the ids of the created users, boms and orders
+    """
+    from app.models import (User, Part, VendorPart, BillOfMaterials,
+                            BOMPart, Order, Order_BOM, Order_VendorPart)
+    from app.utils import reference_sort_key
+    from app.where_used import rebuild_all
+    db = app.db
+    rng = random.Random(seed)
+    now = datetime.now()
+
+    pwd_hash = User('bench', 'bench@example.com', 'bench').pwd_hash
+    _insert(db, User, [
+        {'id': i+1, 'name': 'User {}'.format(i),
+         'email': 'user{}@example.com'.format(i), 'pwd_hash': pwd_hash}
+        for i in range(users)])
+    _insert(db, Part, [
+        {'id': i+1, 'manufacturer': 'Synthetic Mfg {}'.format(i % 40),
+         'manufacturer_part_number': 'SYN-{:06d}'.format(i),
+         'short_description': 'Synthetic part {}'.format(i),
+         'image_url': '/static/missing_part.png'}
+        for i in range(vendorparts)])
+    _insert(db, VendorPart, [
+        {'id': i+1, 'part_id': i+1, 'vendor': 'Digikey',
+         'vendor_part_number': vendor_part_number(i),
+         'fetch_timestamp': now - timedelta(hours=1),
+         'last_seen': now - timedelta(hours=1),
+         'price_breaks': price_breaks(i),
+         'url': 'https://example.com/parts/{}'.format(i)}
+        for i in range(vendorparts)])
+    _insert(db, BillOfMaterials, [
+        {'id': i+1, 'name': 'Synthetic BOM {}'.format(i), 'version': '1',
+         'user_id': i % users + 1, 'timestamp': now, 'content_version': 0}
+        for i in range(boms)])
+    bompart_rows = []
+    for bom_id in range(1, boms+1):
+        for reference, source, lookup_id in bom_fields(
+                components, vendorparts, seed + bom_id):
+            part_id = int(lookup_id[3:9]) + 1
+            bompart_rows.append({'bom_id': bom_id, 'reference': reference,
+                                 'reference_sort_key':
+                                     reference_sort_key(reference),
+                                 'lookup_source': source,
+                                 'lookup_id': lookup_id,
+                                 'part_id': part_id})
+    _insert(db, BOMPart, bompart_rows)
+    _insert(db, Order, [
+        {'id': i+1, 'order_name': 'Synthetic order {}'.format(i),
+         'description': 'Benchmark order', 'archived': False,
+         'delivery_date': now.date(), 'cost_object': '12-3456',
+         'requestor_name': 'Bench', 'requestor_phone': '555-0100',
+         'supervisor_name': 'Bench', 'timestamp': now,
+         'user_id': i % users + 1}
+        for i in range(orders)])
+    _insert(db, Order_BOM, [
+        {'order_id': i+1, 'bom_id': i % boms + 1, 'bom_count': 1}
+        for i in range(orders if boms else 0)])
+    line_rows = []
+    for order_id in range(1, orders+1):
+        for vendorpart_id in rng.sample(range(1, vendorparts+1),
+                                        min(lines, vendorparts)):
+            count = rng.randint(1, 200)
+            line_rows.append({'order_id': order_id,
+                              'vendorpart_id': vendorpart_id,
+                              'number_used': count,
+                              'number_ordered': count})
+    _insert(db, Order_VendorPart, line_rows)
+    rebuild_all(db.session.connection())
+    db.session.commit()
+    return {'users': list(range(1, users+1)),
+            'boms': list(range(1, boms+1)),
+            'orders': list(range(1, orders+1))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest='command')
+    archive = sub.add_parser('archive')
+    archive.add_argument('path')
+    archive.add_argument('--components', type=int, default=500)
+    archive.add_argument('--sheets', type=int, default=4)
+    archive.add_argument('--distinct', type=int, default=None)
+    archive.add_argument('--seed', type=int, default=0)
+    archive.add_argument('--format', default='sch',
+                         choices=('sch', 'kicad_sch', 'net', 'net_sexpr'))
+    database = sub.add_parser('database')
+    database.add_argument('path')
+    database.add_argument('--users', type=int, default=5)
+    database.add_argument('--boms', type=int, default=20)
+    database.add_argument('--components', type=int, default=200)
+    database.add_argument('--vendorparts', type=int, default=2000)
+    database.add_argument('--orders', type=int, default=20)
+    database.add_argument('--lines', type=int, default=100)
+    database.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'archive':
+        fields = make_kicad_archive(args.path, args.components, args.sheets,
+                                    args.distinct, args.seed, args.format)
+        print('Wrote {} components to {}'.format(len(fields), args.path))
+    elif args.command == 'database':
+        from common import scratch_app
+        path = os.path.abspath(args.path)
+        app = scratch_app(path)
+        seed_database(app, args.users, args.boms, args.components,
+                      args.vendorparts, args.orders, args.lines, args.seed)
+        print('Seeded {}'.format(path))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!flask/bin/python3
+""" Upload many zipped KiCAD projects as new BOMs in one go
+
+usage: bulk_upload.py --user EMAIL [--version VERSION] ARCHIVE [ARCHIVE ...]
+"""
+import os
+import sys
+import shutil
+import argparse
+
+from app import app
+from app.ingest import ArchiveUpload, ingest_archives
+from app.models import User
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('archives', nargs='+', help='zipped KiCAD projects')
+    parser.add_argument('--user', required=True,
+                        help='email of the user that will own the BOMs')
+    parser.add_argument('--version', default='',
+                        help='version recorded for every BOM')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--group-size', type=int, default=None)
+    args = parser.parse_args()
+
+    user = User.query.filter(User.email == args.user).first()
+    if user is None:
+        sys.exit('No user with email {}'.format(args.user))
+
+    dest = app.config['UPLOADED_UPLOADS_DEST']
+    os.makedirs(dest, exist_ok=True)
+    archives = []
+    for path in args.archives:
+        base = os.path.basename(path)
+        name, ext = os.path.splitext(base)
+        target = os.path.join(dest, base)
+        i = 1
+        while os.path.exists(target):
+            target = os.path.join(dest, '{}_{}{}'.format(name, i, ext))
+            i += 1
+        shutil.copy(path, target)
+        archives.append(ArchiveUpload(target, name, args.version))
+
+    ingest_archives(archives, user, args.workers, args.group_size)
+    failed = 0
+    for archive in archives:
+        info = archive.to_dict()
+        print('{file}: {status} bom_id={bom_id} parts={part_count} {message}'
+              .format(**info))
+        failed += archive.status != 'stored'
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
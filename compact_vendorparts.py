@@ -0,0 +1,142 @@
+#!flask/bin/python3
+""" Prune superseded vendor part history
+
+Every refresh adds a new VendorPart row per vendor part number. This keeps,
+for each (vendor, vendor_part_number), the most recent fetch, any fetch
+younger than --keep-days, and every fetch still referenced by an order line,
+deletes the rest along with the raw payloads no longer used by any VendorPart,
+and reports the space reclaimed.
+
+usage: compact_vendorparts.py [--keep-days 30] [--dry-run] [--no-vacuum]
+"""
+import sys
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, and_
+
+from app import db
+from app.models import VendorPart, VendorPayload, Order_VendorPart
+from app.utils import chunks
+
+
+def database_bytes():
+    """ (allocated, free) bytes of the SQLite database file """
+    if db.engine.name != 'sqlite':
+        return None, None
+    page_size = db.engine.execute('PRAGMA page_size').scalar()
+    page_count = db.engine.execute('PRAGMA page_count').scalar()
+    free_pages = db.engine.execute('PRAGMA freelist_count').scalar()
+    return page_count * page_size, free_pages * page_size
+
+
+def superseded_vendorpart_ids(keep_days):
+    vendorparts = VendorPart.__table__
+    latest = select([vendorparts.c.vendor,
+                     vendorparts.c.vendor_part_number,
+                     func.max(vendorparts.c.fetch_timestamp).
+                     label('fetch_timestamp')]).\
+        group_by(vendorparts.c.vendor, vendorparts.c.vendor_part_number).\
+        alias('latest')
+    referenced = select([Order_VendorPart.__table__.c.vendorpart_id]).\
+        where(Order_VendorPart.__table__.c.vendorpart_id.isnot(None))
+    cutoff = datetime.now() - timedelta(days=keep_days)
+    query = select([vendorparts.c.id]).\
+        select_from(vendorparts.join(
+            latest,
+            and_(vendorparts.c.vendor == latest.c.vendor,
+                 vendorparts.c.vendor_part_number ==
+                 latest.c.vendor_part_number))).\
+        where(vendorparts.c.fetch_timestamp < latest.c.fetch_timestamp).\
+        where(vendorparts.c.last_seen < cutoff).\
+        where(vendorparts.c.id.notin_(referenced))
+    return [row[0] for row in db.engine.execute(query)]
+
+
+def orphan_payload_ids():
+    payloads = VendorPayload.__table__
+    used = select([VendorPart.__table__.c.payload_id]).\
+        where(VendorPart.__table__.c.payload_id.isnot(None))
+    query = select([payloads.c.id]).where(payloads.c.id.notin_(used))
+    return [row[0] for row in db.engine.execute(query)]
+
+
+def payload_stats():
+    payloads = VendorPayload.__table__
+    count, raw, stored = db.engine.execute(
+        select([func.count(payloads.c.id),
+                func.coalesce(func.sum(payloads.c.raw_size), 0),
+                func.coalesce(func.sum(func.length(payloads.c.data)), 0)])
+    ).first()
+    return {'payloads': count, 'raw_bytes': raw, 'stored_bytes': stored}
+
+
+def compact(keep_days, dry_run=False, vacuum=True):
+    report = {'payloads_before': payload_stats()}
+    report['database_bytes_before'], report['free_bytes_before'] = \
+        database_bytes()
+    vendorpart_ids = superseded_vendorpart_ids(keep_days)
+    report['vendorparts_deleted'] = len(vendorpart_ids)
+    if dry_run:
+        return report
+
+    vendorparts = VendorPart.__table__
+    for chunk in chunks(vendorpart_ids, 500):
+        db.session.execute(vendorparts.delete().
+                           where(vendorparts.c.id.in_(chunk)))
+    db.session.commit()
+
+    payload_ids = orphan_payload_ids()
+    payloads = VendorPayload.__table__
+    for chunk in chunks(payload_ids, 500):
+        db.session.execute(payloads.delete().
+                           where(payloads.c.id.in_(chunk)))
+    db.session.commit()
+    report['payloads_deleted'] = len(payload_ids)
+
+    if vacuum and db.engine.name == 'sqlite':
+        db.session.remove()
+        with db.engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').\
+                execute('VACUUM')
+    report['payloads_after'] = payload_stats()
+    report['database_bytes_after'], report['free_bytes_after'] = \
+        database_bytes()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--keep-days', type=int, default=30,
+                        help='keep every fetch younger than this')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only report what would be deleted')
+    parser.add_argument('--no-vacuum', action='store_true',
+                        help="don't VACUUM the database afterwards")
+    args = parser.parse_args()
+
+    report = compact(args.keep_days, dry_run=args.dry_run,
+                     vacuum=not args.no_vacuum)
+    before = report['payloads_before']
+    print('Payloads: {} stored in {} bytes ({} bytes uncompressed)'
+          .format(before['payloads'], before['stored_bytes'],
+                  before['raw_bytes']))
+    if args.dry_run:
+        print('Would delete {} superseded vendor parts'
+              .format(report['vendorparts_deleted']))
+        return
+    print('Deleted {} superseded vendor parts and {} unused payloads'
+          .format(report['vendorparts_deleted'], report['payloads_deleted']))
+    if report['database_bytes_before'] is not None:
+        # bytes in use, so pages freed without a VACUUM also count
+        reclaimed = ((report['database_bytes_before'] -
+                      report['free_bytes_before']) -
+                     (report['database_bytes_after'] -
+                      report['free_bytes_after']))
+        print('Database: {} -> {} bytes, {} bytes reclaimed'
+              .format(report['database_bytes_before'],
+                      report['database_bytes_after'], reclaimed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,10 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 LOG_LEVEL = 'INFO'
 
+# Certificate and key used by run.py and, by default, gunicorn.conf.py
+SSL_CERT_FILE = os.path.join(basedir, 'ssl', 'cert.pem')
+SSL_KEY_FILE = os.path.join(basedir, 'ssl', 'key.pem')
+
 # **********************************************************************************
 # *  DIGIKEY OAUTH 2
 # **********************************************************************************
@@ -13,12 +17,51 @@ DIGIKEY_CONSUMER_SECRET = 'gM8eG5pN1lG0eO6yV1tG5vM4nX8xH4cI6xG3xJ6fC8mO3fT3mI'
 DIGIKEY_AUTHORIZE_URL = 'https://sso.digikey.com/as/authorization.oauth2'
 DIGIKEY_ACCESS_TOKEN_URL = 'https://sso.digikey.com/as/token.oauth2'
 DIGIKEY_BASE_URL = 'https://api.digikey.com/services/basicsearch/v1/'
+# Access tokens are refreshed this many seconds before they expire
+OAUTH_REFRESH_MARGIN = 300
+# Lock files that let a single process at a time refresh a user's tokens, as
+# the refresh token changes with every refresh
+OAUTH_LOCK_DIR = os.path.join(basedir, 'locks')
+# Vendor lookups kept in flight at once by the async fetch engine
+FETCH_CONCURRENCY = 200
+# Seconds allowed per vendor lookup
+FETCH_TIMEOUT = 30
 
 # **********************************************************************************
 # * SQL CONFIGURATION
 # **********************************************************************************
-SQLALCHEMY_DATABASE_URI = 'sqlite:///'+os.path.join(basedir, 'app.db')
+# BOM_DATABASE_URI overrides the database, eg. for benchmarks on scratch dbs
+SQLALCHEMY_DATABASE_URI = os.environ.get(
+    'BOM_DATABASE_URI', 'sqlite:///'+os.path.join(basedir, 'app.db'))
 SQLALCHEMY_MIGRATE_REPO = os.path.join(basedir, 'db_repository')
+# Compression of stored vendor responses, 'zlib' or 'zstd' (needs zstandard)
+VENDOR_PAYLOAD_CODEC = 'zlib'
+# BOM revision snapshots are stored as deltas against their parent, with a
+# full snapshot at least every BOM_REVISION_KEYFRAME_INTERVAL revisions
+BOM_REVISION_CODEC = 'zlib'
+BOM_REVISION_KEYFRAME_INTERVAL = 10
+
+###############################################################################
+# AUTHENTICATION CONFIGURATION
+###############################################################################
+# passlib CryptContext schemes. The first scheme is used for new hashes,
+# hashes of the other schemes (or with outdated settings) are transparently
+# rehashed on the next successful login. eg. ['argon2', 'bcrypt',
+# 'sha256_crypt'] (argon2 and bcrypt need argon2_cffi and bcrypt installed)
+PASSWORD_SCHEMES = ['sha256_crypt']
+# passlib only counts hashes with rounds (time_cost for argon2) outside
+# min_rounds..max_rounds as outdated, not those that differ from the default,
+# so max_rounds must be lowered with the default for existing hashes to be
+# rehashed
+PASSWORD_HASH_SETTINGS = {'sha256_crypt__default_rounds': 80000,
+                          'sha256_crypt__max_rounds': 80000,
+                          'bcrypt__default_rounds': 10,
+                          'bcrypt__max_rounds': 10,
+                          'argon2__time_cost': 2,
+                          'argon2__max_rounds': 2,
+                          'argon2__memory_cost': 65536}
+# Seconds a loaded user is reused across requests before hitting the db again
+USER_CACHE_TTL = 30
 
 ###############################################################################
 # WTF CONFIGURATION
@@ -33,3 +76,58 @@ UPLOADED_UPLOADS_DEST = os.path.join(basedir, 'uploads')
 
 
 SQLALCHEMY_TRACK_MODIFICATIONS = True
+
+###############################################################################
+# FRAGMENT CACHE CONFIGURATION
+###############################################################################
+# Upper bound on the memory used by cached, pre-rendered BOM part tables.
+FRAGMENT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+###############################################################################
+# BULK UPLOAD CONFIGURATION
+###############################################################################
+BULK_UPLOAD_WORKERS = 8
+# Number of BOMs committed per transaction
+BULK_UPLOAD_GROUP_SIZE = 10
+
+###############################################################################
+# PART SEARCH CONFIGURATION
+###############################################################################
+SEARCH_RESULTS_PER_PAGE = 20
+
+###############################################################################
+# PART IMAGE CACHE CONFIGURATION
+###############################################################################
+IMAGE_CACHE_DIR = os.path.join(basedir, 'image_cache')
+IMAGE_THUMBNAIL_SIZES = (200,)
+IMAGE_FETCH_WORKERS = 4
+IMAGE_FETCH_TIMEOUT = 10
+
+###############################################################################
+# REPORTS
+###############################################################################
+# Where command line jobs (eg. nightly_refresh.py) write their run reports
+REPORT_DIR = os.path.join(basedir, 'reports')
+
+###############################################################################
+# INSTRUMENTATION
+###############################################################################
+# Per-request timing, SQL and template metrics, see app/instrumentation.py
+INSTRUMENTATION_ENABLED = True
+# Requests taking longer than this are written to the slow request log
+SLOW_REQUEST_THRESHOLD_MS = 500
+# File for the slow request log, None to only use the app.slow_requests logger
+SLOW_REQUEST_LOG = None
+
+###############################################################################
+# PROFILING
+###############################################################################
+# Users allowed on the admin pages, eg. ['someone@unl.edu']
+ADMIN_EMAILS = []
+# Endpoints profiled on every request, eg. ('order_summary', 'bom_summary')
+PROFILE_ENDPOINTS = ()
+# Requests by admins carrying this header are profiled, None to disable
+PROFILE_HEADER = 'X-Profile'
+PROFILE_DIR = os.path.join(basedir, 'profiles')
+# Number of profiles kept in PROFILE_DIR
+PROFILE_KEEP = 50
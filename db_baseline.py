@@ -0,0 +1,39 @@
+#!flask/bin/python3
+""" Check or regenerate the baseline schema (db_repository/baseline.sql)
+
+The baseline has to match the models, or databases created from it would
+differ from migrated ones. --check exits with 1 when it is out of date.
+
+usage: db_baseline.py (--check | --write)
+"""
+import sys
+import argparse
+
+from app.baseline import (BASELINE_PATH, latest_version, read_baseline,
+                          render_baseline, write_baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--check', action='store_true')
+    group.add_argument('--write', action='store_true')
+    args = parser.parse_args()
+
+    if args.write:
+        version = write_baseline()
+        print('Baseline at version {} saved as {}'.format(version,
+                                                          BASELINE_PATH))
+        return
+    version, script = read_baseline()
+    if version != latest_version():
+        sys.exit('Baseline is at version {}, the newest migration is {}'
+                 .format(version, latest_version()))
+    if script != render_baseline(version):
+        sys.exit('Baseline does not match the models, '
+                 'run db_baseline.py --write')
+    print('Baseline at version {} is up to date'.format(version))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,11 +3,18 @@ from migrate.versioning import api
 from config import SQLALCHEMY_DATABASE_URI
 from config import SQLALCHEMY_MIGRATE_REPO
 from app import db
+from app.baseline import create_database, sqlite_path
 import os.path
-db.create_all()
+path = sqlite_path(SQLALCHEMY_DATABASE_URI)
 if not os.path.exists(SQLALCHEMY_MIGRATE_REPO):
+    db.create_all()
     api.create(SQLALCHEMY_MIGRATE_REPO, 'database repository')
     api.version_control(SQLALCHEMY_DATABASE_URI, SQLALCHEMY_MIGRATE_REPO)
+elif path is not None:
+    # start from the baseline schema, then apply any newer migrations
+    create_database(path)
+    api.upgrade(SQLALCHEMY_DATABASE_URI, SQLALCHEMY_MIGRATE_REPO)
 else:
+    db.create_all()
     api.version_control(SQLALCHEMY_DATABASE_URI, SQLALCHEMY_MIGRATE_REPO,
                         api.version(SQLALCHEMY_MIGRATE_REPO))
@@ -1,12 +1,13 @@
 #!flask/bin/python3
-import imp
+import types
 from migrate.versioning import api
 from app import db
+from app.baseline import write_baseline
 from config import SQLALCHEMY_DATABASE_URI
 from config import SQLALCHEMY_MIGRATE_REPO
 v = api.db_version(SQLALCHEMY_DATABASE_URI, SQLALCHEMY_MIGRATE_REPO)
 migration = SQLALCHEMY_MIGRATE_REPO + ('/versions/%03d_migration.py' % (v+1))
-tmp_module = imp.new_module('old_model')
+tmp_module = types.ModuleType('old_model')
 old_model = api.create_model(SQLALCHEMY_DATABASE_URI, SQLALCHEMY_MIGRATE_REPO)
 exec(old_model, tmp_module.__dict__)
 script = api.make_update_script_for_model(SQLALCHEMY_DATABASE_URI,
@@ -15,5 +16,7 @@ script = api.make_update_script_for_model(SQLALCHEMY_DATABASE_URI,
 open(migration, "wt").write(script)
 api.upgrade(SQLALCHEMY_DATABASE_URI, SQLALCHEMY_MIGRATE_REPO)
 v = api.db_version(SQLALCHEMY_DATABASE_URI, SQLALCHEMY_MIGRATE_REPO)
+write_baseline(version=v)
 print('New migration saved as ' + migration)
 print('Current database version: ' + str(v))
+print('Baseline schema updated')
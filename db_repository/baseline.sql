@@ -0,0 +1,187 @@
+-- Baseline schema, generated from the models by app/baseline.py.
+-- Do not edit, regenerate it with db_baseline.py --write.
+-- version: 39
+
+CREATE TABLE billofmaterials (
+	id INTEGER NOT NULL,
+	name VARCHAR,
+	zip_file VARCHAR,
+	version VARCHAR,
+	timestamp DATETIME,
+	content_version INTEGER,
+	user_id INTEGER,
+	PRIMARY KEY (id),
+	FOREIGN KEY(user_id) REFERENCES user (id)
+);
+
+CREATE TABLE bompart (
+	id INTEGER NOT NULL,
+	reference VARCHAR,
+	reference_sort_key VARCHAR,
+	lookup_source VARCHAR,
+	lookup_id VARCHAR,
+	bom_id INTEGER,
+	part_id INTEGER,
+	PRIMARY KEY (id),
+	FOREIGN KEY(bom_id) REFERENCES billofmaterials (id),
+	FOREIGN KEY(part_id) REFERENCES part (id)
+);
+
+CREATE INDEX ix_bompart_bom_reference_sort_key ON bompart (bom_id, reference_sort_key);
+
+CREATE TABLE bomrevision (
+	id INTEGER NOT NULL,
+	bom_id INTEGER,
+	project VARCHAR,
+	number INTEGER,
+	parent_id INTEGER,
+	depth INTEGER,
+	entries INTEGER,
+	digest VARCHAR,
+	codec VARCHAR,
+	data BLOB,
+	PRIMARY KEY (id),
+	UNIQUE (bom_id),
+	FOREIGN KEY(bom_id) REFERENCES billofmaterials (id),
+	FOREIGN KEY(parent_id) REFERENCES bomrevision (id)
+);
+
+CREATE INDEX ix_bomrevision_project_number ON bomrevision (project, number);
+
+CREATE TABLE manufacturer (
+	name VARCHAR NOT NULL,
+	PRIMARY KEY (name)
+);
+
+CREATE TABLE "order" (
+	id INTEGER NOT NULL,
+	archived BOOLEAN,
+	description VARCHAR,
+	delivery_date DATE,
+	cost_object VARCHAR,
+	requestor_name VARCHAR,
+	requestor_phone VARCHAR,
+	supervisor_name VARCHAR,
+	order_name VARCHAR,
+	timestamp DATETIME,
+	user_id INTEGER,
+	PRIMARY KEY (id),
+	CHECK (archived IN (0, 1)),
+	FOREIGN KEY(user_id) REFERENCES user (id)
+);
+
+CREATE TABLE order_bom (
+	id INTEGER NOT NULL,
+	bom_count INTEGER,
+	order_id INTEGER,
+	bom_id INTEGER,
+	PRIMARY KEY (id),
+	FOREIGN KEY(order_id) REFERENCES "order" (id),
+	FOREIGN KEY(bom_id) REFERENCES billofmaterials (id)
+);
+
+CREATE TABLE order_vendorpart (
+	id INTEGER NOT NULL,
+	number_used INTEGER,
+	number_ordered INTEGER,
+	order_id INTEGER,
+	vendorpart_id INTEGER,
+	PRIMARY KEY (id),
+	FOREIGN KEY(order_id) REFERENCES "order" (id),
+	FOREIGN KEY(vendorpart_id) REFERENCES vendorpart (id)
+);
+
+CREATE TABLE part (
+	id INTEGER NOT NULL,
+	short_description VARCHAR,
+	manufacturer VARCHAR,
+	image_url VARCHAR,
+	image_hash VARCHAR,
+	manufacturer_part_number VARCHAR,
+	PRIMARY KEY (id)
+);
+
+CREATE VIRTUAL TABLE part_search USING fts5(manufacturer_part_number, short_description, manufacturer, vendor_part_numbers, tokenize = "unicode61 tokenchars '-.'", prefix = '2 3 4');
+
+CREATE VIRTUAL TABLE part_search_vocab USING fts5vocab(part_search, 'row');
+
+CREATE TABLE partbomusage (
+	part_id INTEGER NOT NULL,
+	bom_id INTEGER NOT NULL,
+	count INTEGER,
+	PRIMARY KEY (part_id, bom_id),
+	FOREIGN KEY(part_id) REFERENCES part (id),
+	FOREIGN KEY(bom_id) REFERENCES billofmaterials (id)
+);
+
+CREATE INDEX ix_partbomusage_bom_id ON partbomusage (bom_id);
+
+CREATE TABLE partorderusage (
+	part_id INTEGER NOT NULL,
+	order_id INTEGER NOT NULL,
+	lines INTEGER,
+	number_ordered INTEGER,
+	PRIMARY KEY (part_id, order_id),
+	FOREIGN KEY(part_id) REFERENCES part (id),
+	FOREIGN KEY(order_id) REFERENCES "order" (id)
+);
+
+CREATE INDEX ix_partorderusage_order_id ON partorderusage (order_id);
+
+CREATE TABLE pricehistory (
+	id INTEGER NOT NULL,
+	part_id INTEGER,
+	vendor VARCHAR,
+	vendor_part_number VARCHAR,
+	timestamp DATETIME,
+	unit_price FLOAT,
+	price_breaks VARCHAR,
+	PRIMARY KEY (id),
+	FOREIGN KEY(part_id) REFERENCES part (id)
+);
+
+CREATE INDEX ix_pricehistory_part_timestamp ON pricehistory (part_id, timestamp);
+
+CREATE TABLE user (
+	id INTEGER NOT NULL,
+	name VARCHAR,
+	email VARCHAR,
+	pwd_hash VARCHAR,
+	digikey_oauth_token VARCHAR,
+	digikey_oauth_token_expire DATETIME,
+	digikey_oauth_refresh_token VARCHAR,
+	PRIMARY KEY (id),
+	UNIQUE (email)
+);
+
+CREATE TABLE vendorpart (
+	id INTEGER NOT NULL,
+	json VARCHAR,
+	payload_id INTEGER,
+	vendor VARCHAR,
+	vendor_part_number VARCHAR,
+	fetch_timestamp DATETIME,
+	last_seen DATETIME,
+	price_breaks BLOB,
+	url VARCHAR,
+	part_id INTEGER,
+	PRIMARY KEY (id),
+	FOREIGN KEY(payload_id) REFERENCES vendorpayload (id),
+	FOREIGN KEY(part_id) REFERENCES part (id)
+);
+
+CREATE INDEX ix_vendorpart_part_vendor_fetch ON vendorpart (part_id, vendor, fetch_timestamp);
+
+CREATE INDEX ix_vendorpart_payload_id ON vendorpart (payload_id);
+
+CREATE TABLE vendorpayload (
+	id INTEGER NOT NULL,
+	sha256 VARCHAR,
+	codec VARCHAR,
+	raw_size INTEGER,
+	data BLOB,
+	PRIMARY KEY (id)
+);
+
+CREATE UNIQUE INDEX ix_vendorpayload_sha256 ON vendorpayload (sha256);
+
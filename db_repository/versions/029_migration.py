@@ -0,0 +1,32 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+billofmaterials = Table('billofmaterials', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', String),
+    Column('zip_file', String),
+    Column('version', String),
+    Column('timestamp', DateTime),
+    Column('content_version', Integer, default=ColumnDefault(0)),
+    Column('user_id', Integer),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['billofmaterials'].columns['content_version'].create(
+        populate_default=True)
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['billofmaterials'].columns['content_version'].drop()
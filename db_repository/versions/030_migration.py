@@ -0,0 +1,56 @@
+import re
+
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+bompart = Table('bompart', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('reference', String),
+    Column('reference_sort_key', String),
+    Column('lookup_source', String),
+    Column('lookup_id', String),
+    Column('bom_id', Integer),
+    Column('part_id', Integer),
+)
+ix_bompart_bom_reference_sort_key = Index('ix_bompart_bom_reference_sort_key',
+                                          bompart.c.bom_id,
+                                          bompart.c.reference_sort_key)
+
+# Frozen copy of app.utils.reference_sort_key as of this migration.
+_reference_regex = re.compile(r'^([^0-9]*)([0-9]*)(.*)$', flags=re.DOTALL)
+
+
+def _reference_sort_key(reference):
+    if reference is None:
+        return None
+    prefix, number, suffix = _reference_regex.match(reference).groups()
+    if number:
+        number = number.zfill(10)
+    return '{} {}{}'.format(prefix, number, suffix)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['bompart'].columns['reference_sort_key'].create()
+    rows = migrate_engine.execute(select([bompart.c.id, bompart.c.reference]))
+    for id_, reference in rows.fetchall():
+        migrate_engine.execute(
+            bompart.update().
+            where(bompart.c.id == id_).
+            values(reference_sort_key=_reference_sort_key(reference)))
+    ix_bompart_bom_reference_sort_key.create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    ix_bompart_bom_reference_sort_key.drop()
+    post_meta.tables['bompart'].columns['reference_sort_key'].drop()
@@ -0,0 +1,52 @@
+from sqlalchemy import *
+from migrate import *
+from sqlalchemy.exc import OperationalError
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+manufacturer = Table('manufacturer', post_meta,
+    Column('name', String, primary_key=True, nullable=False),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['manufacturer'].create()
+    migrate_engine.execute(
+        "INSERT INTO manufacturer(name) "
+        "SELECT DISTINCT manufacturer FROM part "
+        "WHERE manufacturer IS NOT NULL")
+    try:
+        migrate_engine.execute(
+            "CREATE VIRTUAL TABLE part_search USING fts5("
+            "manufacturer_part_number, short_description, manufacturer, "
+            "vendor_part_numbers, "
+            "tokenize = \"unicode61 tokenchars '-.'\", prefix = '2 3 4')")
+        migrate_engine.execute(
+            "CREATE VIRTUAL TABLE part_search_vocab "
+            "USING fts5vocab(part_search, 'row')")
+    except OperationalError:
+        # SQLite without FTS5, the app falls back to LIKE searches
+        return
+    migrate_engine.execute(
+        "INSERT INTO part_search(rowid, manufacturer_part_number, "
+        "short_description, manufacturer, vendor_part_numbers) "
+        "SELECT part.id, part.manufacturer_part_number, "
+        "part.short_description, part.manufacturer, "
+        "(SELECT group_concat(DISTINCT vendorpart.vendor_part_number) "
+        " FROM vendorpart WHERE vendorpart.part_id = part.id) "
+        "FROM part")
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    migrate_engine.execute("DROP TABLE IF EXISTS part_search_vocab")
+    migrate_engine.execute("DROP TABLE IF EXISTS part_search")
+    post_meta.tables['manufacturer'].drop()
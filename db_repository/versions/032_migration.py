@@ -0,0 +1,36 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+vendorpart = Table('vendorpart', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('json', String),
+    Column('vendor', String),
+    Column('vendor_part_number', String),
+    Column('fetch_timestamp', DateTime),
+    Column('price_breaks', PickleType),
+    Column('url', String),
+    Column('part_id', Integer),
+)
+ix_vendorpart_part_vendor_fetch = Index('ix_vendorpart_part_vendor_fetch',
+                                        vendorpart.c.part_id,
+                                        vendorpart.c.vendor,
+                                        vendorpart.c.fetch_timestamp)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    ix_vendorpart_part_vendor_fetch.create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    ix_vendorpart_part_vendor_fetch.drop()
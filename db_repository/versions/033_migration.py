@@ -0,0 +1,30 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+part = Table('part', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('short_description', String),
+    Column('manufacturer', String),
+    Column('image_url', String),
+    Column('image_hash', String),
+    Column('manufacturer_part_number', String),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['part'].columns['image_hash'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['part'].columns['image_hash'].drop()
@@ -0,0 +1,97 @@
+import json
+import zlib
+import hashlib
+
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+vendorpayload = Table('vendorpayload', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('sha256', String),
+    Column('codec', String),
+    Column('raw_size', Integer),
+    Column('data', LargeBinary),
+)
+ix_vendorpayload_sha256 = Index('ix_vendorpayload_sha256',
+                                vendorpayload.c.sha256, unique=True)
+
+vendorpart = Table('vendorpart', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('json', String),
+    Column('payload_id', Integer),
+    Column('vendor', String),
+    Column('vendor_part_number', String),
+    Column('fetch_timestamp', DateTime),
+    Column('price_breaks', PickleType),
+    Column('url', String),
+    Column('part_id', Integer),
+)
+ix_vendorpart_payload_id = Index('ix_vendorpart_payload_id',
+                                 vendorpart.c.payload_id)
+
+
+def _compress_existing(migrate_engine):
+    """ Move the uncompressed vendorpart.json into deduplicated payloads """
+    payload_ids = {}
+    conn = migrate_engine.connect()
+    with conn.begin():
+        rows = conn.execute(select([vendorpart.c.id, vendorpart.c.json]).
+                            where(vendorpart.c.json.isnot(None))).fetchall()
+        for vendorpart_id, text in rows:
+            try:
+                raw = json.dumps(json.loads(text), sort_keys=True,
+                                 separators=(',', ':')).encode('utf-8')
+            except ValueError:
+                continue
+            digest = hashlib.sha256(raw).hexdigest()
+            if digest not in payload_ids:
+                result = conn.execute(vendorpayload.insert().values(
+                    sha256=digest, codec='zlib', raw_size=len(raw),
+                    data=zlib.compress(raw, 9)))
+                payload_ids[digest] = result.inserted_primary_key[0]
+            conn.execute(vendorpart.update().
+                         where(vendorpart.c.id == vendorpart_id).
+                         values(payload_id=payload_ids[digest], json=None))
+
+
+def _decompress(data, codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['vendorpayload'].create()
+    post_meta.tables['vendorpart'].columns['payload_id'].create()
+    ix_vendorpart_payload_id.create()
+    _compress_existing(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    conn = migrate_engine.connect()
+    with conn.begin():
+        payloads = {row.id: row for row in
+                    conn.execute(select([vendorpayload])).fetchall()}
+        rows = conn.execute(select([vendorpart.c.id, vendorpart.c.payload_id]).
+                            where(vendorpart.c.payload_id.isnot(None)))
+        for vendorpart_id, payload_id in rows.fetchall():
+            payload = payloads[payload_id]
+            conn.execute(vendorpart.update().
+                         where(vendorpart.c.id == vendorpart_id).
+                         values(json=_decompress(payload.data, payload.codec).
+                                decode('utf-8')))
+    ix_vendorpart_payload_id.drop()
+    post_meta.tables['vendorpart'].columns['payload_id'].drop()
+    post_meta.tables['vendorpayload'].drop()
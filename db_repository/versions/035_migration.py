@@ -0,0 +1,93 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+vendorpart = Table('vendorpart', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('json', String),
+    Column('payload_id', Integer),
+    Column('vendor', String),
+    Column('vendor_part_number', String),
+    Column('fetch_timestamp', DateTime),
+    Column('last_seen', DateTime),
+    Column('price_breaks', PickleType),
+    Column('url', String),
+    Column('part_id', Integer),
+)
+pricehistory = Table('pricehistory', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('part_id', Integer),
+    Column('vendor', String),
+    Column('vendor_part_number', String),
+    Column('timestamp', DateTime),
+    Column('unit_price', Float),
+    Column('price_breaks', String),
+)
+ix_pricehistory_part_timestamp = Index('ix_pricehistory_part_timestamp',
+                                       pricehistory.c.part_id,
+                                       pricehistory.c.timestamp)
+
+
+def _format_price_breaks(price_breaks):
+    # frozen copy of VendorPart.format_price_breaks
+    return '~'.join('{}:{:04f}'.format(x['BreakQuantity'], x['UnitPrice'])
+                    for x in price_breaks)
+
+
+def _unit_price(price_breaks):
+    if not price_breaks:
+        return None
+    return min(price_breaks, key=lambda x: x['BreakQuantity'])['UnitPrice']
+
+
+def _backfill_price_history(migrate_engine):
+    """ One history row per price change in the existing VendorParts """
+    conn = migrate_engine.connect()
+    with conn.begin():
+        rows = conn.execute(
+            select([vendorpart.c.part_id, vendorpart.c.vendor,
+                    vendorpart.c.vendor_part_number,
+                    vendorpart.c.fetch_timestamp,
+                    vendorpart.c.price_breaks]).
+            where(vendorpart.c.price_breaks.isnot(None)).
+            order_by(vendorpart.c.vendor, vendorpart.c.vendor_part_number,
+                     vendorpart.c.fetch_timestamp))
+        entries = []
+        last_key, last_breaks = None, None
+        for row in rows:
+            key = (row.vendor, row.vendor_part_number)
+            if key == last_key and row.price_breaks == last_breaks:
+                continue
+            last_key, last_breaks = key, row.price_breaks
+            entries.append({'part_id': row.part_id,
+                            'vendor': row.vendor,
+                            'vendor_part_number': row.vendor_part_number,
+                            'timestamp': row.fetch_timestamp,
+                            'unit_price': _unit_price(row.price_breaks),
+                            'price_breaks':
+                                _format_price_breaks(row.price_breaks)})
+        if entries:
+            conn.execute(pricehistory.insert(), entries)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['vendorpart'].columns['last_seen'].create()
+    migrate_engine.execute(vendorpart.update().
+                           values(last_seen=vendorpart.c.fetch_timestamp))
+    post_meta.tables['pricehistory'].create()
+    _backfill_price_history(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['pricehistory'].drop()
+    post_meta.tables['vendorpart'].columns['last_seen'].drop()
@@ -0,0 +1,116 @@
+import json
+import zlib
+import hashlib
+from collections import defaultdict
+
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+billofmaterials = Table('billofmaterials', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', String),
+    Column('timestamp', DateTime),
+)
+bompart = Table('bompart', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('reference', String),
+    Column('lookup_source', String),
+    Column('lookup_id', String),
+    Column('bom_id', Integer),
+)
+bomrevision = Table('bomrevision', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('bom_id', Integer, unique=True),
+    Column('project', String),
+    Column('number', Integer),
+    Column('parent_id', Integer),
+    Column('depth', Integer),
+    Column('entries', Integer),
+    Column('digest', String),
+    Column('codec', String),
+    Column('data', LargeBinary),
+)
+ix_bomrevision_project_number = Index('ix_bomrevision_project_number',
+                                      bomrevision.c.project,
+                                      bomrevision.c.number)
+
+# frozen copy of the storage rules in app/revisions.py
+KEYFRAME_INTERVAL = 10
+
+
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+def _encode(snapshot, parent_snapshot, parent_depth):
+    content, depth = {'set': snapshot}, 0
+    if parent_snapshot is not None and parent_depth + 1 < KEYFRAME_INTERVAL:
+        changes = {'set': dict(snapshot.items() - parent_snapshot.items()),
+                   'removed': sorted(parent_snapshot.keys() -
+                                     snapshot.keys())}
+        if 2 * (len(changes['set']) + len(changes['removed'])) < \
+                len(snapshot):
+            content, depth = changes, parent_depth + 1
+    return {'depth': depth,
+            'entries': len(snapshot),
+            'digest': hashlib.sha256(
+                _dumps(snapshot).encode('utf-8')).hexdigest(),
+            'codec': 'zlib',
+            'data': zlib.compress(_dumps(content).encode('utf-8'))}
+
+
+def _backfill_revisions(migrate_engine):
+    """ Link the existing BOMs of each project (by name) as revisions, in
+    upload order
+    """
+    conn = migrate_engine.connect()
+    with conn.begin():
+        snapshots = defaultdict(dict)
+        for row in conn.execute(select([bompart.c.bom_id,
+                                        bompart.c.reference,
+                                        bompart.c.lookup_source,
+                                        bompart.c.lookup_id])):
+            snapshots[row.bom_id][row.reference] = (row.lookup_source,
+                                                    row.lookup_id)
+        boms = conn.execute(select([billofmaterials.c.id,
+                                    billofmaterials.c.name]).
+                            order_by(billofmaterials.c.timestamp,
+                                     billofmaterials.c.id)).fetchall()
+        latest = {}
+        for bom in boms:
+            project = bom.name or ''
+            parent = latest.get(project) if project else None
+            snapshot = snapshots.get(bom.id, {})
+            values = _encode(snapshot,
+                             parent['snapshot'] if parent else None,
+                             parent['depth'] if parent else 0)
+            values.update(bom_id=bom.id,
+                          project=project,
+                          number=parent['number'] + 1 if parent else 1,
+                          parent_id=parent['id'] if parent else None)
+            id_ = conn.execute(bomrevision.insert(), values).\
+                inserted_primary_key[0]
+            latest[project] = {'id': id_,
+                               'number': values['number'],
+                               'depth': values['depth'],
+                               'snapshot': snapshot}
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['bomrevision'].create()
+    _backfill_revisions(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['bomrevision'].drop()
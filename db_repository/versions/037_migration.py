@@ -0,0 +1,83 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+bompart = Table('bompart', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('bom_id', Integer),
+    Column('part_id', Integer),
+)
+order = Table('order', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('archived', Boolean),
+)
+order_vendorpart = Table('order_vendorpart', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('order_id', Integer),
+    Column('vendorpart_id', Integer),
+    Column('number_ordered', Integer),
+)
+vendorpart = Table('vendorpart', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('part_id', Integer),
+)
+partbomusage = Table('partbomusage', post_meta,
+    Column('part_id', Integer, primary_key=True, nullable=False),
+    Column('bom_id', Integer, primary_key=True, nullable=False),
+    Column('count', Integer),
+)
+partorderusage = Table('partorderusage', post_meta,
+    Column('part_id', Integer, primary_key=True, nullable=False),
+    Column('order_id', Integer, primary_key=True, nullable=False),
+    Column('lines', Integer),
+    Column('number_ordered', Integer),
+)
+ix_partbomusage_bom_id = Index('ix_partbomusage_bom_id',
+                               partbomusage.c.bom_id)
+ix_partorderusage_order_id = Index('ix_partorderusage_order_id',
+                                   partorderusage.c.order_id)
+
+
+def _backfill_usage(migrate_engine):
+    """ Fill the where-used index from the existing BOMs and open orders """
+    conn = migrate_engine.connect()
+    with conn.begin():
+        conn.execute(partbomusage.insert().from_select(
+            ['part_id', 'bom_id', 'count'],
+            select([bompart.c.part_id, bompart.c.bom_id, func.count()]).
+            where(bompart.c.part_id.isnot(None)).
+            where(bompart.c.bom_id.isnot(None)).
+            group_by(bompart.c.bom_id, bompart.c.part_id)))
+        conn.execute(partorderusage.insert().from_select(
+            ['part_id', 'order_id', 'lines', 'number_ordered'],
+            select([vendorpart.c.part_id, order_vendorpart.c.order_id,
+                    func.count(), func.sum(order_vendorpart.c.number_ordered)]).
+            select_from(order_vendorpart.
+                        join(vendorpart, order_vendorpart.c.vendorpart_id ==
+                             vendorpart.c.id).
+                        join(order, order_vendorpart.c.order_id ==
+                             order.c.id)).
+            where(order.c.archived == False).
+            where(vendorpart.c.part_id.isnot(None)).
+            group_by(order_vendorpart.c.order_id, vendorpart.c.part_id)))
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['partbomusage'].create()
+    post_meta.tables['partorderusage'].create()
+    _backfill_usage(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['partorderusage'].drop()
+    post_meta.tables['partbomusage'].drop()
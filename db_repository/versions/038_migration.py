@@ -0,0 +1,94 @@
+import json
+import zlib
+
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+bomrevision = Table('bomrevision', pre_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('bom_id', Integer, unique=True),
+    Column('project', String),
+    Column('number', Integer),
+    Column('parent_id', Integer),
+    Column('depth', Integer),
+    Column('entries', Integer),
+    Column('digest', String),
+    Column('codec', String),
+    Column('data', LargeBinary),
+)
+
+
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+def _compress(data, codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return zlib.compress(data, 9)
+
+
+def _decompress(data, codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _rewrite(migrate_engine, encode):
+    """ Store every revision's full snapshot, as encode(snapshot)
+
+    Revisions stored as deltas (depth > 0) are applied to their parent's
+    snapshot, parents having lower ids than their children.
+    """
+    conn = migrate_engine.connect()
+    with conn.begin():
+        rows = conn.execute(select([bomrevision.c.id,
+                                    bomrevision.c.parent_id,
+                                    bomrevision.c.depth,
+                                    bomrevision.c.codec,
+                                    bomrevision.c.data]).
+                            order_by(bomrevision.c.id)).fetchall()
+        snapshots = {}
+        for row in rows:
+            content = json.loads(_decompress(row.data, row.codec).
+                                 decode('utf-8'))
+            if 'set' not in content:
+                # already a plain snapshot
+                snapshot = content
+            elif row.depth:
+                snapshot = dict(snapshots[row.parent_id])
+                for reference in content['removed']:
+                    del snapshot[reference]
+                snapshot.update(content['set'])
+            else:
+                snapshot = content['set']
+            snapshots[row.id] = snapshot
+            conn.execute(bomrevision.update().
+                         where(bomrevision.c.id == row.id).
+                         values(depth=0, data=_compress(
+                             _dumps(encode(snapshot)).encode('utf-8'),
+                             row.codec)))
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    # revisions no longer store deltas against their parent
+    _rewrite(migrate_engine, lambda snapshot: snapshot)
+    pre_meta.tables['bomrevision'].columns['depth'].drop()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    pre_meta.tables['bomrevision'].columns['depth'].create()
+    _rewrite(migrate_engine, lambda snapshot: {'set': snapshot})
@@ -0,0 +1,119 @@
+import json
+import zlib
+
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+bomrevision = Table('bomrevision', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('bom_id', Integer, unique=True),
+    Column('project', String),
+    Column('number', Integer),
+    Column('parent_id', Integer),
+    Column('depth', Integer, default=0),
+    Column('entries', Integer),
+    Column('digest', String),
+    Column('codec', String),
+    Column('data', LargeBinary),
+)
+
+# frozen copy of the storage rules in app/revisions.py
+KEYFRAME_INTERVAL = 10
+
+
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+def _compress(data, codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return zlib.compress(data, 9)
+
+
+def _decompress(data, codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _encode(snapshot, parent_snapshot, parent_depth):
+    content, depth = {'set': snapshot}, 0
+    if parent_snapshot is not None and parent_depth + 1 < KEYFRAME_INTERVAL:
+        changes = {'set': dict(snapshot.items() - parent_snapshot.items()),
+                   'removed': sorted(parent_snapshot.keys() -
+                                     snapshot.keys())}
+        if 2 * (len(changes['set']) + len(changes['removed'])) < \
+                len(snapshot):
+            content, depth = changes, parent_depth + 1
+    return content, depth
+
+
+def _rewrite(migrate_engine, deltas):
+    """ Store every revision's snapshot as a delta against its parent's
+    where that pays off, or in full if not deltas
+
+    Reads both encodings, parents having lower ids than their children.
+    """
+    table = post_meta.tables['bomrevision']
+    conn = migrate_engine.connect()
+    with conn.begin():
+        rows = conn.execute(select([table.c.id,
+                                    table.c.parent_id,
+                                    table.c.depth,
+                                    table.c.codec,
+                                    table.c.data]).
+                            order_by(table.c.id)).fetchall()
+        snapshots, depths = {}, {}
+        for row in rows:
+            content = json.loads(_decompress(row.data, row.codec).
+                                 decode('utf-8'))
+            if 'set' not in content:
+                # a full snapshot, as stored since 038
+                snapshot = {}
+                content = {'set': content}
+            elif row.depth:
+                snapshot = dict(snapshots[row.parent_id])
+                for reference in content['removed']:
+                    del snapshot[reference]
+            else:
+                snapshot = {}
+            snapshot.update((reference, tuple(lookup))
+                            for reference, lookup in content['set'].items())
+            snapshots[row.id] = snapshot
+            if not deltas:
+                content, depth = snapshot, 0
+            elif row.parent_id in snapshots:
+                content, depth = _encode(snapshot, snapshots[row.parent_id],
+                                         depths[row.parent_id])
+            else:
+                content, depth = _encode(snapshot, None, 0)
+            depths[row.id] = depth
+            conn.execute(table.update().
+                         where(table.c.id == row.id).
+                         values(depth=depth, data=_compress(
+                             _dumps(content).encode('utf-8'), row.codec)))
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    # revisions are stored as deltas against their parent again
+    post_meta.tables['bomrevision'].columns['depth'].create()
+    _rewrite(migrate_engine, deltas=True)
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    _rewrite(migrate_engine, deltas=False)
+    post_meta.tables['bomrevision'].columns['depth'].drop()
@@ -0,0 +1,57 @@
+""" gunicorn configuration for running BOM-Manager in production
+
+usage: gunicorn -c gunicorn.conf.py wsgi:application
+
+A pre-fork server: the master process binds the socket and forks BOM_WORKERS
+worker processes, each importing the app and handling one request at a time
+(or BOM_THREADS at a time with threads > 1). Settings are read from the
+environment:
+
+    BOM_BIND            address to listen on, default 0.0.0.0:8443
+    BOM_WORKERS         worker processes, default 2 * cores + 1
+    BOM_THREADS         threads per worker, default 1
+    BOM_TIMEOUT         seconds before a silent worker is restarted, 120
+    BOM_MAX_REQUESTS    restart workers after this many requests, 1000
+    BOM_TLS             '1' (default) to serve HTTPS with BOM_CERTFILE and
+                        BOM_KEYFILE, '0' when TLS is terminated by a reverse
+                        proxy that sets X-Forwarded-Proto
+    BOM_CERTFILE        default config.SSL_CERT_FILE
+    BOM_KEYFILE         default config.SSL_KEY_FILE
+
+Graceful reload: `kill -HUP <master pid>` re-reads this file and starts new
+workers with freshly imported code, while the old workers finish their
+in-flight requests (up to graceful_timeout) before exiting. The app is not
+preloaded in the master so that reloads pick up new code and no database
+connections are shared across the fork.
+"""
+import os
+import multiprocessing
+
+import config as bom_config
+
+_tls = os.environ.get('BOM_TLS', '1') == '1'
+
+bind = os.environ.get('BOM_BIND', '0.0.0.0:8443')
+workers = int(os.environ.get('BOM_WORKERS',
+                             2 * multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get('BOM_THREADS', 1))
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.environ.get('BOM_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get('BOM_MAX_REQUESTS', 1000))
+# spread worker restarts so they don't all recycle at once
+max_requests_jitter = max_requests // 10
+preload_app = False
+
+if _tls:
+    certfile = os.environ.get('BOM_CERTFILE', bom_config.SSL_CERT_FILE)
+    keyfile = os.environ.get('BOM_KEYFILE', bom_config.SSL_KEY_FILE)
+else:
+    # trust X-Forwarded-Proto from the proxy, which SSLify checks
+    forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+accesslog = '-'
+errorlog = '-'
+loglevel = bom_config.LOG_LEVEL.lower()
+proc_name = 'bom-manager'
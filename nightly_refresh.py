@@ -0,0 +1,123 @@
+#!flask/bin/python3
+""" Nightly bulk price refresh
+
+Collects every vendor part used by a non-archived order or by a BOM uploaded
+in the last --recent-days days, refreshes the ones older than --max-age-hours
+with the async fetch engine, re-points all open order lines at the new
+VendorParts with a set-based UPDATE, and writes a JSON run report.
+
+usage: nightly_refresh.py --user EMAIL [--recent-days 30]
+                          [--max-age-hours 20] [--concurrency N]
+                          [--base-url URL] [--report PATH]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+
+from app import app, db
+from app.models import (User, BillOfMaterials, BOMPart, Order,
+                        Order_VendorPart, VendorPart)
+from app.vendor_fetch import (vendors, refresh_vendorparts,
+                              repoint_open_orders_bulk)
+
+
+def collect_keys(recent_days):
+    """ (vendor, vendor_part_number) of open orders and recent BOMs, of the
+    vendors with an API
+    """
+    order_keys = db.session.query(VendorPart.vendor,
+                                  VendorPart.vendor_part_number).\
+        join(Order_VendorPart,
+             Order_VendorPart.vendorpart_id == VendorPart.id).\
+        join(Order, Order_VendorPart.order_id == Order.id).\
+        filter(Order.archived == False).\
+        filter(VendorPart.vendor.in_(vendors)).\
+        distinct()
+    since = datetime.now() - timedelta(days=recent_days)
+    bom_keys = db.session.query(BOMPart.lookup_source, BOMPart.lookup_id).\
+        join(BillOfMaterials, BOMPart.bom_id == BillOfMaterials.id).\
+        filter(BillOfMaterials.timestamp >= since).\
+        filter(BOMPart.lookup_source.in_(vendors)).\
+        distinct()
+    order_keys = set(order_keys)
+    bom_keys = set(bom_keys)
+    return order_keys, bom_keys
+
+
+def run(user, recent_days, max_age, **kwargs):
+    report = {'started': datetime.now().isoformat(), 'timings_s': {}}
+    timings = report['timings_s']
+
+    start = time.perf_counter()
+    order_keys, bom_keys = collect_keys(recent_days)
+    keys = order_keys | bom_keys
+    timings['collect'] = time.perf_counter() - start
+    report['vendorparts'] = {'open_orders': len(order_keys),
+                             'recent_boms': len(bom_keys),
+                             'distinct': len(keys)}
+
+    credentials = {name: vendor.credentials(user)
+                   for name, vendor in vendors.items()}
+    start = time.perf_counter()
+    latest, fetched, errors, stats = refresh_vendorparts(
+        keys, credentials, max_age=max_age, **kwargs)
+    timings['fetch'] = time.perf_counter() - start
+    report['vendorparts']['refreshed'] = len(fetched)
+    report['vendorparts']['failed'] = len(errors)
+    report['api_calls'] = {
+        'lookups': sum(s.requests for s in stats),
+        'retries': sum(s.retries for s in stats),
+        'failures': sum(s.failures for s in stats),
+        'token_refreshes': {name: vendor.tokens.stats()
+                            for name, vendor in vendors.items()}}
+
+    start = time.perf_counter()
+    report['order_lines_repointed'] = repoint_open_orders_bulk(
+        {key: latest[key] for key in fetched})
+    db.session.commit()
+    timings['repoint'] = time.perf_counter() - start
+
+    report['errors'] = errors
+    report['finished'] = datetime.now().isoformat()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--user', required=True,
+                        help='email of the user whose vendor tokens are used')
+    parser.add_argument('--recent-days', type=int, default=30)
+    parser.add_argument('--max-age-hours', type=float, default=20)
+    parser.add_argument('--concurrency', type=int, default=None)
+    parser.add_argument('--base-url', default=None,
+                        help='vendor API base url, eg. of a stub server')
+    parser.add_argument('--report', default=None,
+                        help='report file, defaults to '
+                             'reports/nightly_refresh_<timestamp>.json')
+    args = parser.parse_args()
+
+    user = User.query.filter(User.email == args.user).first()
+    if user is None:
+        sys.exit('No user with email {}'.format(args.user))
+    report = run(user, args.recent_days,
+                 timedelta(hours=args.max_age_hours),
+                 concurrency=args.concurrency, base_url=args.base_url)
+
+    path = args.report
+    if path is None:
+        report_dir = app.config['REPORT_DIR']
+        os.makedirs(report_dir, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(report_dir,
+                            'nightly_refresh_{}.json'.format(stamp))
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Report written to {}'.format(path))
+    sys.exit(1 if report['errors'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!flask/bin/python3
+""" Refresh vendor part information outside of the web server
+
+Looks up every outdated vendor part of the selected BOMs concurrently with
+the async fetch engine, using the stored vendor tokens of the given user.
+
+usage: refresh_parts.py --user EMAIL (--all-boms | --bom ID [--bom ID ...])
+                        [--concurrency N] [--base-url URL]
+"""
+import sys
+import json
+import argparse
+
+from app import db
+from app.models import User, BillOfMaterials, BOMPart
+from app.vendor_fetch import vendors, refresh_bomparts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--user', required=True,
+                        help='email of the user whose vendor tokens are used')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--all-boms', action='store_true')
+    group.add_argument('--bom', type=int, action='append', dest='boms')
+    parser.add_argument('--concurrency', type=int, default=None)
+    parser.add_argument('--base-url', default=None,
+                        help='vendor API base url, eg. of a stub server')
+    args = parser.parse_args()
+
+    user = User.query.filter(User.email == args.user).first()
+    if user is None:
+        sys.exit('No user with email {}'.format(args.user))
+    credentials = {name: vendor.credentials(user)
+                   for name, vendor in vendors.items()}
+
+    query = BOMPart.query
+    if not args.all_boms:
+        query = query.filter(BOMPart.bom_id.in_(args.boms))
+    errors, stats = refresh_bomparts(query.all(), credentials,
+                                     concurrency=args.concurrency,
+                                     base_url=args.base_url)
+    if not args.all_boms:
+        boms = BillOfMaterials.query.filter(BillOfMaterials.id.in_(args.boms))
+    else:
+        boms = BillOfMaterials.query
+    for bom in boms:
+        bom.content_version = (bom.content_version or 0) + 1
+    db.session.commit()
+
+    for error in errors:
+        print(error, file=sys.stderr)
+    print(json.dumps({'errors': len(errors),
+                      'fetch': [s.to_dict() for s in stats]}))
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
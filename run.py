@@ -1,8 +1,9 @@
 #!flask/bin/python3
 import webbrowser
-from app import app, context
+from app import create_app, ssl_context
+app = create_app()
 webbrowser.open_new_tab("https://localhost:8080/")
 app.run(port=8080,
         debug=True,
         use_reloader=True,
-        ssl_context=context)
+        ssl_context=ssl_context())